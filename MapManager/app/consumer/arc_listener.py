@@ -0,0 +1,98 @@
+import json
+import select
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from MapViewer.app.config.settings import DATABASE_CONFIG
+from MapManager.app.config.logging import setup_logging
+from MapManager.app.config.settings import RABBITMQ_CONFIG
+from MapManager.app.services.arc_updater import apply_disabled_arcs
+from NotificationCenter.app.services.rabbitmq_handler import RabbitMQHandler
+
+logger = setup_logging("arc_listener", "MapManager/logs/arcListener.log")
+
+ARC_DISABLED_CHANNEL = "arc_disabled"
+
+
+class ArcDisabledListener:
+    """
+    LISTEN su 'arc_disabled' (pg_notify inviato da MapViewer /api/disable-edge):
+    ogni arco disattivato viene applicato in memoria e i percorsi interessati riparati.
+
+    Usa una connessione dedicata (fuori dal pool: resta in LISTEN per tutta la vita del processo).
+    A ogni (ri)connessione allinea lo stato leggendo gli archi inattivi, così le notifiche
+    perse durante una disconnessione non lasciano percorsi su archi rotti.
+
+    Dopo una riparazione pubblica 'paths_ready' con un proprio RabbitMQHandler, creato nel
+    thread del listener (pika non è thread-safe: non condivide quello dei consumer).
+    """
+
+    def __init__(self, poll_timeout: float = 5.0, reconnect_delay: float = 3.0):
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._running = True
+        self._rabbit = None
+
+    def _rabbitmq(self):
+        if self._rabbit is None:
+            try:
+                self._rabbit = RabbitMQHandler(
+                    host=RABBITMQ_CONFIG["host"],
+                    port=RABBITMQ_CONFIG["port"],
+                    username=RABBITMQ_CONFIG["username"],
+                    password=RABBITMQ_CONFIG["password"]
+                )
+            except Exception as e:
+                logger.error(f"RabbitMQ non disponibile, paths_ready non verrà pubblicato: {e}")
+        return self._rabbit
+
+    def _connect(self):
+        conn = psycopg2.connect(**DATABASE_CONFIG)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {ARC_DISABLED_CHANNEL};")
+            cur.execute("SELECT arc_id FROM arcs WHERE active = FALSE")
+            inactive = [r[0] for r in cur.fetchall()]
+        logger.info(f"In ascolto su '{ARC_DISABLED_CHANNEL}' ({len(inactive)} archi già inattivi)")
+        if inactive:
+            apply_disabled_arcs(inactive, self._rabbitmq())
+        return conn
+
+    @staticmethod
+    def _arc_ids(payload: str):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = payload
+        if isinstance(data, dict):
+            data = data.get("arc_ids", data.get("arc_id"))
+        if not isinstance(data, list):
+            data = [data]
+        return [int(a) for a in data if a is not None]
+
+    def run(self):
+        while self._running:
+            conn = None
+            try:
+                conn = self._connect()
+                while self._running:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    arc_ids = []
+                    while conn.notifies:
+                        arc_ids.extend(self._arc_ids(conn.notifies.pop(0).payload))
+                    if arc_ids:
+                        apply_disabled_arcs(arc_ids, self._rabbitmq())
+            except Exception as e:
+                logger.error(f"Errore nel listener '{ARC_DISABLED_CHANNEL}': {e}", exc_info=True)
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try: conn.close()
+                    except Exception: pass
+
+    def stop(self):
+        self._running = False
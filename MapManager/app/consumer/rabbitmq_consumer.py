@@ -1,10 +1,9 @@
 from typing import Dict, Any, List, Optional
-import psycopg2
 
-from MapViewer.app.config.settings import DATABASE_CONFIG
-from MapManager.app.core.manager import handle_evacuations
+from MapManager.app.core.manager import handle_evacuations, handle_flow_evacuations
+from MapManager.app.services.db_pool import get_connection
 from MapManager.app.config.logging import setup_logging
-from MapManager.app.config.settings import EVENT_TTL_SECONDS, MAP_MANAGER_QUEUE
+from MapManager.app.config.settings import EVENT_TTL_SECONDS, MAP_MANAGER_QUEUE, PATHFINDING_CONFIG
 from MapManager.app.core.event_state import EventState
 
 from NotificationCenter.app.services.rabbitmq_handler import RabbitMQHandler
@@ -12,10 +11,22 @@ from NotificationCenter.app.services.rabbitmq_handler import RabbitMQHandler
 logger = setup_logging("evacuation_consumer", "MapManager/logs/evacuationConsumer.log")
 
 class EvacuationConsumer:
+    """
+    PositionManager pubblica su MAP_MANAGER_QUEUE:
+      - "snapshot": tutti i nodi in pericolo -> sostituisce lo stato locale
+      - "delta": solo i nodi cambiati ("dangerous_nodes") e quelli tornati sicuri ("cleared_nodes")
+    con un numero di sequenza "seq". Con un delta si ricalcolano solo i nodi cambiati; se manca
+    una sequenza (messaggio perso) o cambia l'evento si ricalcola tutto lo stato noto.
+    I messaggi senza "msg_type" (formato precedente) sono trattati come snapshot.
+    """
     def __init__(self, rabbitmq_handler: RabbitMQHandler, event_state: EventState):
         self.rabbit = rabbitmq_handler
         self.event_state = event_state
-        logger.info("EvacuationConsumer inizializzato.")
+        self.routing_mode = (PATHFINDING_CONFIG.get("routing_mode") or "shortest").lower()
+        self.dangerous_nodes: Dict[int, List[int]] = {}   # node_id -> user_ids in pericolo
+        self.last_seq: Optional[int] = None
+        self.last_event: Optional[str] = None
+        logger.info(f"EvacuationConsumer inizializzato (routing_mode={self.routing_mode}).")
 
     def start_consuming(self):
         self.rabbit.consume_messages(
@@ -27,10 +38,10 @@ class EvacuationConsumer:
     def process_message(self, message: Dict[str, Any]):
         try:
             logger.info(f"Ricevuto payload: {message}")
-            
-            dangerous_nodes = message.get("dangerous_nodes") or []
-            if not dangerous_nodes:
-                logger.warning("Nessun nodo pericoloso nel messaggio.")
+
+            to_route = self._apply_update(message)
+            if not to_route:
+                logger.info("Nessun nodo pericoloso da ricalcolare.")
                 return
 
             payload_event = (message.get("event") or "").strip() or None
@@ -51,19 +62,29 @@ class EvacuationConsumer:
                 else:
                     logger.warning("Né payload_event né global_event valido/fresco. Ignoro il batch.")
                     return
-    
+
+            if event_type != self.last_event:
+                # nuovo evento: cambiano le uscite, vanno ricalcolati tutti i nodi noti
+                to_route = list(self.dangerous_nodes)
+                self.last_event = event_type
+
             floor_groups: Dict[int, List[int]] = {}
-            for entry in dangerous_nodes:
-                node_id = entry.get("node_id")
-                if node_id is None:
-                    continue
+            for node_id in to_route:
                 for floor in self._get_node_floors(node_id) or []:
                     floor_groups.setdefault(floor, []).append(node_id)
+            # la capacità è condivisa: la domanda è quella di tutti i nodi in pericolo, non solo del delta
+            demands: Dict[int, int] = {
+                node_id: len(user_ids) or 1 for node_id, user_ids in self.dangerous_nodes.items()
+            }
 
             if not floor_groups:
                 logger.warning("Nessun piano da processare.")
                 return
 
+            if self.routing_mode == "capacity":
+                handle_flow_evacuations(floor_groups, demands, event_type, rabbitmq_handler=self.rabbit)
+                return
+
             for floor, group in floor_groups.items():
                 handle_evacuations(floor, group, event_type, rabbitmq_handler=self.rabbit)
 
@@ -71,14 +92,43 @@ class EvacuationConsumer:
             logger.error(f"Errore processando MAP_MANAGER_QUEUE: {e}", exc_info=True)
             raise
 
+    def _apply_update(self, message: Dict[str, Any]) -> List[int]:
+        """
+        Aggiorna self.dangerous_nodes con uno snapshot o un delta e ritorna i nodi da ricalcolare.
+        """
+        msg_type = message.get("msg_type") or "snapshot"
+        seq = message.get("seq")
+        entries = {
+            entry["node_id"]: entry.get("user_ids") or []
+            for entry in message.get("dangerous_nodes") or []
+            if entry.get("node_id") is not None
+        }
+
+        if msg_type == "snapshot":
+            self.dangerous_nodes = entries
+            self.last_seq = seq
+            return list(entries)
+
+        gap = self.last_seq is not None and seq is not None and seq != self.last_seq + 1
+        for node_id in message.get("cleared_nodes") or []:
+            self.dangerous_nodes.pop(node_id, None)
+        self.dangerous_nodes.update(entries)
+        if seq is not None:
+            self.last_seq = seq
+
+        if gap:
+            logger.warning(
+                f"Sequenza MAP_MANAGER_QUEUE interrotta (seq={seq}): ricalcolo tutti i "
+                f"{len(self.dangerous_nodes)} nodi noti in attesa del prossimo snapshot."
+            )
+            return list(self.dangerous_nodes)
+        return list(entries)
+
     def _get_node_floors(self, node_id: int) -> Optional[List[int]]:
         try:
-            conn = psycopg2.connect(**DATABASE_CONFIG)
-            cur = conn.cursor()
-            cur.execute("SELECT floor_level FROM nodes WHERE node_id = %s", (node_id,))
-            row = cur.fetchone()
-            cur.close()
-            conn.close()
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT floor_level FROM nodes WHERE node_id = %s", (node_id,))
+                row = cur.fetchone()
             if not row:
                 return None
             floors = row[0]
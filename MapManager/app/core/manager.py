@@ -1,19 +1,22 @@
-from typing import List, Set, Dict, Tuple
-from collections import deque
-import psycopg2, yaml
+from typing import FrozenSet, List, Optional, Set, Dict, Tuple
+from threading import Lock
+import time
+import yaml
 
-from MapViewer.app.config.settings import DATABASE_CONFIG
 from MapViewer.app.services.graph_manager import graph_manager
 
 from MapManager.app.config.logging import setup_logging
-from MapManager.app.services.db_reader import get_arc_final_node
-from MapManager.app.services.path_calculator import find_shortest_path_to_exit
-from MapManager.app.services.db_writer import update_node_evacuation_path
+from MapManager.app.services.db_pool import get_connection
+from MapManager.app.services.path_calculator import (
+    compute_evacuation_routes, release_tree_routes, repair_evacuation_routes
+)
+from MapManager.app.services.flow_router import assign_flow_routes, primary_route
+from MapManager.app.services.db_writer import bulk_update_node_evacuation_paths
+from MapManager.app.services.floor_index import floor_index
+from MapManager.app.core.path_table import path_table
 from MapManager.app.services.publisher import publish_paths_ready
 from MapManager.app.config.settings import ACK_EVACUATION_QUEUE, ALERTS_CONFIG_PATH, PATHFINDING_CONFIG
 
-from MapManager.app.services.db_reader import get_interfloor_stair_arcs, get_node_attributes
-
 logger = setup_logging("evacuation_manager", "MapManager/logs/evacuationManager.log")
 
 try:
@@ -24,6 +27,13 @@ except Exception as e:
     logger.error(f"Cannot load emergency config at {ALERTS_CONFIG_PATH}: {e}")
     emergency_config = {"emergencies": {}}
 
+# routing "capacity": node_id -> (richiesta che ha prodotto il suo percorso, archi usati dai suoi percorsi).
+# Questi nodi non stanno negli alberi dei cammini minimi: se un arco disattivato li tocca
+# la riparazione rifà l'assegnazione completa con la stessa richiesta (floor_groups, demands, event_type).
+FlowRequest = Tuple[Dict[int, List[int]], Dict[int, int], str]
+_flow_routed: Dict[int, Tuple[FlowRequest, FrozenSet[int]]] = {}
+_flow_lock = Lock()
+
 def get_safe_nodes_for_event(G, event_type: str) -> List[int]:
     emergencies = emergency_config.get("emergencies", {})
     rule = (emergencies or {}).get(event_type, {})
@@ -68,41 +78,9 @@ def get_safe_nodes_for_event(G, event_type: str) -> List[int]:
 
 def collect_reachable_floors(start_floor: int) -> Set[int]:
     """
-    Scopre i piani raggiungibili dal piano di partenza **seguendo gli archi scale inter-piano**.
+    Scopre i piani raggiungibili dal piano di partenza **seguendo gli archi scale inter-piano attivi**.
     """
-    inter = get_interfloor_stair_arcs()
-    if not inter:
-        return {int(start_floor)}
-
-    node_ids = {e["initial_node_id"] for e in inter} | {e["final_node_id"] for e in inter}
-    attrs = get_node_attributes(list(node_ids))
-
-    # costruisci adiacenze tra piani
-    edges_floor: List[Tuple[int, int]] = []
-    for e in inter:
-        n1 = attrs.get(e["initial_node_id"]); n2 = attrs.get(e["final_node_id"])
-        if not n1 or not n2:
-            continue
-        for f1 in n1["floor_level"]:
-            for f2 in n2["floor_level"]:
-                if f1 != f2:
-                    edges_floor.append((int(f1), int(f2)))
-
-    # BFS sui piani
-    visited: Set[int] = set()
-    q: deque[int] = deque([int(start_floor)])
-    while q:
-        fl = q.popleft()
-        if fl in visited:
-            continue
-        visited.add(fl)
-        for a, b in edges_floor:
-            if a == fl and b not in visited:
-                q.append(b)
-            elif b == fl and a not in visited:
-                q.append(a)
-
-    return visited
+    return floor_index.reachable_floors([start_floor])
 
 
 def collect_safe_nodes_multi_floor(start_floor: int, event_type: str) -> List[int]:
@@ -151,11 +129,15 @@ def initialize_evacuation_paths(floor_level: int):
             logger.info("Nessun default_exit_node_types configurato: init saltata.")
             return
 
+        # percorsi da salvare: scritti tutti insieme a fine calcolo
+        # node_id -> (arc_ids, nodo terminale)
+        updates: Dict[int, Tuple[List[int], int]] = {}
+
         # 1) outdoor stessi = evacuation_path vuoto
         zeroed = 0
         for nid, d in G.nodes(data=True):
             if d.get("node_type") in exit_types:
-                update_node_evacuation_path(nid, [])
+                updates[nid] = ([], nid)
                 zeroed += 1
 
         # 2) target multi-piano (outdoor raggiungibili via scale)
@@ -171,20 +153,23 @@ def initialize_evacuation_paths(floor_level: int):
                 )
             else:
                 logger.warning(f"Nessun target (outdoor) disponibile per floor={floor_level}")
+                _save_routes(updates)
                 return
 
-        # 3) calcolo percorsi per tutti i non-outdoor
+        # 3) calcolo percorsi per tutti i non-outdoor (una sola passata multi-sorgente)
+        sources = [nid for nid, d in G.nodes(data=True) if d.get("node_type") not in exit_types]
+        routes = compute_evacuation_routes(G, default_targets, sources)
         computed = 0
-        for nid, d in G.nodes(data=True):
-            if d.get("node_type") in exit_types:
-                continue
-            path = find_shortest_path_to_exit(G, nid, default_targets)
-            if path is not None:
-                update_node_evacuation_path(nid, path)
+        for nid in sources:
+            route = routes.get(nid)
+            if route is not None:
+                updates[nid] = route
                 computed += 1
             else:
                 logger.warning(f"[init] Nessun path di default per nodo {nid} (piano {floor_level})")
 
+        _save_routes(updates)
+
         logger.info(
             f"Init su piano {floor_level}: azzerati target={zeroed}, "
             f"percorsi calcolati={computed} verso default_targets={default_targets}"
@@ -193,13 +178,27 @@ def initialize_evacuation_paths(floor_level: int):
     except Exception as e:
         logger.error(f"Errore initialize_evacuation_paths: {e}", exc_info=True)
 
+def _save_routes(
+    updates: Dict[int, Tuple[List[int], int]],
+    event_type: Optional[str] = None,
+    splits: Optional[Dict[int, List[Dict]]] = None
+) -> None:
+    """
+    Scrive i percorsi con un solo UPDATE e, solo se la scrittura riesce,
+    aggiorna la tabella in memoria (path_table).
+    """
+    bulk_update_node_evacuation_paths(((nid, path) for nid, (path, _t) in updates.items()), splits)
+    path_table.record(updates.items(), event_type, splits)
+    # il percorso appena scritto sostituisce un'eventuale assegnazione "capacity"
+    with _flow_lock:
+        for nid in updates:
+            _flow_routed.pop(nid, None)
+
 def get_saved_evacuation_path(node_id: int) -> List[int]:
     try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cur = conn.cursor()
-        cur.execute("SELECT evacuation_path FROM nodes WHERE node_id = %s", (node_id,))
-        row = cur.fetchone()
-        cur.close(); conn.close()
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT evacuation_path FROM nodes WHERE node_id = %s", (node_id,))
+            row = cur.fetchone()
         return row[0] if row and row[0] else []
     except Exception as e:
         logger.error(f"Errore leggendo evacuation_path per nodo {node_id}: {e}")
@@ -282,8 +281,8 @@ def handle_evacuations(floor_level: int, alert_nodes: List[int], event_type: str
         safe_nodes_set = set(safe_nodes)
 
         # 2) Azzera SOLO i target correnti (NON gli outdoor in generale)
-        for t in safe_nodes:
-            update_node_evacuation_path(t, [])
+        #    (tutte le scritture del ricalcolo partono in un unico UPDATE a fine calcolo)
+        updates: Dict[int, Tuple[List[int], int]] = {t: ([], t) for t in safe_nodes}
 
         paths_by_node: Dict[int, List[int]] = {}
 
@@ -291,23 +290,27 @@ def handle_evacuations(floor_level: int, alert_nodes: List[int], event_type: str
         #    (NON filtrare per default_exit_node_types: gli OUTDOOR vanno inclusi!)
         sources = [n for n in alert_nodes if n not in safe_nodes_set]
 
+        to_compute: List[int] = []
         for source in sources:
-            # opzionale: se il path salvato già termina in un target, salta
-            saved = get_saved_evacuation_path(source)
-            if saved:
-                last_arc = saved[-1]
-                final_node = get_arc_final_node(last_arc)
-                if final_node is not None and final_node in safe_nodes_set:
-                    logger.info(f"Nodo {source} ha già un path verso un target. Skip.")
-                    continue
-
-            path = find_shortest_path_to_exit(G, source, safe_nodes)
-            if path is None:
+            # se il path salvato già termina in un target, salta (lookup in memoria)
+            if path_table.has_path_to(source, safe_nodes_set):
+                logger.info(f"Nodo {source} ha già un path verso un target. Skip.")
+                continue
+            to_compute.append(source)
+
+        # 4) un solo shortest-path tree dai target copre tutte le sorgenti rimaste
+        computed_routes = compute_evacuation_routes(G, safe_nodes, to_compute) if to_compute else {}
+
+        for source in to_compute:
+            route = computed_routes.get(source)
+            if route is None:
                 logger.warning(f"Nessun path di evacuazione per nodo {source}")
                 continue
 
-            update_node_evacuation_path(source, path)
-            paths_by_node[source] = path
+            updates[source] = route
+            paths_by_node[source] = route[0]
+
+        _save_routes(updates, event_type)
 
         # (invio ACK ecc..)
         if rabbitmq_handler:
@@ -320,3 +323,186 @@ def handle_evacuations(floor_level: int, alert_nodes: List[int], event_type: str
     except Exception as e:
         logger.error(f"Errore in handle_evacuations: {e}", exc_info=True)
         raise
+
+
+def handle_flow_evacuations(
+    floor_groups: Dict[int, List[int]], demands: Dict[int, int], event_type: str, rabbitmq_handler=None
+):
+    """
+    Routing "capacity": gli utenti dei nodi in pericolo (demands: node_id -> numero di utenti)
+    vengono ripartiti su più percorsi in base a capacità e tempi degli archi, considerando
+    insieme tutti i piani del batch (scale e uscite sono condivise tra i piani).
+
+    In nodes.evacuation_path va il percorso con più utenti, in nodes.evacuation_path_splits
+    la ripartizione completa. Qui non si salta nessun nodo: la congestione dipende
+    dalla domanda di tutti.
+    """
+    try:
+        logger.info(f"handle_flow_evacuations: floors={sorted(floor_groups)}, event={event_type}, demands={demands}")
+        if not floor_groups:
+            return
+
+        safe_nodes: List[int] = []
+        for floor in floor_groups:
+            for t in collect_safe_nodes_multi_floor(floor, event_type):
+                if t not in safe_nodes:
+                    safe_nodes.append(t)
+        if not safe_nodes:
+            logger.warning(f"Nessun nodo target raggiungibile per event={event_type} dai piani {sorted(floor_groups)}")
+            return
+        safe_nodes_set = set(safe_nodes)
+
+        updates: Dict[int, Tuple[List[int], int]] = {t: ([], t) for t in safe_nodes}
+        splits: Dict[int, List[Dict]] = {}
+
+        sources = {n for group in floor_groups.values() for n in group if n not in safe_nodes_set}
+        source_demands = {n: demands.get(n, 1) for n in sources}
+
+        flow_routes = assign_flow_routes(floor_groups.keys(), safe_nodes, source_demands) if sources else {}
+
+        for source in sources:
+            route = primary_route(flow_routes.get(source))
+            if route is None:
+                logger.warning(f"Nessun path di evacuazione per nodo {source}")
+                continue
+            updates[source] = route
+            if len(flow_routes[source]) > 1:
+                splits[int(source)] = [
+                    {"evacuation_path": arc_ids, "users": count}
+                    for arc_ids, count, _terminal in flow_routes[source]
+                ]
+
+        _save_routes(updates, event_type, splits)
+
+        # i nodi instradati qui non vanno più riparati dagli alberi (che li riporterebbero
+        # al percorso più breve): un arco disattivato sui loro percorsi rifà questa assegnazione
+        routed = [n for n in sources if n in updates]
+        release_tree_routes(routed)
+        request: FlowRequest = (dict(floor_groups), dict(demands), event_type)
+        with _flow_lock:
+            for n in routed:
+                used = {a for arc_ids, _count, _terminal in flow_routes[n] for a in arc_ids}
+                _flow_routed[n] = (request, frozenset(used))
+
+        if rabbitmq_handler:
+            try:
+                publish_paths_ready(rabbitmq_handler)
+                logger.info(f"Inviato 'paths_ready' su {ACK_EVACUATION_QUEUE}")
+            except Exception as e:
+                logger.error(f"Errore pubblicando paths_ready: {e}")
+
+    except Exception as e:
+        logger.error(f"Errore in handle_flow_evacuations: {e}", exc_info=True)
+        raise
+
+
+def repair_evacuation_paths(arc_ids: List[int], rabbitmq_handler=None) -> int:
+    """
+    Archi appena disattivati: ripara in memoria gli alberi dei cammini minimi e
+    riscrive solo i nodi il cui percorso passava da quegli archi (nessun ricalcolo completo).
+    I nodi rimasti senza percorso nell'albero riparato passano a un ricalcolo completo
+    (target e sovraffollamento aggiornati); se neanche quello trova un percorso il nodo esce
+    da path_table, così il prossimo handle_evacuations lo ricalcola invece di saltarlo.
+    Se qualche percorso è stato riscritto pubblica 'paths_ready', come il ricalcolo completo.
+    I nodi instradati dal routing "capacity" non stanno negli alberi: per loro si ripete
+    l'assegnazione completa (handle_flow_evacuations) con l'ultima richiesta che li ha coinvolti.
+    Ritorna il numero di percorsi riscritti.
+    """
+    if not arc_ids:
+        return 0
+    t0 = time.perf_counter()
+    try:
+        # da qui in poi un percorso salvato che usa questi archi non vale come "già calcolato"
+        path_table.disable_arcs(arc_ids)
+        flow_rerouted = _repair_flow_routes(arc_ids, rabbitmq_handler)
+        routes = repair_evacuation_routes(arc_ids)
+        repair_ms = (time.perf_counter() - t0) * 1000.0
+
+        updates: Dict[int, Tuple[List[int], int]] = {
+            node_id: route for node_id, route in routes.items() if route is not None
+        }
+        unreachable = [node_id for node_id, route in routes.items() if route is None]
+        if unreachable:
+            updates.update(_recompute_routes(unreachable))
+            lost = [node_id for node_id in unreachable if node_id not in updates]
+            if lost:
+                path_table.discard(lost)
+                logger.warning(
+                    f"[repair] Nodi {lost} senza percorso dopo la disattivazione di {arc_ids}: "
+                    f"verranno ricalcolati al prossimo handle_evacuations"
+                )
+
+        if updates:
+            # la ripartizione salvata resta solo se nessuno dei suoi percorsi usa archi disattivati
+            splits = {}
+            for node_id in updates:
+                kept = path_table.usable_splits(node_id)
+                if kept:
+                    splits[int(node_id)] = kept
+            bulk_update_node_evacuation_paths(((nid, path) for nid, (path, _t) in updates.items()), splits)
+            # ogni nodo mantiene l'evento per cui era stato calcolato
+            for node_id, route in updates.items():
+                entry = path_table.get(node_id)
+                path_table.record([(node_id, route)], entry.event if entry else None, splits)
+
+            if rabbitmq_handler:
+                try:
+                    publish_paths_ready(rabbitmq_handler)
+                    logger.info(f"[repair] Inviato 'paths_ready' su {ACK_EVACUATION_QUEUE}")
+                except Exception as e:
+                    logger.error(f"[repair] Errore pubblicando paths_ready: {e}")
+
+        logger.info(
+            f"[repair] archi={arc_ids}: {len(routes)} nodi toccati, {len(updates)} percorsi riscritti, "
+            f"{flow_rerouted} nodi riassegnati (capacity) "
+            f"(riparazione {repair_ms:.2f} ms, totale {(time.perf_counter() - t0) * 1000.0:.2f} ms)"
+        )
+        return len(updates) + flow_rerouted
+    except Exception as e:
+        logger.error(f"Errore in repair_evacuation_paths: {e}", exc_info=True)
+        return 0
+
+
+def _recompute_routes(node_ids: List[int]) -> Dict[int, Tuple[List[int], int]]:
+    """
+    Ricalcolo completo per i nodi che la riparazione ha lasciato senza percorso:
+    un nuovo albero per (piano, evento) verso i target attuali dell'evento per cui
+    il nodo era stato calcolato (target di default se non c'era evento).
+    """
+    groups: Dict[Tuple[int, Optional[str]], List[int]] = {}
+    pending = set(node_ids)
+    with graph_manager.lock:
+        floor_graphs = sorted(graph_manager.graphs.items())
+    for floor, G in floor_graphs:
+        for node_id in [n for n in pending if n in G]:
+            entry = path_table.get(node_id)
+            groups.setdefault((floor, entry.event if entry else None), []).append(node_id)
+            pending.discard(node_id)
+
+    routes: Dict[int, Tuple[List[int], int]] = {}
+    for (floor, event), nodes in groups.items():
+        targets = collect_safe_nodes_multi_floor(floor, event) if event else _collect_default_exits_multi_floor(floor)
+        if targets:
+            routes.update(compute_evacuation_routes(graph_manager.get_graph(floor), targets, nodes))
+    return routes
+
+
+def _repair_flow_routes(arc_ids: List[int], rabbitmq_handler=None) -> int:
+    """
+    Ripete le assegnazioni "capacity" i cui percorsi usano uno degli archi disattivati.
+    Ritorna il numero di nodi toccati.
+    """
+    broken = {int(a) for a in arc_ids}
+    requests: Dict[int, FlowRequest] = {}
+    touched = 0
+    with _flow_lock:
+        for _nid, (request, used) in _flow_routed.items():
+            if used & broken:
+                requests[id(request)] = request
+                touched += 1
+    for floor_groups, demands, event_type in requests.values():
+        try:
+            handle_flow_evacuations(floor_groups, demands, event_type, rabbitmq_handler)
+        except Exception as e:
+            logger.error(f"[repair] Riassegnazione capacity fallita per piani {sorted(floor_groups)}: {e}")
+    return touched
@@ -0,0 +1,95 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from threading import RLock
+
+from MapManager.app.config.logging import setup_logging
+
+logger = setup_logging("path_table", "MapManager/logs/pathTable.log")
+
+
+class PathEntry(NamedTuple):
+    path: List[int]          # arc_id ordinati (vuoto = il nodo è esso stesso un target)
+    terminal: int            # nodo in cui termina il percorso
+    event: Optional[str]     # evento per cui è stato calcolato (None = target di default)
+    splits: Optional[List[Dict]] = None  # ripartizione "capacity" salvata in evacuation_path_splits
+
+
+class EvacuationPathTable:
+    """
+    Copia in memoria di nodes.evacuation_path: node_id -> (path, nodo terminale, evento, splits).
+
+    È popolata da initialize_evacuation_paths e aggiornata dopo ogni scrittura su DB,
+    così il controllo "il nodo ha già un percorso verso un target corrente"
+    di handle_evacuations è una lookup invece di due query per nodo.
+    Tiene anche gli archi disattivati: un percorso che ne usa uno non conta come valido.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self._entries: Dict[int, PathEntry] = {}
+        self._disabled: Set[int] = set()
+
+    def record(
+        self, routes: Iterable[Tuple[int, Tuple[List[int], int]]], event: Optional[str] = None,
+        splits: Optional[Dict[int, List[Dict]]] = None
+    ) -> None:
+        """
+        Registra i percorsi appena salvati su DB: (node_id, (arc_ids, terminale)).
+        Da chiamare solo dopo che la scrittura è andata a buon fine.
+        """
+        splits = splits or {}
+        with self.lock:
+            for node_id, (path, terminal) in routes:
+                node_id = int(node_id)
+                self._entries[node_id] = PathEntry(list(path or []), int(terminal), event, splits.get(node_id) or None)
+
+    def discard(self, node_ids: Iterable[int]) -> None:
+        """Dimentica i nodi indicati: il prossimo handle_evacuations li ricalcola."""
+        with self.lock:
+            for node_id in node_ids:
+                self._entries.pop(int(node_id), None)
+
+    def disable_arcs(self, arc_ids: Iterable[int]) -> None:
+        with self.lock:
+            self._disabled.update(int(a) for a in arc_ids)
+
+    def uses_disabled_arc(self, path: Iterable[int]) -> bool:
+        with self.lock:
+            return any(int(a) in self._disabled for a in path or [])
+
+    def usable_splits(self, node_id: int) -> Optional[List[Dict]]:
+        """
+        Ripartizione salvata per il nodo, se nessuno dei suoi percorsi usa archi disattivati.
+        """
+        entry = self.get(node_id)
+        if entry is None or not entry.splits:
+            return None
+        if any(self.uses_disabled_arc(s.get("evacuation_path")) for s in entry.splits):
+            return None
+        return entry.splits
+
+    def get(self, node_id: int) -> Optional[PathEntry]:
+        with self.lock:
+            return self._entries.get(int(node_id))
+
+    def has_path_to(self, node_id: int, targets: Set[int]) -> bool:
+        """
+        True se il percorso salvato per node_id è non vuoto, termina in uno dei target
+        e non passa da archi disattivati.
+        """
+        entry = self.get(node_id)
+        return (
+            entry is not None and bool(entry.path) and entry.terminal in targets
+            and not self.uses_disabled_arc(entry.path)
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+        logger.info("Tabella percorsi svuotata")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._entries)
+
+
+path_table = EvacuationPathTable()
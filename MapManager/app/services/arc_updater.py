@@ -1,37 +1,78 @@
-import psycopg2
-from typing import List
+from typing import Iterable, List, Optional
 
-from MapViewer.app.config.settings import DATABASE_CONFIG
 from MapViewer.app.services.graph_manager import graph_manager
 
 from MapManager.app.config.logging import setup_logging
+from MapManager.app.services.db_pool import get_connection
+from MapManager.app.services.path_calculator import invalidate_graph_cache
+from MapManager.app.services.floor_index import floor_index
+from MapManager.app.core.manager import repair_evacuation_paths
 
 logger = setup_logging("arc_updater", "MapManager/logs/arcUpdater.log")
 
-def update_arc_statuses(floor_level: int, broken_arc_ids: List[int] = []):
+def update_arc_statuses(floor_level: int, broken_arc_ids: Optional[List[int]] = None, rabbitmq_handler=None):
     G = graph_manager.get_graph(floor_level)
     if G is None:
         logger.warning(f"No graph for floor {floor_level}")
         return
+    broken_arc_ids = set(broken_arc_ids or [])
+    # snapshot degli archi sotto lock: il grafo condiviso può cambiare durante le query
+    with graph_manager.lock:
+        edges = [data for _, _, data in G.edges(data=True)]
+    deactivated: List[int] = []
+    deactivated_edges = []
     try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cur = conn.cursor()
-        for _, _, data in G.edges(data=True):
-            arc_id = data.get("arc_id")
-            if arc_id is None: continue
-            is_broken = arc_id in broken_arc_ids
-            currently_active = data.get("active", True)
-            if currently_active and is_broken:
-                logger.info(f"Deactivating arc {arc_id} (broken)")
+        with get_connection() as conn, conn.cursor() as cur:
+            for data in edges:
+                arc_id = data.get("arc_id")
+                if arc_id is None: continue
+                is_broken = arc_id in broken_arc_ids
+                currently_active = data.get("active", True)
+                if currently_active and is_broken:
+                    logger.info(f"Deactivating arc {arc_id} (broken)")
+                    cur.execute("UPDATE arcs SET active = FALSE WHERE arc_id = %s", (arc_id,))
+                    cur.execute("""
+                        INSERT INTO arc_status_log (arc_id, previous_state, new_state, modified_by)
+                        VALUES (%s, %s, %s, %s)
+                    """, (arc_id, True, False, 'MapManager'))
+                    deactivated.append(arc_id)
+                    deactivated_edges.append(data)
+            conn.commit()
+        # grafo in memoria e indice dei piani aggiornati solo dopo il commit
+        with graph_manager.lock:
+            for data in deactivated_edges:
                 data["active"] = False
-                cur.execute("UPDATE arcs SET active = FALSE WHERE arc_id = %s", (arc_id,))
-                cur.execute("""
-                    INSERT INTO arc_status_log (arc_id, previous_state, new_state, modified_by)
-                    VALUES (%s, %s, %s, %s)
-                """, (arc_id, True, False, 'MapManager'))
-        conn.commit()
-        cur.close()
-        conn.close()
+        for arc_id in deactivated:
+            floor_index.set_arc_active(arc_id, False)
+        if deactivated:
+            invalidate_graph_cache()
+            repair_evacuation_paths(deactivated, rabbitmq_handler)
     except Exception as e:
         logger.error(f"Error updating arcs: {str(e)}")
         raise
+
+def apply_disabled_arcs(arc_ids: Iterable[int], rabbitmq_handler=None) -> List[int]:
+    """
+    Archi già disattivati su DB da un altro processo (es. /api/disable-edge di MapViewer):
+    allinea grafi in memoria, indice dei piani e cache, poi ripara i percorsi interessati.
+    Ritorna gli arc_id che erano ancora attivi in memoria.
+    """
+    pending = {int(a) for a in arc_ids}
+    changed: List[int] = []
+    with graph_manager.lock:
+        for G in graph_manager.graphs.values():
+            for _, _, data in G.edges(data=True):
+                arc_id = data.get("arc_id")
+                if arc_id is not None and int(arc_id) in pending and data.get("active", True):
+                    data["active"] = False
+                    changed.append(int(arc_id))
+    # gli archi scala inter-piano possono non stare in nessun grafo di piano
+    for arc_id in pending:
+        if floor_index.set_arc_active(arc_id, False) and arc_id not in changed:
+            changed.append(arc_id)
+    if changed:
+        logger.info(f"Archi disattivati esternamente: {changed}")
+        invalidate_graph_cache()
+    # la riparazione usa l'insieme completo: un arco scala vive solo negli alberi
+    repair_evacuation_paths(sorted(pending), rabbitmq_handler)
+    return changed
@@ -0,0 +1,119 @@
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import heapq
+import math
+import networkx as nx
+
+
+class CSRGraph:
+    """
+    Rappresentazione compatta (array tipizzati) di un grafo di evacuazione per il Dijkstra inverso.
+
+    - node_ids[i]        : node_id del nodo con indice i (index: node_id -> i)
+    - indptr / indices   : adiacenza INVERSA in formato CSR: gli archi u -> v entranti in v
+                           sono indices[indptr[v]:indptr[v+1]] (indici dei nodi u)
+    - weights            : float64, traversal_time in secondi di ciascun arco
+    - arc_ids            : int64, arc_id di ciascun arco (-1 se assente)
+
+    Gli array (array.array) occupano pochi byte per elemento e si indicizzano direttamente
+    dal loop del Dijkstra: vengono costruiti una volta per grafo, nessuna conversione a ogni
+    esecuzione. Gli archi inattivi restano fuori dagli array (disattivare un arco invalida il
+    grafo combinato e quindi anche il CSR); i nodi bloccati (sovraffollati) sono una maschera.
+    L'ordine degli archi entranti è quello di G.pred, quindi a parità di costo il risultato
+    coincide con quello del Dijkstra su networkx.
+    """
+
+    def __init__(self, G: nx.DiGraph, weight: Callable):
+        self.node_ids = array("q", (int(n) for n in G.nodes))
+        self.index: Dict[int, int] = {n: i for i, n in enumerate(self.node_ids)}
+
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        self.weights = array("d")
+        self.arc_ids = array("q")
+
+        for v in self.node_ids:
+            for u, data in G.pred[v].items():
+                if data.get("active") is False:
+                    continue
+                self.indices.append(self.index[u])
+                self.weights.append(float(weight(u, v, data)))
+                arc_id = data.get("arc_id")
+                self.arc_ids.append(-1 if arc_id is None else int(arc_id))
+            self.indptr.append(len(self.indices))
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (
+            self.node_ids, self.indptr, self.indices, self.weights, self.arc_ids
+        ))
+
+    def node_mask(self, nodes: Iterable[int]) -> List[bool]:
+        mask = [False] * len(self.node_ids)
+        for n in nodes:
+            i = self.index.get(n)
+            if i is not None:
+                mask[i] = True
+        return mask
+
+    def reverse_dijkstra(
+        self, targets: Iterable[int], blocked: Set[int] = frozenset(), weights: Optional[Sequence[float]] = None
+    ) -> Tuple[Dict[int, float], Dict[int, Tuple[int, Optional[int]]]]:
+        """
+        Dijkstra sul grafo inverso da tutti i target insieme (stessa semantica di
+        path_calculator._reverse_multi_source_dijkstra). Ritorna (dist, succ) per node_id.
+        'weights' sostituisce i pesi degli archi (es. pesi congestionati), una sequenza per arco.
+        """
+        n = len(self.node_ids)
+        w = self.weights if weights is None else weights
+        indptr = self.indptr
+        indices = self.indices
+        is_blocked = self.node_mask(blocked)
+
+        dist = [math.inf] * n
+        succ_node = [-1] * n
+        succ_edge = [-1] * n
+        heap = []
+        tie = 0
+
+        for t in targets:
+            i = self.index.get(t)
+            if i is not None and dist[i] != 0.0:
+                dist[i] = 0.0
+                heap.append((0.0, tie, i))
+                tie += 1
+        heapq.heapify(heap)
+
+        pop, push = heapq.heappop, heapq.heappush
+        # nessun array 'done': una voce è vecchia se d > dist[v], e un nodo già estratto
+        # ha dist <= d, quindi non passa il test nd < dist[u] (pesi non negativi)
+        while heap:
+            d, _, v = pop(heap)
+            if d > dist[v] or is_blocked[v]:
+                continue
+            for k in range(indptr[v], indptr[v + 1]):
+                u = indices[k]
+                nd = d + w[k]
+                if nd < dist[u]:
+                    dist[u] = nd
+                    succ_node[u] = v
+                    succ_edge[u] = k
+                    push(heap, (nd, tie, u))
+                    tie += 1
+
+        node_ids = self.node_ids
+        arc_ids = self.arc_ids
+        dist_out: Dict[int, float] = {}
+        succ_out: Dict[int, Tuple[int, Optional[int]]] = {}
+        for i in range(n):
+            if dist[i] == math.inf:
+                continue
+            dist_out[node_ids[i]] = dist[i]
+            k = succ_edge[i]
+            if k >= 0:
+                a = arc_ids[k]
+                succ_out[node_ids[i]] = (node_ids[succ_node[i]], None if a < 0 else a)
+        return dist_out, succ_out
@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Optional
+import time
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from MapViewer.app.config.settings import DATABASE_CONFIG
+from MapManager.app.config.logging import setup_logging
+from MapManager.app.config.settings import DB_POOL_CONFIG
+
+logger = setup_logging("db_pool", "MapManager/logs/dbPool.log")
+
+
+class ConnectionPool:
+    """
+    Pool di connessioni psycopg2 condiviso da tutto il processo (thread-safe).
+
+    - ThreadedConnectionPool con minconn/maxconn da DB_POOL_CONFIG
+    - se il pool è esaurito il checkout attende (fino a checkout_timeout) invece di fallire
+    - health check: connessioni chiuse vengono scartate, quelle inattive da troppo
+      tempo vengono verificate con SELECT 1 prima di essere riusate
+    - statistiche di checkout (attese, tempi di utilizzo, connessioni scartate)
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        cfg = {**DB_POOL_CONFIG, **(config or {})}
+        self.minconn = int(cfg.get("minconn", 1))
+        self.maxconn = int(cfg.get("maxconn", 10))
+        self.checkout_timeout = float(cfg.get("checkout_timeout", 10.0))
+        self.health_check_idle = float(cfg.get("health_check_idle_seconds", 30.0))
+        self.slow_checkout_ms = float(cfg.get("slow_checkout_warning_ms", 200.0))
+
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._init_lock = Lock()
+        self._slots = BoundedSemaphore(self.maxconn)
+        self._last_used: Dict[int, float] = {}
+
+        self._stats_lock = Lock()
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "max_in_use": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "hold_ms_total": 0.0,
+            "hold_ms_max": 0.0,
+            "health_checks": 0,
+            "discarded": 0,
+            "errors": 0,
+        }
+
+    def _ensure_pool(self) -> ThreadedConnectionPool:
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, **DATABASE_CONFIG)
+                    logger.info(f"Pool Postgres creato (min={self.minconn}, max={self.maxconn})")
+        return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last = self._last_used.get(id(conn))
+        if last is None or (time.monotonic() - last) < self.health_check_idle:
+            return True
+        with self._stats_lock:
+            self._stats["health_checks"] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Health check fallito, connessione scartata: {e}")
+            return False
+
+    def _discard(self, pool: ThreadedConnectionPool, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        with self._stats_lock:
+            self._stats["discarded"] += 1
+        try:
+            pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def _checkout(self, pool: ThreadedConnectionPool):
+        # al massimo un tentativo per connessione aperta + una nuova
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._discard(pool, conn)
+        raise psycopg2.OperationalError("Nessuna connessione valida disponibile nel pool")
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager: presta una connessione del pool.
+        Commit all'uscita normale, rollback in caso di eccezione, poi la connessione torna al pool.
+        """
+        pool = self._ensure_pool()
+        t0 = time.monotonic()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            raise psycopg2.OperationalError(
+                f"Timeout ({self.checkout_timeout}s) in attesa di una connessione dal pool"
+            )
+
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout(pool)
+            t1 = time.monotonic()
+            wait_ms = (t1 - t0) * 1000.0
+            with self._stats_lock:
+                s = self._stats
+                s["checkouts"] += 1
+                s["in_use"] += 1
+                s["max_in_use"] = max(s["max_in_use"], s["in_use"])
+                s["wait_ms_total"] += wait_ms
+                s["wait_ms_max"] = max(s["wait_ms_max"], wait_ms)
+            if wait_ms >= self.slow_checkout_ms:
+                logger.warning(f"Checkout lento dal pool: {wait_ms:.1f} ms")
+
+            try:
+                yield conn
+                if not conn.closed:
+                    conn.commit()
+            except Exception:
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                try:
+                    if not conn.closed:
+                        conn.rollback()
+                except Exception:
+                    broken = True
+                raise
+            finally:
+                hold_ms = (time.monotonic() - t1) * 1000.0
+                with self._stats_lock:
+                    s = self._stats
+                    s["in_use"] -= 1
+                    s["hold_ms_total"] += hold_ms
+                    s["hold_ms_max"] = max(s["hold_ms_max"], hold_ms)
+        finally:
+            try:
+                if conn is not None:
+                    if broken or conn.closed:
+                        self._discard(pool, conn)
+                    else:
+                        self._last_used[id(conn)] = time.monotonic()
+                        pool.putconn(conn)
+            finally:
+                self._slots.release()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        n = s["checkouts"] or 1
+        s["wait_ms_avg"] = s["wait_ms_total"] / n
+        s["hold_ms_avg"] = s["hold_ms_total"] / n
+        return s
+
+    def close(self) -> None:
+        with self._init_lock:
+            if self._pool is not None:
+                logger.info(f"Chiusura pool Postgres, stats={self.stats()}")
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+db_pool = ConnectionPool()
+
+
+def get_connection():
+    """
+    Scorciatoia per db_pool.connection():  with get_connection() as conn, conn.cursor() as cur: ...
+    """
+    return db_pool.connection()
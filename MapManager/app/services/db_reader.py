@@ -1,7 +1,7 @@
 # db_reader.py
 # -------------------------------------------------------------
 # Data Access Layer per tabelle 'nodes' e 'arcs'
-# - Connessione sicura via context manager
+# - Connessioni prese dal pool condiviso (db_pool) via context manager
 # - Tipi e docstring consistenti
 # - Nessuna funzione duplicata
 # - Query parametriche e gestione array floor_level
@@ -10,11 +10,10 @@
 from __future__ import annotations
 
 from typing import List, Dict, Iterable, Optional, Tuple
-import psycopg2
 import psycopg2.extras as pg_extras
 
-from MapViewer.app.config.settings import DATABASE_CONFIG
 from MapManager.app.config.logging import setup_logging
+from MapManager.app.services.db_pool import get_connection
 
 logger = setup_logging("db_reader", "MapManager/logs/dbReader.log")
 
@@ -25,10 +24,10 @@ logger = setup_logging("db_reader", "MapManager/logs/dbReader.log")
 
 def _get_conn():
     """
-    Ritorna una nuova connessione psycopg2 usando DATABASE_CONFIG.
+    Ritorna un context manager che presta una connessione del pool condiviso.
+    All'uscita la transazione viene chiusa e la connessione torna al pool.
     """
-    # Nota: rely on autocommit=False di default; i SELECT non richiedono commit.
-    return psycopg2.connect(**DATABASE_CONFIG)
+    return get_connection()
 
 
 def _as_list(value) -> List[int]:
@@ -107,7 +106,7 @@ def get_intra_floor_arcs(floor_level: int) -> List[Dict]:
         return []
 
 
-def get_interfloor_stair_arcs() -> List[Dict]:
+def get_interfloor_stair_arcs(raise_errors: bool = False) -> List[Dict]:
     """
     Ritorna gli archi che connettono nodi di 'tipo scala' (inter-floor).
     Non imponiamo un vincolo su 'arc_type' perché lo schema può variare.
@@ -120,13 +119,18 @@ def get_interfloor_stair_arcs() -> List[Dict]:
       - initial_node_id: int
       - final_node_id: int
       - active: bool
+      - traversal_time: float (secondi)
+      - capacity: Optional[int]
+
+    Con raise_errors=True un errore DB viene rilanciato invece di restituire [].
     """
     sql = """
         SELECT a.arc_id,
                a.initial_node,
                a.final_node,
                a.active,
-               a.traversal_time
+               EXTRACT(EPOCH FROM a.traversal_time)::float8 AS traversal_time,
+               a.capacity
         FROM arcs a
         JOIN nodes n1 ON n1.node_id = a.initial_node
         JOIN nodes n2 ON n2.node_id = a.final_node
@@ -137,17 +141,20 @@ def get_interfloor_stair_arcs() -> List[Dict]:
             cur.execute(sql)
             rows = cur.fetchall()
         out: List[Dict] = []
-        for arc_id, ini, fin, active, ttime in rows:
+        for arc_id, ini, fin, active, ttime, cap in rows:
             out.append({
                 "arc_id": int(arc_id),
                 "initial_node_id": int(ini),
                 "final_node_id": int(fin),
                 "active": bool(active),
-                "traversal_time": ttime
+                "traversal_time": float(ttime) if ttime is not None else 1.0,
+                "capacity": cap
             })
         return out
     except Exception as e:
         logger.error(f"get_interfloor_stair_arcs error: {e}", exc_info=True)
+        if raise_errors:
+            raise
         return []
 
 
@@ -226,7 +233,7 @@ def get_node_ids_in_zone(x1: float, x2: float, y1: float, y2: float, z1: int, z2
         return []
 
 
-def get_node_attributes(node_ids: Iterable[int]) -> Dict[int, Dict]:
+def get_node_attributes(node_ids: Iterable[int], raise_errors: bool = False) -> Dict[int, Dict]:
     """
     Ritorna attributi per i node_id richiesti.
 
@@ -236,6 +243,8 @@ def get_node_attributes(node_ids: Iterable[int]) -> Dict[int, Dict]:
         "node_type": str | None,
         "floor_level": List[int]
     }
+
+    Con raise_errors=True un errore DB viene rilanciato invece di restituire {}.
     """
     node_ids = [int(n) for n in (node_ids or [])]
     if not node_ids:
@@ -267,6 +276,8 @@ def get_node_attributes(node_ids: Iterable[int]) -> Dict[int, Dict]:
         return out
     except Exception as e:
         logger.error(f"get_node_attributes error: {e}", exc_info=True)
+        if raise_errors:
+            raise
         return {}
 
 
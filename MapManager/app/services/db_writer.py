@@ -1,12 +1,12 @@
-import psycopg2
-from typing import Iterable, List
-from MapViewer.app.config.settings import DATABASE_CONFIG  
+from psycopg2.extras import Json, execute_values
+from typing import Dict, Iterable, List, Optional, Tuple
 from MapManager.app.config.logging import setup_logging
+from MapManager.app.services.db_pool import get_connection
 
 logger = setup_logging("db_writer", "MapManager/logs/dbWriter.log")
 
 def _get_conn():
-    return psycopg2.connect(**DATABASE_CONFIG)
+    return get_connection()
 
 def update_node_evacuation_path(node_id: int, arc_path: List[int]):
     """
@@ -23,18 +23,47 @@ def update_node_evacuation_path(node_id: int, arc_path: List[int]):
         logger.error(f"Error updating evacuation_path for node {node_id}: {str(e)}")
         raise
 
-def bulk_update_node_evacuation_paths(pairs: List[tuple[int, List[int]]]):
-    if not pairs: return 0
+def bulk_update_node_evacuation_paths(
+    pairs: Iterable[Tuple[int, List[int]]],
+    splits: Optional[Dict[int, List[Dict]]] = None
+) -> int:
+    """
+    Salva gli evacuation_path di più nodi con un solo UPDATE ... FROM (VALUES ...)
+    in un'unica transazione: i percorsi di un ricalcolo diventano visibili tutti insieme.
+    Un percorso vuoto viene salvato come array vuoto (nodo target).
+
+    'splits' (routing "capacity"): node_id -> [{"evacuation_path": [...], "users": n}, ...]
+    salvato in evacuation_path_splits; per i nodi senza ripartizione la colonna torna NULL.
+    """
+    splits = splits or {}
+    # un nodo ripetuto nello stesso UPDATE ... FROM è ambiguo: vince l'ultimo valore
+    rows = {
+        int(node_id): [int(a) for a in (arc_path or []) if a is not None]
+        for node_id, arc_path in pairs
+    }
+    if not rows: return 0
+    sql = """
+        UPDATE nodes AS n
+        SET evacuation_path = v.evacuation_path,
+            evacuation_path_splits = v.evacuation_path_splits
+        FROM (VALUES %s) AS v(node_id, evacuation_path, evacuation_path_splits)
+        WHERE n.node_id = v.node_id
+    """
+    values = [
+        (node_id, path, Json(splits[node_id]) if splits.get(node_id) else None)
+        for node_id, path in rows.items()
+    ]
     try:
         with _get_conn() as conn, conn.cursor() as cur:
-            for node_id, arc_path in pairs:
-                cur.execute(
-                    "UPDATE nodes SET evacuation_path=%s WHERE node_id=%s",
-                    (arc_path or None, node_id)
-                )
+            execute_values(
+                cur, sql, values,
+                template="(%s, %s::integer[], %s::jsonb)",
+                page_size=len(rows)
+            )
+            n = cur.rowcount
             conn.commit()
-        logger.info(f"Saved {len(pairs)} evacuation paths.")
-        return len(pairs)
+        logger.info(f"Saved {len(rows)} evacuation paths in one statement ({n} rows updated).")
+        return len(rows)
     except Exception as e:
         logger.error(f"bulk_update_node_evacuation_paths error: {e}")
         raise
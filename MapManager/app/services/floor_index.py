@@ -0,0 +1,132 @@
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+from threading import RLock
+
+from MapManager.app.config.logging import setup_logging
+from MapManager.app.services.db_reader import get_interfloor_stair_arcs, get_node_attributes
+
+logger = setup_logging("floor_index", "MapManager/logs/floorIndex.log")
+
+
+class FloorConnectivityIndex:
+    """
+    Componenti connesse dei piani rispetto agli archi scale ATTIVI.
+
+    Viene costruito una volta (preload) leggendo gli archi scale dal DB; quando un arco
+    scala cambia stato l'indice si aggiorna in memoria, senza query.
+    reachable_floors() è quindi una semplice lookup.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.loaded = False
+        # arc_id -> (piani nodo iniziale, piani nodo finale, active)
+        self._stair_arcs: Dict[int, Tuple[FrozenSet[int], FrozenSet[int], bool]] = {}
+        # piano -> insieme dei piani nella stessa componente
+        self._component_of: Dict[int, FrozenSet[int]] = {}
+
+    def rebuild(self) -> bool:
+        """
+        Ricarica dal DB gli archi scale inter-piano e ricalcola le componenti.
+        Se la lettura fallisce l'indice precedente resta valido (e loaded invariato):
+        ritorna False, e se l'indice non era mai stato caricato si riprova alla prossima richiesta.
+        """
+        try:
+            inter = get_interfloor_stair_arcs(raise_errors=True)
+            attrs = {}
+            if inter:
+                node_ids = {e["initial_node_id"] for e in inter} | {e["final_node_id"] for e in inter}
+                attrs = get_node_attributes(list(node_ids), raise_errors=True)
+        except Exception as e:
+            logger.error(f"Indice piani non ricostruito (lettura DB fallita), mantengo il precedente: {e}")
+            return False
+
+        stair_arcs: Dict[int, Tuple[FrozenSet[int], FrozenSet[int], bool]] = {}
+        for e in inter:
+            n1 = attrs.get(e["initial_node_id"]); n2 = attrs.get(e["final_node_id"])
+            if not n1 or not n2:
+                continue
+            stair_arcs[int(e["arc_id"])] = (
+                frozenset(int(f) for f in n1["floor_level"]),
+                frozenset(int(f) for f in n2["floor_level"]),
+                bool(e["active"]),
+            )
+
+        with self.lock:
+            self._stair_arcs = stair_arcs
+            self._recompute()
+            self.loaded = True
+        logger.info(f"Indice piani costruito: {len(stair_arcs)} archi scale, componenti={self.components()}")
+        return True
+
+    def _recompute(self) -> None:
+        # union-find sui piani, solo archi attivi
+        parent: Dict[int, int] = {}
+
+        def find(f: int) -> int:
+            parent.setdefault(f, f)
+            while parent[f] != f:
+                parent[f] = parent[parent[f]]
+                f = parent[f]
+            return f
+
+        for f1s, f2s, active in self._stair_arcs.values():
+            for f in f1s | f2s:
+                find(f)
+            if not active:
+                continue
+            for f1 in f1s:
+                for f2 in f2s:
+                    if f1 != f2:
+                        parent[find(f1)] = find(f2)
+
+        groups: Dict[int, Set[int]] = {}
+        for f in parent:
+            groups.setdefault(find(f), set()).add(f)
+        self._component_of = {f: frozenset(g) for g in groups.values() for f in g}
+
+    def set_arc_active(self, arc_id: int, active: bool) -> bool:
+        """
+        Aggiorna lo stato di un arco scala. Ritorna True se l'arco è indicizzato
+        (cioè è un arco scala) e il suo stato è cambiato.
+        """
+        with self.lock:
+            entry = self._stair_arcs.get(int(arc_id))
+            if entry is None or entry[2] == bool(active):
+                return False
+            f1s, f2s, _ = entry
+            self._stair_arcs[int(arc_id)] = (f1s, f2s, bool(active))
+
+            if active:
+                # riattivazione: basta fondere le componenti toccate dall'arco
+                merged: Set[int] = set()
+                for f in f1s | f2s:
+                    merged |= self._component_of.get(f, frozenset([f]))
+                comp = frozenset(merged)
+                for f in comp:
+                    self._component_of[f] = comp
+            else:
+                # disattivazione: può spezzare una componente, ricalcolo in memoria
+                self._recompute()
+        logger.info(f"Arco scala {arc_id} active={active}: componenti={self.components()}")
+        return True
+
+    def reachable_floors(self, start_floors: Iterable[int]) -> Set[int]:
+        """
+        Piani raggiungibili dai piani di partenza seguendo archi scale attivi
+        (i piani di partenza sono sempre inclusi).
+        """
+        if not self.loaded:
+            self.rebuild()
+        out: Set[int] = set()
+        with self.lock:
+            for f in start_floors or []:
+                f = int(f)
+                out |= self._component_of.get(f, frozenset([f]))
+        return out
+
+    def components(self) -> List[List[int]]:
+        with self.lock:
+            return [list(c) for c in sorted({tuple(sorted(c)) for c in self._component_of.values()})]
+
+
+floor_index = FloorConnectivityIndex()
@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import math
+import networkx as nx
+
+from MapManager.app.config.logging import setup_logging
+from MapManager.app.config.settings import PATHFINDING_CONFIG
+from MapManager.app.services.path_calculator import (
+    MAX_NODE_CAPACITY, _build_combined_graph, _edge_weight, _extract_arc_paths,
+    _reverse_multi_source_dijkstra
+)
+
+logger = setup_logging("flow_router", "MapManager/logs/flowRouter.log")
+
+MAX_ARC_CAPACITY = int(PATHFINDING_CONFIG.get("max_arc_capacity", 30))
+FLOW_ITERATIONS = max(1, int(PATHFINDING_CONFIG.get("flow_iterations", 10)))
+
+# node_id -> [(arc_ids, n_utenti, nodo terminale), ...]
+FlowRoutes = Dict[int, List[Tuple[List[int], int, int]]]
+
+
+def _arc_capacity(data) -> int:
+    """
+    Persone che possono stare contemporaneamente sull'arco (arcs.capacity);
+    se non valorizzata si usa PATHFINDING_CONFIG["max_arc_capacity"].
+    """
+    cap = data.get("capacity")
+    try:
+        cap = int(cap)
+    except (TypeError, ValueError):
+        cap = 0
+    return cap if cap > 0 else MAX_ARC_CAPACITY
+
+
+def _congested_weight(flow: Dict[int, int]):
+    """
+    Peso di un arco dato il flusso già assegnato (modello time-expanded semplificato):
+    l'arco fa passare 'capacity' persone ogni traversal_time, quindi chi arriva dopo
+    i primi k*capacity attende k turni: t * (1 + flow // capacity).
+    """
+    def weight(u, v, data) -> float:
+        t = _edge_weight(u, v, data)
+        f = flow.get(data.get("arc_id"), 0)
+        return t * (1 + f // _arc_capacity(data)) if f else t
+    return weight
+
+
+def assign_flow_routes(
+    start_floors: Iterable[int], exit_nodes: List[int], demands: Dict[int, int]
+) -> FlowRoutes:
+    """
+    Distribuisce gli utenti (demands: node_id -> numero di utenti in pericolo) sui percorsi
+    verso exit_nodes tenendo conto di capacità e tempi di attraversamento degli archi.
+
+    Assegnazione incrementale (successive shortest paths): la domanda di ogni nodo viene
+    divisa in FLOW_ITERATIONS quote; a ogni iterazione si ricalcola un unico albero dei
+    cammini minimi dai target con i pesi congestionati e ogni nodo manda la sua quota
+    sul percorso migliore del momento. Il risultato è, per nodo, la lista di percorsi
+    con il numero di utenti assegnati a ciascuno.
+    """
+    floors = sorted({int(f) for f in start_floors})
+    G: nx.DiGraph = _build_combined_graph(floors)
+
+    overcrowded = {
+        n for n, d in G.nodes(data=True)
+        if d.get("current_occupancy", 0) >= MAX_NODE_CAPACITY
+    }
+    targets = [t for t in (exit_nodes or []) if t in G and t not in overcrowded]
+    if not targets:
+        logger.warning(f"Nessun target presente nel grafo combinato (piani {floors})")
+        return {}
+
+    remaining = {int(n): max(1, int(c or 0)) for n, c in demands.items() if n in G}
+    for n in set(demands) - set(remaining):
+        logger.warning(f"Nodo {n} non presente nel grafo combinato (piani {floors})")
+
+    flow: Dict[int, int] = {}
+    assigned: Dict[int, Dict[Tuple[int, ...], List[int]]] = {}  # node -> path -> [n_utenti, terminale]
+    weight = _congested_weight(flow)
+
+    for it in range(FLOW_ITERATIONS):
+        pending = [n for n, c in remaining.items() if c > 0]
+        if not pending:
+            break
+        _dist, succ = _reverse_multi_source_dijkstra(G, targets, overcrowded, weight=weight)
+        routes = _extract_arc_paths(succ, pending)
+
+        iterations_left = FLOW_ITERATIONS - it
+        for n in pending:
+            route = routes.get(n)
+            if route is None or not route[0]:
+                remaining[n] = 0
+                continue
+            arc_ids, terminal = route
+            share = math.ceil(remaining[n] / iterations_left)
+            remaining[n] -= share
+            for a in arc_ids:
+                flow[a] = flow.get(a, 0) + share
+            entry = assigned.setdefault(n, {}).setdefault(tuple(arc_ids), [0, terminal])
+            entry[0] += share
+
+    out: FlowRoutes = {}
+    for n, by_path in assigned.items():
+        splits = [(list(p), cnt, term) for p, (cnt, term) in by_path.items()]
+        splits.sort(key=lambda s: -s[1])
+        out[n] = splits
+
+    n_split = sum(1 for s in out.values() if len(s) > 1)
+    busiest = sorted(flow.items(), key=lambda kv: -kv[1])[:5]
+    logger.info(
+        f"[flow] piani={floors}: {sum(int(c or 0) for c in demands.values())} utenti su {len(out)} nodi, "
+        f"{n_split} nodi con più percorsi, archi più carichi={busiest}"
+    )
+    return out
+
+
+def primary_route(splits: List[Tuple[List[int], int, int]]) -> Optional[Tuple[List[int], int]]:
+    """
+    Percorso con più utenti assegnati (quello salvato in nodes.evacuation_path).
+    """
+    if not splits:
+        return None
+    arc_ids, _count, terminal = splits[0]
+    return arc_ids, terminal
@@ -1,5 +1,7 @@
-from typing import List, Optional, Iterable, Tuple
-from datetime import timedelta
+from typing import Dict, FrozenSet, List, Optional, Iterable, Set, Tuple
+from threading import RLock
+import heapq
+import itertools
 import math
 import networkx as nx
 
@@ -8,6 +10,9 @@ from MapManager.app.config.settings import PATHFINDING_CONFIG
 from MapManager.app.services.db_reader import (
     get_interfloor_stair_arcs, get_node_attributes
 )
+from MapManager.app.services.floor_index import floor_index
+from MapManager.app.services.path_tree import ShortestPathTree
+from MapManager.app.services.csr_graph import CSRGraph
 from MapViewer.app.services.graph_manager import graph_manager
 
 from MapManager.app.core.event_state import get_current_event
@@ -16,22 +21,12 @@ logger = setup_logging("path_calculator", "MapManager/logs/pathCalculator.log")
 
 # ---- utility ----
 
-def _to_seconds(x) -> float:
-    if isinstance(x, timedelta):
-        return x.total_seconds()
-    try:
-        if isinstance(x, str) and ":" in x:
-            h, m, s = x.split(":")
-            return int(h) * 3600 + int(m) * 60 + float(s)
-        return float(x)
-    except Exception:
-        return 1.0
-
 def _dist(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     return math.hypot(a[0] - b[0], a[1] - b[1])
 
 def _edge_weight(_u, _v, data) -> float:
-    return _to_seconds(data.get("traversal_time", 1.0))
+    # traversal_time è già un float in secondi (normalizzato al caricamento del grafo)
+    return data.get("traversal_time", 1.0)
 
 def _select_exit_nodes(G: nx.DiGraph) -> list[int]:
     ev = (get_current_event() or "").lower()
@@ -56,57 +51,75 @@ def _select_exit_nodes(G: nx.DiGraph) -> list[int]:
 
 STAIR_XY_TOLERANCE = float(PATHFINDING_CONFIG.get("stair_xy_tolerance", 80.0))
 MAX_NODE_CAPACITY = int(PATHFINDING_CONFIG.get("max_node_capacity", 10**9))
+GRAPH_BACKEND = (PATHFINDING_CONFIG.get("graph_backend") or "networkx").lower()
+
+# ---- cache (archi scale + grafo combinato) legata a graph_manager.version ----
+
+_cache_lock = RLock()
+_interfloor_cache: Dict[int, Tuple[List[Dict], Dict[int, Dict]]] = {}
+_combined_cache: Dict[Tuple[FrozenSet[int], int], nx.DiGraph] = {}
+
+def invalidate_graph_cache() -> None:
+    """
+    Da chiamare quando cambia la topologia o il peso degli archi fuori da graph_manager.load_graph
+    (archi disattivati): le cache vengono ricostruite alla prossima richiesta.
+    Il flag safe dei nodi non entra nel grafo combinato e non richiede invalidazione.
+    """
+    version = graph_manager.bump_version()
+    logger.info(f"Cache grafo combinato invalidata (version={version})")
+
+def _get_interfloor_data() -> Tuple[List[Dict], Dict[int, Dict]]:
+    """
+    Archi scale inter-piano + attributi dei nodi estremi, letti dal DB una sola volta per versione del grafo.
+    """
+    version = graph_manager.version
+    with _cache_lock:
+        cached = _interfloor_cache.get(version)
+    if cached is not None:
+        return cached
+
+    inter = get_interfloor_stair_arcs()
+    attrs: Dict[int, Dict] = {}
+    if inter:
+        node_ids = {e["initial_node_id"] for e in inter} | {e["final_node_id"] for e in inter}
+        attrs = get_node_attributes(list(node_ids))
+        # un risultato vuoto può essere un errore DB già loggato: non lo rendiamo persistente
+        with _cache_lock:
+            _interfloor_cache.clear()
+            _interfloor_cache[version] = (inter, attrs)
+    return inter, attrs
 
 # ---- floors discovery via inter-floor arcs ----
 
 def _reachable_floors_from(start_floors: Iterable[int]) -> List[int]:
     """
-    Scopre tutti i piani raggiungibili **usando gli archi scale inter-piano dal DB**.
+    Scopre tutti i piani raggiungibili **usando gli archi scale inter-piano attivi**
+    (lookup sull'indice di connettività dei piani, nessuna query).
     """
     start = {int(f) for f in (start_floors or [])}
     if not start:
         return []
+    return sorted(floor_index.reachable_floors(start))
 
-    inter = get_interfloor_stair_arcs()
-    if not inter:
-        return sorted(start)
-
-    node_ids = {e["initial_node_id"] for e in inter} | {e["final_node_id"] for e in inter}
-    attrs = get_node_attributes(list(node_ids))
+# ---- build combined graph (multi-piano) ----
 
-    # calcola le adiacenze tra piani a partire dagli archi scale
-    edges_floor: List[Tuple[int, int]] = []
-    for e in inter:
-        n1 = attrs.get(e["initial_node_id"]); n2 = attrs.get(e["final_node_id"])
-        if not n1 or not n2:
-            continue
-        f1s = n1["floor_level"]; f2s = n2["floor_level"]
-        for f1 in f1s:
-            for f2 in f2s:
-                if f1 != f2:
-                    edges_floor.append((int(f1), int(f2)))
-
-    # BFS sui piani
-    visited = set()
-    stack = list(start)
-    while stack:
-        fl = stack.pop()
-        if fl in visited:
-            continue
-        visited.add(fl)
-        for a, b in edges_floor:
-            if a == fl and b not in visited:
-                stack.append(b)
-            elif b == fl and a not in visited:
-                stack.append(a)
+def _combined_floors(start_floors: Iterable[int]) -> List[int]:
+    floors = _reachable_floors_from(start_floors) or list(start_floors or [])
+    return list(sorted(set(int(f) for f in floors)))
 
-    return sorted(visited)
+def _build_combined_graph(start_floors: Iterable[int]) -> nx.DiGraph:
+    """
+    Grafo multi-piano (sola lettura: è condiviso tramite cache finché graph_manager.version non cambia).
+    """
+    version = graph_manager.version
+    floors = _combined_floors(start_floors)
 
-# ---- build combined graph (multi-piano) ----
+    key = (frozenset(floors), version)
+    with _cache_lock:
+        cached = _combined_cache.get(key)
+    if cached is not None:
+        return cached
 
-def _build_combined_graph(start_floors: Iterable[int]) -> nx.DiGraph:
-    floors = _reachable_floors_from(start_floors) or list(start_floors or [])
-    floors = list(sorted(set(int(f) for f in floors)))
     logger.info(f"Piani combinati: {floors}")
 
     # unisci i grafi intra-piano
@@ -117,10 +130,8 @@ def _build_combined_graph(start_floors: Iterable[int]) -> nx.DiGraph:
             G.update(Gfl)
 
     # aggiungi archi inter-piano (solo scale)
-    inter = get_interfloor_stair_arcs()
+    inter, attrs = _get_interfloor_data()
     if inter:
-        node_ids = {e["initial_node_id"] for e in inter} | {e["final_node_id"] for e in inter}
-        attrs = get_node_attributes(list(node_ids))
         floors_set = set(floors)
 
         for e in inter:
@@ -146,13 +157,229 @@ def _build_combined_graph(start_floors: Iterable[int]) -> nx.DiGraph:
             G.add_edge(
                 i, f,
                 arc_id=int(e["arc_id"]),
-                traversal_time=_to_seconds(e["traversal_time"]),
+                traversal_time=e["traversal_time"],
+                capacity=e.get("capacity"),
                 active=True
             )
 
-    logger.info(f"Grafo multi-piano: {G.number_of_nodes()} nodi, {G.number_of_edges()} archi")    
+    logger.info(f"Grafo multi-piano: {G.number_of_nodes()} nodi, {G.number_of_edges()} archi")
+
+    with _cache_lock:
+        for stale in [k for k in _combined_cache if k[1] != version]:
+            del _combined_cache[stale]
+        _combined_cache[key] = G
     return G
 
+def _get_csr(G: nx.DiGraph) -> CSRGraph:
+    """
+    Versione CSR del grafo combinato, costruita una volta e tenuta insieme al grafo in cache.
+    """
+    with _cache_lock:
+        csr = G.graph.get("csr")
+        if csr is None:
+            csr = CSRGraph(G, _edge_weight)
+            G.graph["csr"] = csr
+            logger.info(f"CSR costruito: {len(csr)} nodi, {len(csr.indices)} archi, {csr.nbytes} byte")
+    return csr
+
+# ---- shortest-path tree multi-sorgente ----
+
+def _reverse_multi_source_dijkstra(
+    G: nx.DiGraph, targets: Iterable[int], blocked: Set[int] = frozenset(), weight=_edge_weight
+) -> Tuple[Dict[int, float], Dict[int, Tuple[int, Optional[int]]]]:
+    """
+    Dijkstra sul grafo inverso partendo da TUTTI i target contemporaneamente.
+
+    Ritorna (dist, succ):
+      - dist[n]: tempo minimo (s) dal nodo n al target più vicino
+      - succ[n]: (nodo successivo, arc_id) lungo il percorso ottimo verso quel target
+
+    I nodi in 'blocked' (es. sovraffollati) possono essere raggiunti come partenza
+    ma non vengono attraversati. Gli archi con active=False vengono ignorati.
+    'weight(u, v, data)' permette pesi diversi dal traversal_time (es. congestione).
+    """
+    dist: Dict[int, float] = {}
+    succ: Dict[int, Tuple[int, Optional[int]]] = {}
+    done: Set[int] = set()
+    tie = itertools.count()
+    heap: List[Tuple[float, int, int]] = []
+
+    for t in targets:
+        if t not in dist:
+            dist[t] = 0.0
+            heapq.heappush(heap, (0.0, next(tie), t))
+
+    while heap:
+        d, _, v = heapq.heappop(heap)
+        if v in done:
+            continue
+        done.add(v)
+        if v in blocked:
+            continue
+        for u, data in G.pred[v].items():
+            if u in done or data.get("active") is False:
+                continue
+            nd = d + weight(u, v, data)
+            if nd < dist.get(u, math.inf):
+                dist[u] = nd
+                succ[u] = (v, data.get("arc_id"))
+                heapq.heappush(heap, (nd, next(tie), u))
+
+    return dist, succ
+
+
+def _extract_arc_paths(
+    succ: Dict[int, Tuple[int, Optional[int]]], nodes: Iterable[int]
+) -> Dict[int, Tuple[List[int], int]]:
+    """
+    Ricostruisce, seguendo i puntatori 'succ', la lista di arc_id verso il target
+    per ciascun nodo richiesto, insieme al target raggiunto (nodo terminale).
+    I sotto-percorsi già calcolati vengono riusati.
+    """
+    memo: Dict[int, Tuple[List[int], int]] = {}
+    out: Dict[int, Tuple[List[int], int]] = {}
+    for n in nodes:
+        if n not in succ:
+            continue
+        chain: List[int] = []
+        cur = n
+        while cur in succ and cur not in memo:
+            chain.append(cur)
+            cur = succ[cur][0]
+        tail, terminal = memo.get(cur, ([], cur))
+        for node in reversed(chain):
+            arc_id = succ[node][1]
+            tail = ([int(arc_id)] if arc_id is not None else []) + tail
+            memo[node] = (tail, terminal)
+        out[n] = memo[n]
+    return out
+
+
+def _start_floors_of(G_floor: nx.DiGraph, node: int) -> Tuple[int, ...]:
+    floors = G_floor.nodes[node].get("floor_level")
+    floors = floors if isinstance(floors, list) else [floors]
+    return tuple(sorted({int(f) for f in floors if f is not None}))
+
+
+def compute_evacuation_routes(
+    G_floor: nx.DiGraph, exit_nodes: List[int], sources: Optional[Iterable[int]] = None
+) -> Dict[int, Tuple[List[int], int]]:
+    """
+    Calcola in un'unica passata (Dijkstra inverso multi-sorgente dai target)
+    il percorso più veloce verso QUALSIASI nodo in exit_nodes per tutti i nodi
+    in 'sources' (default: tutti i nodi del piano).
+
+    Ritorna node_id -> (arc_id del percorso, target raggiunto).
+    I nodi vengono raggruppati per piani di partenza, così ogni gruppo usa lo
+    stesso grafo combinato multi-piano di find_shortest_path_to_exit.
+    Nel risultato compaiono solo i nodi con un percorso non vuoto.
+    """
+    sources = list(G_floor.nodes) if sources is None else list(sources)
+
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for n in sources:
+        if n not in G_floor:
+            logger.warning(f"Start node {n} non nel grafo del piano")
+            continue
+        groups.setdefault(_start_floors_of(G_floor, n), []).append(n)
+
+    routes: Dict[int, Tuple[List[int], int]] = {}
+    for start_floors, group in groups.items():
+        G = _build_combined_graph(start_floors)
+
+        # nodi sovraffollati: raggiungibili come partenza ma non attraversabili
+        overcrowded = {
+            n for n, d in G.nodes(data=True)
+            if d.get("current_occupancy", 0) >= MAX_NODE_CAPACITY
+        }
+
+        targets = [t for t in (exit_nodes or []) if t in G and t not in overcrowded]
+        if not targets:
+            logger.warning(f"Nessun target presente nel grafo combinato (piani {list(start_floors)})")
+            continue
+
+        if GRAPH_BACKEND == "csr":
+            dist, succ = _get_csr(G).reverse_dijkstra(targets, overcrowded)
+        else:
+            dist, succ = _reverse_multi_source_dijkstra(G, targets, overcrowded)
+        group_paths = _extract_arc_paths(succ, (n for n in group if n in G))
+        _register_tree(
+            start_floors, ShortestPathTree(G, targets, overcrowded, dict(dist), dict(succ), _edge_weight), group
+        )
+        for n, route in group_paths.items():
+            if route[0]:
+                routes[n] = route
+
+        logger.info(
+            f"[pf] tree piani={list(start_floors)}: {len(targets)} target, "
+            f"{len(dist)} nodi raggiunti, {len(group_paths)}/{len(group)} sorgenti con path"
+        )
+
+    return routes
+
+
+def compute_evacuation_paths(
+    G_floor: nx.DiGraph, exit_nodes: List[int], sources: Optional[Iterable[int]] = None
+) -> Dict[int, List[int]]:
+    """
+    Come compute_evacuation_routes, ma ritorna solo gli arc_id: node_id -> [arc_id, ...].
+    """
+    routes = compute_evacuation_routes(G_floor, exit_nodes, sources)
+    return {n: arc_ids for n, (arc_ids, _terminal) in routes.items()}
+
+# ---- alberi mantenuti per la riparazione incrementale (archi disattivati) ----
+
+# (piani di partenza, target) -> (albero, {piano: grafo di piano da cui è stato costruito})
+_trees: Dict[Tuple[Tuple[int, ...], FrozenSet[int]], Tuple[ShortestPathTree, Dict[int, nx.DiGraph]]] = {}
+# node_id -> chiave dell'albero che ha prodotto il suo ultimo percorso
+_served_by: Dict[int, Tuple[Tuple[int, ...], FrozenSet[int]]] = {}
+
+def _drop_unused_trees() -> None:
+    # alberi non più referenziati da nessun nodo (chiamare con _cache_lock)
+    live = set(_served_by.values())
+    for stale in [k for k in _trees if k not in live]:
+        del _trees[stale]
+
+def _register_tree(start_floors: Tuple[int, ...], tree: ShortestPathTree, sources: Iterable[int]) -> None:
+    key = (tuple(start_floors), tree.targets)
+    graphs = {fl: graph_manager.graphs.get(fl) for fl in _combined_floors(start_floors)}
+    with _cache_lock:
+        _trees[key] = (tree, graphs)
+        for n in sources:
+            _served_by[n] = key
+        _drop_unused_trees()
+
+def release_tree_routes(nodes: Iterable[int]) -> None:
+    """
+    I nodi indicati hanno ora un percorso che non viene da un albero (routing "capacity"):
+    repair_evacuation_routes non li deve più riscrivere.
+    """
+    with _cache_lock:
+        for n in nodes:
+            _served_by.pop(n, None)
+        _drop_unused_trees()
+
+def repair_evacuation_routes(arc_ids: Iterable[int]) -> Dict[int, Optional[Tuple[List[int], int]]]:
+    """
+    Ripara gli alberi dei cammini minimi dopo la disattivazione di 'arc_ids'.
+
+    Ritorna, per i nodi il cui ultimo percorso passava da uno di quegli archi,
+    il nuovo (arc_ids, target) oppure None se il nodo non ha più un percorso.
+    Gli alberi costruiti su grafi di piano ricaricati nel frattempo vengono scartati
+    (quei nodi verranno ricalcolati al prossimo handle_evacuations).
+    """
+    arc_ids = {int(a) for a in arc_ids}
+    out: Dict[int, Optional[Tuple[List[int], int]]] = {}
+    with _cache_lock:
+        for key, (tree, graphs) in list(_trees.items()):
+            if any(graph_manager.graphs.get(fl) is not G for fl, G in graphs.items()):
+                del _trees[key]
+                continue
+            for n in tree.repair(arc_ids):
+                if _served_by.get(n) == key:
+                    out[n] = tree.route(n)
+    return out
+
 # ---- pathfinding ----
 
 def find_shortest_path_to_exit(
@@ -161,66 +388,16 @@ def find_shortest_path_to_exit(
     """
     Ritorna gli arc_id del percorso più veloce dal nodo di partenza
     a QUALSIASI nodo in exit_nodes, attraversando scale e piani diversi.
+    Per molte sorgenti usare compute_evacuation_paths (una sola passata).
     """
     if start_node not in G_floor:
         logger.warning(f"Start node {start_node} non nel grafo del piano")
         return None
 
-    # piani di partenza del nodo
-    start_floors = G_floor.nodes[start_node].get("floor_level")
-    start_floors = start_floors if isinstance(start_floors, list) else [start_floors]
-    start_floors = [int(f) for f in start_floors if f is not None]
-
-    G = _build_combined_graph(start_floors)
-    if start_node not in G:
-        logger.error(f"Start node {start_node} non nel grafo combinato")
-        return None
-
-    # filtra archi inattivi
-    for u, v, data in list(G.edges(data=True)):
-        if data.get("active") is False:
-            G.remove_edge(u, v)
-
-    # rimuovi nodi sovraffollati (eccetto lo start)
-    overcrowded = [
-        n for n, d in G.nodes(data=True)
-        if d.get("current_occupancy", 0) >= MAX_NODE_CAPACITY and n != start_node
-    ]
-    if overcrowded:
-        G.remove_nodes_from(overcrowded)
-
-    # tieni solo i target presenti
-    targets = [t for t in (exit_nodes or []) if t in G]
-    if not targets:
-        logger.warning("Nessun target presente nel grafo combinato")
-        return None
-
-    # super-sink per dijkstra multi-target
-    super_sink = object()
-    G2 = G.copy()
-    for t in targets:
-        G2.add_edge(t, super_sink, traversal_time=0.0, arc_id=None, active=True)
-
-    try:
-        nodes_path = nx.dijkstra_path(G2, source=start_node, target=super_sink, weight=_edge_weight)
-    except nx.NetworkXNoPath:
-        logger.warning(f"Nessun path dal nodo {start_node} a target")
-        return None
-
-    # estrai arc_id, ignora l'ultimo verso il super_sink
-    arc_ids: List[int] = []
-    for u, v in zip(nodes_path, nodes_path[1:]):
-        data = G2.get_edge_data(u, v) or {}
-        if data.get("arc_id") is not None:
-            arc_ids.append(int(data["arc_id"]))
-
+    arc_ids = compute_evacuation_paths(G_floor, exit_nodes, [start_node]).get(start_node)
     if not arc_ids:
+        logger.warning(f"Nessun path dal nodo {start_node} a target")
         return None
 
-    try:
-        total = nx.dijkstra_path_length(G2, start_node, super_sink, weight=_edge_weight)
-        logger.info(f"Path migliore da {start_node}: {len(arc_ids)} archi, {total:.1f}s")
-    except Exception:
-        pass
-
+    logger.info(f"Path migliore da {start_node}: {len(arc_ids)} archi")
     return arc_ids
@@ -0,0 +1,127 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import heapq
+import itertools
+import math
+import networkx as nx
+
+Succ = Dict[int, Tuple[int, Optional[int]]]
+
+
+class ShortestPathTree:
+    """
+    Albero dei cammini minimi verso i target (risultato del Dijkstra inverso multi-sorgente)
+    mantenuto in memoria per poterlo riparare quando degli archi vengono disattivati.
+
+    Togliere archi può solo allungare i percorsi: i nodi il cui percorso ottimo non usa
+    nessun arco disattivato restano ottimi. Vanno ricalcolati solo i sottoalberi appesi
+    agli archi rotti, ripartendo dai nodi di confine (non toccati) adiacenti.
+
+    Il grafo G è condiviso (cache del grafo combinato) e non viene modificato:
+    gli archi disattivati sono tenuti in 'disabled'.
+    """
+
+    def __init__(
+        self, G: nx.DiGraph, targets: Iterable[int], blocked: Set[int],
+        dist: Dict[int, float], succ: Succ, weight: Callable
+    ):
+        self.G = G
+        self.targets = frozenset(targets)
+        self.blocked = frozenset(blocked)
+        self.weight = weight
+        self.dist = dist
+        self.succ = succ
+        self.disabled: Set[int] = set()
+        # nodo -> nodi il cui successore nell'albero è quel nodo
+        self.children: Dict[int, Set[int]] = {}
+        # arc_id -> nodo che lo usa come primo arco del proprio percorso
+        self.node_of_arc: Dict[int, int] = {}
+        for u, (v, arc_id) in succ.items():
+            self._link(u, v, arc_id)
+
+    def _link(self, u: int, v: int, arc_id: Optional[int]) -> None:
+        self.children.setdefault(v, set()).add(u)
+        if arc_id is not None:
+            self.node_of_arc[int(arc_id)] = u
+
+    def _unlink(self, u: int) -> None:
+        v, arc_id = self.succ.pop(u)
+        kids = self.children.get(v)
+        if kids is not None:
+            kids.discard(u)
+        if arc_id is not None and self.node_of_arc.get(int(arc_id)) == u:
+            del self.node_of_arc[int(arc_id)]
+
+    def _usable(self, data) -> bool:
+        if data.get("active") is False:
+            return False
+        arc_id = data.get("arc_id")
+        return arc_id is None or int(arc_id) not in self.disabled
+
+    def repair(self, arc_ids: Iterable[int]) -> Set[int]:
+        """
+        Disattiva gli archi indicati e ricalcola solo i nodi il cui percorso li attraversava.
+        Ritorna l'insieme di questi nodi (quelli rimasti senza percorso non sono più in dist/succ).
+        """
+        new = {int(a) for a in arc_ids} - self.disabled
+        if not new:
+            return set()
+        self.disabled |= new
+
+        # 1) nodi che usano direttamente un arco rotto + tutti i loro discendenti
+        affected: Set[int] = set()
+        stack = [self.node_of_arc[a] for a in new if a in self.node_of_arc]
+        while stack:
+            u = stack.pop()
+            if u in affected:
+                continue
+            affected.add(u)
+            stack.extend(self.children.get(u, ()))
+        if not affected:
+            return affected
+
+        for u in affected:
+            self._unlink(u)
+            self.dist.pop(u, None)
+
+        # 2) seed: miglior uscita di ogni nodo colpito verso un nodo non colpito
+        tie = itertools.count()
+        heap: List[Tuple[float, int, int, int, Optional[int]]] = []
+        for u in affected:
+            for v, data in self.G.succ[u].items():
+                if v in affected or v not in self.dist or v in self.blocked or not self._usable(data):
+                    continue
+                nd = self.dist[v] + self.weight(u, v, data)
+                heapq.heappush(heap, (nd, next(tie), u, v, data.get("arc_id")))
+
+        # 3) Dijkstra inverso ristretto ai nodi colpiti
+        while heap:
+            d, _, u, v, arc_id = heapq.heappop(heap)
+            if u in self.dist:
+                continue
+            self.dist[u] = d
+            self.succ[u] = (v, arc_id)
+            self._link(u, v, arc_id)
+            if u in self.blocked:
+                continue
+            for w, data in self.G.pred[u].items():
+                if w in affected and w not in self.dist and self._usable(data):
+                    heapq.heappush(heap, (d + self.weight(w, u, data), next(tie), w, u, data.get("arc_id")))
+
+        return affected
+
+    def route(self, node: int) -> Optional[Tuple[List[int], int]]:
+        """
+        (arc_id del percorso, target raggiunto) per il nodo, None se non ha percorso.
+        """
+        if node not in self.dist:
+            return None
+        arc_ids: List[int] = []
+        cur = node
+        while cur in self.succ:
+            cur, arc_id = self.succ[cur]
+            if arc_id is not None:
+                arc_ids.append(int(arc_id))
+        return arc_ids, cur
+
+    def distance(self, node: int) -> float:
+        return self.dist.get(node, math.inf)
@@ -6,8 +6,11 @@ import os
 
 from MapManager.app.consumer.rabbitmq_consumer import EvacuationConsumer
 from MapManager.app.consumer.alert_consumer import AlertConsumer 
+from MapManager.app.consumer.arc_listener import ArcDisabledListener
 
 from MapManager.app.core.manager import initialize_evacuation_paths
+from MapManager.app.services.floor_index import floor_index
+from MapManager.app.services.db_pool import db_pool
 from MapManager.app.config.logging import setup_logging
 from MapManager.app.core.event_state import EventState
 
@@ -58,7 +61,8 @@ def preload_graphs():
                 })
 
             cur.execute("""
-                SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time
+                SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active,
+                       EXTRACT(EPOCH FROM traversal_time)::float8 AS traversal_time, capacity
                 FROM arcs
                 WHERE initial_node IN (SELECT node_id FROM nodes WHERE %s = ANY(floor_level))
                   AND final_node   IN (SELECT node_id FROM nodes WHERE %s = ANY(floor_level))
@@ -67,14 +71,15 @@ def preload_graphs():
 
             arcs = []
             for r in arc_rows:
-                arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time = r
+                arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time, capacity = r
                 arcs.append({
                     "arc_id": arc_id,
                     "initial_node": initial_node,
                     "final_node": final_node,
                     "x1": x1, "y1": y1, "x2": x2, "y2": y2,
                     "active": active,
-                    "traversal_time": traversal_time
+                    "traversal_time": traversal_time,
+                    "capacity": capacity
                 })
 
             graph_manager.load_graph(floor, nodes, arcs)
@@ -122,11 +127,13 @@ def run_alert_consumer(event_state):
 
 def graceful_shutdown(signum, _frame):
     logger.info("Shutdown initiated, exiting...")
+    db_pool.close()
     sys.exit(0)
 
 def main():
     logger.info("Starting MapManager service")
     preload_graphs()
+    floor_index.rebuild()
 
     for floor in list(graph_manager.graphs.keys()):
         initialize_evacuation_paths(floor_level=floor)
@@ -141,7 +148,10 @@ def main():
     t2 = threading.Thread(target=run_alert_consumer, args=(shared_event_state,),
                           name="Thread-AlertConsumer", daemon=True)
 
-    t1.start(); t2.start()
+    # archi disattivati da MapViewer (NOTIFY arc_disabled) -> riparazione incrementale dei percorsi
+    t3 = threading.Thread(target=ArcDisabledListener().run, name="Thread-ArcDisabledListener", daemon=True)
+
+    t1.start(); t2.start(); t3.start()
     logger.info("Consumers avviati in thread separati.")
     t1.join(); t2.join()
 
@@ -0,0 +1,74 @@
+import random
+
+import networkx as nx
+
+from MapManager.app.services.csr_graph import CSRGraph
+from MapManager.app.services.path_calculator import _reverse_multi_source_dijkstra
+
+
+def _weight(_u, _v, data):
+    return data.get("traversal_time", 1.0)
+
+
+def _random_graph(n_nodes=60, n_edges=240, seed=3):
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(range(100, 100 + n_nodes))
+    arc_id = 0
+    while arc_id < n_edges:
+        u, v = rng.sample(range(100, 100 + n_nodes), 2)
+        if not G.has_edge(u, v):
+            G.add_edge(u, v, arc_id=arc_id, traversal_time=rng.uniform(1.0, 30.0), active=rng.random() > 0.1)
+            arc_id += 1
+    return G
+
+
+def _networkx_reverse_distances(G, targets, blocked=frozenset()):
+    """Distanze minime verso il target più vicino calcolate da networkx sul grafo inverso."""
+    H = nx.DiGraph()
+    H.add_nodes_from(G.nodes)
+    for u, v, data in G.edges(data=True):
+        if data.get("active") is False or v in blocked and v not in targets:
+            continue
+        H.add_edge(v, u, weight=_weight(u, v, data))
+    return nx.multi_source_dijkstra_path_length(H, set(targets), weight="weight")
+
+
+def test_reverse_dijkstra_matches_networkx():
+    G = _random_graph()
+    targets = [100, 101, 102]
+    dist, succ = CSRGraph(G, _weight).reverse_dijkstra(targets)
+
+    expected = _networkx_reverse_distances(G, targets)
+    assert dist.keys() == expected.keys()
+    for node, d in expected.items():
+        assert abs(dist[node] - d) < 1e-9
+
+    # ogni successore segue un arco attivo che realizza la distanza minima
+    for node, (nxt, arc_id) in succ.items():
+        data = G.edges[node, nxt]
+        assert data["active"] and data["arc_id"] == arc_id
+        assert abs(dist[node] - (dist[nxt] + data["traversal_time"])) < 1e-9
+
+
+def test_reverse_dijkstra_blocked_nodes_are_not_traversed():
+    G = _random_graph(seed=11)
+    targets = [100]
+    blocked = {n for n in G.nodes if n % 7 == 0} - set(targets)
+    dist, succ = CSRGraph(G, _weight).reverse_dijkstra(targets, blocked)
+
+    expected = _networkx_reverse_distances(G, targets, blocked)
+    assert dist.keys() == expected.keys()
+    for node, d in expected.items():
+        assert abs(dist[node] - d) < 1e-9
+    assert not any(nxt in blocked for nxt, _arc in succ.values())
+
+
+def test_reverse_dijkstra_matches_the_networkx_backend_exactly():
+    # stessi (dist, succ) del backend networkx, anche a parità di costo
+    G = _random_graph(seed=17)
+    for _u, _v, data in G.edges(data=True):
+        data["traversal_time"] = float(round(data["traversal_time"]))  # molti pareggi
+    targets, blocked = [100, 140], {105, 120}
+    assert CSRGraph(G, _weight).reverse_dijkstra(targets, blocked) == \
+        _reverse_multi_source_dijkstra(G, targets, blocked, weight=_weight)
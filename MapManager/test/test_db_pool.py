@@ -0,0 +1,135 @@
+import threading
+
+import psycopg2
+import pytest
+
+from MapManager.app.services import db_pool as db_pool_module
+from MapManager.app.services.db_pool import ConnectionPool
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql)
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class _Conn:
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.commits = 0
+        self.rollbacks = 0
+        self.executed = []
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class _FakePool:
+    """ThreadedConnectionPool in memoria: riusa le connessioni restituite, ne crea fino a maxconn."""
+
+    def __init__(self, minconn, maxconn, **_kwargs):
+        self.maxconn = maxconn
+        self.idle = []
+        self.created = []
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        conn = _Conn()
+        self.created.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.closed = 1
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        for conn in self.created:
+            conn.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db_pool_module, "ThreadedConnectionPool", _FakePool)
+    return ConnectionPool({"minconn": 1, "maxconn": 2, "checkout_timeout": 0.1, "health_check_idle_seconds": 30})
+
+
+def test_commit_on_success_and_reuse(pool):
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    assert first.commits == 2 and first.rollbacks == 0
+    assert pool.stats()["checkouts"] == 2 and pool.stats()["in_use"] == 0
+
+
+def test_rollback_on_error(pool):
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError("boom")
+    assert conn.rollbacks == 1 and conn.commits == 0
+    assert pool.stats()["errors"] == 1
+    # la connessione torna comunque al pool
+    with pool.connection() as again:
+        assert again is conn
+
+
+def test_checkout_waits_then_times_out_when_exhausted(pool):
+    release = threading.Event()
+    held = threading.Barrier(3)
+
+    def hold():
+        with pool.connection():
+            held.wait()
+            release.wait()
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for t in threads:
+        t.start()
+    held.wait()
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection():
+            pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert pool.stats()["max_in_use"] == 2
+
+
+def test_idle_connection_is_health_checked_and_discarded(pool):
+    with pool.connection() as conn:
+        stale = conn
+    # inattiva da più di health_check_idle e non più valida
+    pool._last_used[id(stale)] -= 60
+    stale.dead = True
+    with pool.connection() as conn:
+        assert conn is not stale
+    assert stale.closed and stale.executed == ["SELECT 1"]
+    assert pool.stats()["health_checks"] == 1 and pool.stats()["discarded"] == 1
+
+
+def test_closed_connection_is_discarded_on_return(pool):
+    with pool.connection() as conn:
+        conn.closed = 1
+    assert pool.stats()["discarded"] == 1
+    with pool.connection() as fresh:
+        assert fresh is not conn
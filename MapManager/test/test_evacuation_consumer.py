@@ -0,0 +1,81 @@
+import pytest
+
+from MapManager.app.consumer import rabbitmq_consumer as consumer_module
+from MapManager.app.consumer.rabbitmq_consumer import EvacuationConsumer
+from MapManager.app.core.event_state import EventState
+
+
+def _nodes(*pairs):
+    return [{"node_id": node_id, "user_ids": user_ids} for node_id, user_ids in pairs]
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    EventState.clear()
+    routed = []
+    monkeypatch.setattr(
+        consumer_module, "handle_evacuations",
+        lambda floor, group, event_type, rabbitmq_handler=None: routed.append((floor, sorted(group), event_type))
+    )
+    monkeypatch.setattr(EvacuationConsumer, "_get_node_floors", lambda self, node_id: [node_id // 100])
+    c = EvacuationConsumer(rabbitmq_handler=None, event_state=EventState)
+    c.routing_mode = "shortest"
+    c.routed = routed
+    yield c
+    EventState.clear()
+
+
+def test_snapshot_replaces_state(consumer):
+    consumer.dangerous_nodes = {999: [1]}
+    to_route = consumer._apply_update({"msg_type": "snapshot", "seq": 5, "dangerous_nodes": _nodes((101, [1, 2]))})
+    assert to_route == [101]
+    assert consumer.dangerous_nodes == {101: [1, 2]}
+    assert consumer.last_seq == 5
+
+
+def test_message_without_type_is_a_snapshot(consumer):
+    consumer.dangerous_nodes = {999: [1]}
+    assert consumer._apply_update({"dangerous_nodes": _nodes((101, [1]))}) == [101]
+    assert consumer.dangerous_nodes == {101: [1]}
+
+
+def test_delta_routes_only_changed_nodes(consumer):
+    consumer._apply_update({"msg_type": "snapshot", "seq": 1, "dangerous_nodes": _nodes((101, [1]), (102, [2]))})
+    to_route = consumer._apply_update({
+        "msg_type": "delta", "seq": 2,
+        "dangerous_nodes": _nodes((103, [3])), "cleared_nodes": [101],
+    })
+    assert to_route == [103]
+    assert consumer.dangerous_nodes == {102: [2], 103: [3]}
+    assert consumer.last_seq == 2
+
+
+def test_sequence_gap_routes_all_known_nodes(consumer):
+    consumer._apply_update({"msg_type": "snapshot", "seq": 1, "dangerous_nodes": _nodes((101, [1]), (102, [2]))})
+    # seq 2 perso
+    to_route = consumer._apply_update({"msg_type": "delta", "seq": 3, "dangerous_nodes": _nodes((103, [3]))})
+    assert sorted(to_route) == [101, 102, 103]
+    assert consumer.last_seq == 3
+    # la sequenza riparte da 3: il delta successivo torna incrementale
+    assert consumer._apply_update({"msg_type": "delta", "seq": 4, "cleared_nodes": [102]}) == []
+    assert sorted(consumer.dangerous_nodes) == [101, 103]
+
+
+def test_first_delta_without_previous_seq_is_not_a_gap(consumer):
+    assert consumer._apply_update({"msg_type": "delta", "seq": 7, "dangerous_nodes": _nodes((101, [1]))}) == [101]
+    assert consumer.last_seq == 7
+
+
+def test_event_change_reroutes_all_known_nodes(consumer):
+    consumer.process_message({"msg_type": "snapshot", "seq": 1, "event": "fire",
+                              "dangerous_nodes": _nodes((101, [1]), (201, [2]))})
+    consumer.routed.clear()
+    consumer.process_message({"msg_type": "delta", "seq": 2, "event": "fire",
+                              "dangerous_nodes": _nodes((102, [3]))})
+    assert consumer.routed == [(1, [102], "fire")]
+
+    consumer.routed.clear()
+    consumer.process_message({"msg_type": "delta", "seq": 3, "event": "flood",
+                              "dangerous_nodes": _nodes((103, [4]))})
+    assert sorted(consumer.routed) == [(1, [101, 102, 103], "flood"), (2, [201], "flood")]
+    assert EventState.get() == "flood"
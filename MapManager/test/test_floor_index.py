@@ -0,0 +1,69 @@
+from MapManager.app.services import floor_index as floor_index_module
+from MapManager.app.services.floor_index import FloorConnectivityIndex
+
+
+# scale: 1 collega i piani 0-1, 2 collega 1-2, 3 (spenta) collega 2-3
+STAIR_ARCS = [
+    {"arc_id": 1, "initial_node_id": 10, "final_node_id": 11, "active": True},
+    {"arc_id": 2, "initial_node_id": 21, "final_node_id": 22, "active": True},
+    {"arc_id": 3, "initial_node_id": 32, "final_node_id": 33, "active": False},
+]
+NODE_FLOORS = {10: [0], 11: [1], 21: [1], 22: [2], 32: [2], 33: [3]}
+
+
+def _index(monkeypatch, stair_arcs=STAIR_ARCS):
+    calls = []
+
+    def read_arcs(raise_errors=False):
+        calls.append("arcs")
+        return stair_arcs
+
+    monkeypatch.setattr(floor_index_module, "get_interfloor_stair_arcs", read_arcs)
+    monkeypatch.setattr(
+        floor_index_module, "get_node_attributes",
+        lambda node_ids, raise_errors=False: {n: {"floor_level": NODE_FLOORS[n]} for n in node_ids}
+    )
+    return FloorConnectivityIndex(), calls
+
+
+def test_reachable_floors_follow_active_stairs(monkeypatch):
+    index, calls = _index(monkeypatch)
+    assert index.reachable_floors([0]) == {0, 1, 2}
+    assert index.reachable_floors([3]) == {3}
+    # piano sconosciuto: solo se stesso
+    assert index.reachable_floors([7]) == {7}
+    # caricato una volta sola, poi solo lookup
+    index.reachable_floors([1])
+    assert calls == ["arcs"]
+
+
+def test_set_arc_active_splits_and_merges_components(monkeypatch):
+    index, _ = _index(monkeypatch)
+    index.rebuild()
+
+    assert index.set_arc_active(2, False)
+    assert index.reachable_floors([0]) == {0, 1}
+    assert index.reachable_floors([2]) == {2}
+
+    assert index.set_arc_active(3, True)
+    assert index.reachable_floors([2]) == {2, 3}
+
+    assert index.set_arc_active(2, True)
+    assert index.reachable_floors([0]) == {0, 1, 2, 3}
+
+    # stato invariato o arco non scala: nessun cambiamento
+    assert not index.set_arc_active(2, True)
+    assert not index.set_arc_active(99, False)
+
+
+def test_failed_rebuild_keeps_previous_index(monkeypatch):
+    index, _ = _index(monkeypatch)
+    index.rebuild()
+
+    def broken(raise_errors=False):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(floor_index_module, "get_interfloor_stair_arcs", broken)
+    assert not index.rebuild()
+    assert index.loaded
+    assert index.reachable_floors([0]) == {0, 1, 2}
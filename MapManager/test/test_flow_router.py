@@ -0,0 +1,82 @@
+import networkx as nx
+import pytest
+
+from MapManager.app.core import manager
+from MapManager.app.core.path_table import path_table
+from MapManager.app.services import flow_router, path_calculator
+from MapManager.app.services.flow_router import assign_flow_routes, primary_route
+
+EXIT = 9
+
+
+def _two_corridors():
+    """
+    1 -> 2 -> 9 breve ma stretto (archi 1, 2: 10 s, capacità 10)
+    1 -> 3 -> 9 più lento ma largo (archi 3, 4: 15 s, capacità 100)
+    """
+    G = nx.DiGraph()
+    for n in (1, 2, 3, EXIT):
+        G.add_node(n, floor_level=0, current_occupancy=0)
+    for arc_id, (u, v, t, cap) in enumerate([(1, 2, 10.0, 10), (2, EXIT, 10.0, 10),
+                                             (1, 3, 15.0, 100), (3, EXIT, 15.0, 100)], start=1):
+        G.add_edge(u, v, arc_id=arc_id, traversal_time=t, capacity=cap, active=True)
+    return G
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    G = _two_corridors()
+    monkeypatch.setattr(flow_router, "_build_combined_graph", lambda floors: G)
+    monkeypatch.setattr(path_calculator, "_build_combined_graph", lambda floors: G)
+    monkeypatch.setattr(path_calculator, "_combined_floors", lambda floors: list(floors))
+    monkeypatch.setattr(path_calculator, "_trees", {})
+    monkeypatch.setattr(path_calculator, "_served_by", {})
+    return G
+
+
+def test_demand_is_split_over_both_corridors(graph):
+    routes = assign_flow_routes([0], [EXIT], {1: 60})
+
+    splits = routes[1]
+    assert {tuple(p) for p, _n, _t in splits} == {(1, 2), (3, 4)}
+    assert sum(n for _p, n, _t in splits) == 60
+    assert all(t == EXIT for _p, _n, t in splits)
+    # il percorso principale è quello con più utenti
+    assert [n for _p, n, _t in splits] == sorted((n for _p, n, _t in splits), reverse=True)
+    assert primary_route(splits) == (splits[0][0], EXIT)
+
+
+def test_small_demand_takes_the_fastest_path(graph):
+    assert assign_flow_routes([0], [EXIT], {1: 3}) == {1: [([1, 2], 3, EXIT)]}
+
+
+def test_overcrowded_targets_and_unknown_nodes(graph):
+    assert assign_flow_routes([0], [EXIT], {42: 5}) == {}
+    graph.nodes[EXIT]["current_occupancy"] = 10**9
+    assert assign_flow_routes([0], [EXIT], {1: 5}) == {}
+
+
+def test_disabled_arc_repeats_the_flow_assignment(graph, monkeypatch):
+    writes = []
+    monkeypatch.setattr(manager, "bulk_update_node_evacuation_paths",
+                        lambda pairs, splits=None: writes.append((dict(pairs), dict(splits or {}))))
+    monkeypatch.setattr(manager, "collect_safe_nodes_multi_floor", lambda floor, event: [EXIT])
+    monkeypatch.setattr(manager, "_flow_routed", {})
+    path_table.clear()
+
+    # prima un percorso "shortest" (albero registrato), poi l'assegnazione capacity per lo stesso nodo
+    assert path_calculator.compute_evacuation_routes(graph, [EXIT], [1]) == {1: ([1, 2], EXIT)}
+    manager.handle_flow_evacuations({0: [1]}, {1: 60}, "Fire")
+    assert 1 not in path_calculator._served_by
+    paths, splits = writes[-1]
+    assert len(splits[1]) == 2
+
+    # l'arco tolto sta solo nella ripartizione (il percorso dell'albero non lo usa):
+    # si rifà l'assegnazione e resta un solo percorso
+    graph.edges[1, 3]["active"] = False
+    assert manager.repair_evacuation_paths([3]) == 1
+    paths, splits = writes[-1]
+    assert paths[1] == [1, 2] and 1 not in splits
+    assert path_table.get(1).path == [1, 2]
+    assert path_table.get(1).event == "Fire"
+    path_table.clear()
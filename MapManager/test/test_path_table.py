@@ -0,0 +1,32 @@
+from MapManager.app.core.path_table import EvacuationPathTable, PathEntry
+
+
+def test_record_and_lookup():
+    table = EvacuationPathTable()
+    table.record([(1, ([10, 11], 5)), (5, ([], 5))], "Fire")
+
+    assert table.get(1) == PathEntry([10, 11], 5, "Fire")
+    assert table.get(5).path == [] and table.get(5).terminal == 5
+    assert table.get(2) is None
+    assert len(table) == 2
+
+
+def test_has_path_to_needs_a_non_empty_path_to_a_current_target():
+    table = EvacuationPathTable()
+    table.record([(1, ([10, 11], 5)), (5, ([], 5))])
+
+    assert table.has_path_to(1, {5, 6})
+    assert not table.has_path_to(1, {6})
+    # il target stesso ha percorso vuoto: va ricalcolato/azzerato dal chiamante
+    assert not table.has_path_to(5, {5})
+    assert not table.has_path_to(2, {5})
+
+
+def test_record_overwrites_and_clear():
+    table = EvacuationPathTable()
+    table.record([(1, ([10], 5))], None)
+    table.record([(1, ([12, 13], 6))], "Flood")
+
+    assert table.get(1) == PathEntry([12, 13], 6, "Flood")
+    table.clear()
+    assert len(table) == 0 and table.get(1) is None
@@ -0,0 +1,86 @@
+import random
+
+import networkx as nx
+
+from MapManager.app.services.path_calculator import _edge_weight, _reverse_multi_source_dijkstra
+from MapManager.app.services.path_tree import ShortestPathTree
+
+
+def _random_graph(n_nodes=80, n_edges=320, seed=5):
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(range(n_nodes))
+    arc_id = 0
+    while arc_id < n_edges:
+        u, v = rng.sample(range(n_nodes), 2)
+        if not G.has_edge(u, v):
+            G.add_edge(u, v, arc_id=arc_id, traversal_time=rng.uniform(1.0, 20.0), active=True)
+            arc_id += 1
+    return G
+
+
+def _without(G, arc_ids):
+    H = G.copy()
+    for _u, _v, data in H.edges(data=True):
+        if data["arc_id"] in arc_ids:
+            data["active"] = False
+    return H
+
+
+def _assert_valid_tree(tree, G, dist):
+    assert tree.dist.keys() == dist.keys()
+    for node, d in dist.items():
+        assert abs(tree.distance(node) - d) < 1e-9
+        arc_ids, terminal = tree.route(node)
+        assert terminal in tree.targets
+        assert not set(arc_ids) & tree.disabled
+        # il percorso segue archi del grafo e ha la lunghezza attesa
+        length, cur = 0.0, node
+        by_arc = {data["arc_id"]: (u, v, data) for u, v, data in G.edges(data=True)}
+        for a in arc_ids:
+            u, v, data = by_arc[a]
+            assert u == cur
+            length += _edge_weight(u, v, data)
+            cur = v
+        assert cur == terminal and abs(length - d) < 1e-9
+
+
+def test_repair_matches_full_recompute():
+    G = _random_graph()
+    targets = [0, 1, 2]
+    blocked = {7, 13}
+    dist, succ = _reverse_multi_source_dijkstra(G, targets, blocked)
+    tree = ShortestPathTree(G, targets, blocked, dict(dist), dict(succ), _edge_weight)
+
+    rng = random.Random(9)
+    disabled = set()
+    for _ in range(6):
+        # archi dell'albero (quelli che contano) più qualche arco a caso
+        used = [a for _v, a in tree.succ.values() if a is not None]
+        batch = set(rng.sample(used, 4)) | set(rng.sample(range(320), 4))
+        disabled |= batch
+        affected = tree.repair(batch)
+
+        expected, _ = _reverse_multi_source_dijkstra(_without(G, disabled), targets, blocked)
+        _assert_valid_tree(tree, G, expected)
+        # i nodi non toccati mantengono la distanza di prima
+        assert all(n in affected or n not in dist or abs(tree.distance(n) - dist[n]) < 1e-9 for n in expected)
+        dist = dict(tree.dist)
+
+
+def test_repair_reports_nodes_left_without_path():
+    # 3 -> 2 -> 0 è l'unico percorso di 3 e 2; 1 -> 0 resta intatto
+    G = nx.DiGraph()
+    G.add_edge(3, 2, arc_id=30, traversal_time=1.0)
+    G.add_edge(2, 0, arc_id=20, traversal_time=1.0)
+    G.add_edge(1, 0, arc_id=10, traversal_time=1.0)
+    dist, succ = _reverse_multi_source_dijkstra(G, [0])
+    tree = ShortestPathTree(G, [0], set(), dict(dist), dict(succ), _edge_weight)
+
+    assert tree.repair([20]) == {2, 3}
+    assert tree.route(2) is None and tree.route(3) is None
+    assert tree.route(1) == ([10], 0)
+    # già disattivato: nessun nodo da ricalcolare
+    assert tree.repair([20]) == set()
+    # arco non usato dall'albero
+    assert tree.repair([30]) == set()
@@ -0,0 +1,130 @@
+import networkx as nx
+import pytest
+
+from MapViewer.app.services.graph_manager import graph_manager
+
+from MapManager.app.core import manager
+from MapManager.app.core.path_table import path_table
+from MapManager.app.services import path_calculator
+
+
+def _floor_graph():
+    """
+    Piano 0, uscite 8 e 9:
+      1 -> 2 -> 9 (archi 12, 29), alternativa 1 -> 3 -> 9 (archi 13, 39) più lenta
+      4 -> 9 (arco 49), alternativa 4 -> 8 (arco 48) più lenta
+      5 -> 9 (arco 59) è l'unico arco di 5
+    """
+    G = nx.DiGraph()
+    for n in (1, 2, 3, 4, 5, 8, 9):
+        G.add_node(n, floor_level=0, current_occupancy=0, node_type="outdoor" if n in (8, 9) else "room")
+    for arc_id, u, v, t in [(12, 1, 2, 1.0), (29, 2, 9, 1.0), (13, 1, 3, 5.0), (39, 3, 9, 5.0),
+                            (49, 4, 9, 1.0), (48, 4, 8, 2.0), (59, 5, 9, 1.0)]:
+        G.add_edge(u, v, arc_id=arc_id, traversal_time=t, active=True)
+    return G
+
+
+@pytest.fixture
+def floor(monkeypatch):
+    G = _floor_graph()
+    monkeypatch.setattr(graph_manager, "graphs", {0: G})
+    monkeypatch.setattr(path_calculator, "_build_combined_graph", lambda floors: G)
+    monkeypatch.setattr(path_calculator, "_combined_floors", lambda floors: list(floors))
+    monkeypatch.setattr(path_calculator, "_trees", {})
+    monkeypatch.setattr(path_calculator, "_served_by", {})
+    monkeypatch.setattr(manager, "_collect_default_exits_multi_floor", lambda floor: [8, 9])
+    monkeypatch.setattr(manager, "_flow_routed", {})
+    monkeypatch.setattr(path_table, "_disabled", set())
+    writes = []
+    monkeypatch.setattr(manager, "bulk_update_node_evacuation_paths",
+                        lambda pairs, splits=None: writes.append((dict(pairs), dict(splits or {}))))
+    path_table.clear()
+    yield G, writes
+    path_table.clear()
+
+
+def _init(G, targets, sources, event=None):
+    routes = path_calculator.compute_evacuation_routes(G, targets, sources)
+    manager._save_routes(routes, event)
+    return routes
+
+
+def _disable(G, arc_id):
+    for _u, _v, data in G.edges(data=True):
+        if data["arc_id"] == arc_id:
+            data["active"] = False
+    # come invalidate_graph_cache: il grafo combinato (e il suo CSR) va ricostruito
+    G.graph.pop("csr", None)
+
+
+def test_repair_rewrites_only_nodes_on_the_disabled_arc(floor):
+    G, writes = floor
+    _init(G, [9], [1, 4, 5], "Fire")
+    writes.clear()
+
+    _disable(G, 29)
+    assert manager.repair_evacuation_paths([29]) == 1
+    paths, splits = writes[-1]
+    assert paths == {1: [13, 39]} and splits == {}
+    # stesso risultato di un ricalcolo completo, evento conservato
+    assert path_calculator.compute_evacuation_paths(G, [9], [1]) == {1: [13, 39]}
+    assert path_table.get(1).path == [13, 39] and path_table.get(1).event == "Fire"
+    assert path_table.has_path_to(4, {9})
+
+
+def test_unreachable_node_falls_back_to_full_recompute(floor):
+    G, writes = floor
+    # l'uscita 8 è sovraffollata quando l'albero viene costruito: 4 va verso 9
+    G.nodes[8]["current_occupancy"] = 10**9
+    _init(G, [8, 9], [4])
+    assert path_table.get(4).path == [49]
+    G.nodes[8]["current_occupancy"] = 0
+    writes.clear()
+
+    _disable(G, 49)
+    assert manager.repair_evacuation_paths([49]) == 1
+    assert writes[-1][0] == {4: [48]}
+    assert path_table.get(4).path == [48] and path_table.has_path_to(4, {8})
+
+
+def test_node_without_any_path_is_left_for_the_next_evacuation(floor):
+    G, writes = floor
+    _init(G, [9], [1, 5])
+    writes.clear()
+
+    _disable(G, 59)
+    assert manager.repair_evacuation_paths([59]) == 0
+    assert writes == []
+    # non più in tabella: handle_evacuations non lo salta
+    assert path_table.get(5) is None
+    assert not path_table.has_path_to(5, {9})
+    assert path_table.has_path_to(1, {9})
+
+
+def test_saved_path_on_a_disabled_arc_is_not_a_valid_path(floor):
+    G, _writes = floor
+    # percorso salvato da un'altra fonte (nessun albero lo ripara)
+    manager._save_routes({2: ([29], 9)}, "Fire")
+    assert path_table.has_path_to(2, {9})
+    _disable(G, 29)
+    manager.repair_evacuation_paths([29])
+    assert not path_table.has_path_to(2, {9})
+
+
+def test_repair_drops_splits_that_use_disabled_arcs(floor):
+    G, writes = floor
+    _init(G, [8, 9], [4])
+    splits = {4: [{"evacuation_path": [49], "users": 3}, {"evacuation_path": [48], "users": 2}]}
+    manager._save_routes({4: ([49], 9)}, None, splits)
+    assert path_table.usable_splits(4) == splits[4]
+
+    # un arco disattivato che nessuna ripartizione usa non la tocca
+    path_table.disable_arcs([29])
+    assert path_table.usable_splits(4) == splits[4]
+
+    writes.clear()
+    _disable(G, 49)
+    manager.repair_evacuation_paths([49])
+    paths, saved_splits = writes[-1]
+    assert paths == {4: [48]} and saved_splits == {}
+    assert path_table.get(4).splits is None
@@ -32,7 +32,8 @@ def get_graph_json(floor_level: int, image_filename: str, image_width: int, imag
             })
 
         cur.execute("""
-            SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time::text AS traversal_time
+            SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active,
+                   EXTRACT(EPOCH FROM traversal_time)::float8 AS traversal_time
             FROM arcs
             WHERE initial_node IN (SELECT node_id FROM nodes WHERE %s = ANY(floor_level))
             AND final_node IN (SELECT node_id FROM nodes WHERE %s = ANY(floor_level))
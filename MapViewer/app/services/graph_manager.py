@@ -23,11 +23,29 @@ def time_str_to_seconds(time_val):
         return int(h) * 3600 + int(m) * 60 + int(float(sec))
     return 1
 
+def traversal_time_to_seconds(time_val) -> float:
+    """
+    traversal_time come float (secondi). I valori numerici (EXTRACT(EPOCH ...)) passano così come sono,
+    stringhe/timedelta vengono convertite una sola volta al caricamento del grafo.
+    """
+    if time_val is None:
+        return 1.0
+    if isinstance(time_val, (int, float)):
+        return float(time_val)
+    return float(time_str_to_seconds(time_val))
+
 class GraphManager:
     def __init__(self):
         self.graphs = {}
         self.lock = Lock()
         self.height_mapper = HeightMapper(Z_RANGES, SCALE_CONFIG)
+        # Incrementata ad ogni modifica dei grafi: le cache derivate (es. grafo multi-piano) la usano come chiave
+        self.version = 0
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+            return self.version
 
     def get_graph(self, floor_level):
         with self.lock:
@@ -81,6 +99,7 @@ class GraphManager:
             with self.lock:
                 G.add_node(node_id, x=x_px, y=y_px, floor_level=floor, node_type=node_type,
                            current_occupancy=0, capacity=cap)
+                self.version += 1
 
             return {
                 "node_id": node_id,
@@ -109,6 +128,7 @@ class GraphManager:
 
             G.add_edge(node1, node2, active=True)
             self._persist_edge(node1, node2, floor)
+            self.version += 1
 
     def _persist_edge(self, node1: int, node2: int, floor: int):
         conn = psycopg2.connect(**DATABASE_CONFIG)
@@ -162,7 +182,8 @@ class GraphManager:
             print(f"Arco {arc_id} inserito tra nodi {node1} e {node2}")
             if self.graphs.get(floor) and self.graphs[floor].has_edge(node1, node2):
                 self.graphs[floor].edges[node1, node2]["arc_id"] = arc_id
-                self.graphs[floor].edges[node1, node2]["traversal_time"] = traversal_seconds
+                self.graphs[floor].edges[node1, node2]["traversal_time"] = float(traversal_seconds)
+                self.graphs[floor].edges[node1, node2]["capacity"] = capacity
         finally:
             cur.close()
             conn.close()
@@ -200,11 +221,13 @@ class GraphManager:
                 if from_node is None or to_node is None:
                     continue
                 
-                traversal_time_str = arc.get("traversal_time", "00:00:01")
-                traversal_time_sec = time_str_to_seconds(traversal_time_str)
+                # i loader leggono EXTRACT(EPOCH FROM traversal_time)::float8: qui arriva già in secondi
+                traversal_time_sec = traversal_time_to_seconds(arc.get("traversal_time", 1.0))
                 
-                G.add_edge(from_node, to_node, active=arc.get("active", True), arc_id=arc.get("arc_id"), traversal_time=traversal_time_sec)
+                G.add_edge(from_node, to_node, active=arc.get("active", True), arc_id=arc.get("arc_id"),
+                           traversal_time=traversal_time_sec, capacity=arc.get("capacity"))
             self.graphs[floor_level] = G
+            self.version += 1
             print(f"Graph for floor {floor_level} loaded with {len(nodes)} nodes and {len(arcs)} arcs")
 
     def _load_floor_graph(self, floor_level):
@@ -235,7 +258,8 @@ class GraphManager:
             
             # Carica archi correlati
             cur.execute("""
-                SELECT arc_id, initial_node, final_node, active, traversal_time 
+                SELECT arc_id, initial_node, final_node, active,
+                       EXTRACT(EPOCH FROM traversal_time)::float8 AS traversal_time, capacity
                 FROM arcs 
                 WHERE initial_node IN (
                     SELECT node_id FROM nodes WHERE %s = ANY(floor_level)
@@ -244,13 +268,14 @@ class GraphManager:
             
             arcs = []
             for row in cur.fetchall():
-                arc_id, initial_node, final_node, active, traversal_time = row
+                arc_id, initial_node, final_node, active, traversal_time, capacity = row
                 arcs.append({
                     "arc_id": arc_id,
                     "initial_node": initial_node,
                     "final_node": final_node,
                     "active": active,
-                    "traversal_time": traversal_time
+                    "traversal_time": traversal_time,
+                    "capacity": capacity
                 })
             
             # Costruisci il grafo
@@ -260,12 +285,13 @@ class GraphManager:
                 G.add_node(node['id'], **node)
             
             for arc in arcs:
-                tt = time_str_to_seconds(arc.get("traversal_time"))
+                tt = traversal_time_to_seconds(arc.get("traversal_time"))
                 G.add_edge(arc['initial_node'], arc['final_node'], 
                         arc_id=arc['arc_id'], active=arc['active'],
-                        traversal_time=tt)
+                        traversal_time=tt, capacity=arc['capacity'])
 
-            self.graphs[floor_level] = G    
+            self.graphs[floor_level] = G
+            self.version += 1
         finally:
             cur.close()
             conn.close()
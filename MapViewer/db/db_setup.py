@@ -24,11 +24,17 @@ def create_tables():
             current_occupancy INT DEFAULT 0, 
             safe BOOLEAN DEFAULT TRUE,
             evacuation_path INTEGER[],
+            evacuation_path_splits JSONB,
             last_modified TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
             last_modified_by VARCHAR(100) DEFAULT 'system'                        
         );
     ''')
     
+    # Ripartizione degli utenti su più percorsi (routing "capacity" di MapManager)
+    cursor.execute('''
+        ALTER TABLE nodes ADD COLUMN IF NOT EXISTS evacuation_path_splits JSONB;
+    ''')
+
     cursor.execute('''
         CREATE OR REPLACE FUNCTION nodes_update_metadata()
         RETURNS TRIGGER AS $$
@@ -48,6 +54,55 @@ def create_tables():
         EXECUTE FUNCTION nodes_update_metadata();
     ''')
 
+    # Notify safe-flag changes: PositionManager keeps an in-memory snapshot of nodes.safe
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION notify_node_safe_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('node_safe_changed',
+                    json_build_object('node_id', OLD.node_id, 'deleted', TRUE)::text);
+                RETURN OLD;
+            END IF;
+            IF TG_OP = 'INSERT' OR NEW.safe IS DISTINCT FROM OLD.safe THEN
+                PERFORM pg_notify('node_safe_changed',
+                    json_build_object('node_id', NEW.node_id, 'safe', NEW.safe)::text);
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+    cursor.execute('''
+        DROP TRIGGER IF EXISTS trg_nodes_safe_notify ON nodes;
+        CREATE TRIGGER trg_nodes_safe_notify
+        AFTER INSERT OR UPDATE OF safe OR DELETE ON nodes
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_node_safe_changed();
+    ''')
+
+    # Notify evacuation path changes: PositionManager caches each node's path for dispatch
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION notify_evacuation_path_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF NEW.evacuation_path IS DISTINCT FROM OLD.evacuation_path
+               OR NEW.evacuation_path_splits IS DISTINCT FROM OLD.evacuation_path_splits THEN
+                PERFORM pg_notify('evacuation_path_changed', NEW.node_id::text);
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+    cursor.execute('''
+        DROP TRIGGER IF EXISTS trg_nodes_evacuation_path_notify ON nodes;
+        CREATE TRIGGER trg_nodes_evacuation_path_notify
+        AFTER UPDATE OF evacuation_path, evacuation_path_splits ON nodes
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_evacuation_path_changed();
+    ''')
+
     # Table for current positions
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS current_position (
@@ -76,6 +131,20 @@ def create_tables():
         );
     ''')
 
+    # One historical row per (user, node): target of PositionManager's ON CONFLICT DO NOTHING.
+    # Duplicates left by the old SELECT-then-INSERT race are removed first (earliest row kept,
+    # ctid breaks ties between rows with the same event_time so exactly one row survives).
+    cursor.execute('''
+        DELETE FROM user_historical_position a
+        USING user_historical_position b
+        WHERE a.user_id = b.user_id
+          AND a.node_id = b.node_id
+          AND (a.event_time > b.event_time OR (a.event_time = b.event_time AND a.ctid > b.ctid));
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_historical_position_user_node
+        ON user_historical_position (user_id, node_id);
+    ''')
 
     # Table for map arcs
     cursor.execute('''
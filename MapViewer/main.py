@@ -144,7 +144,8 @@ def preload_graphs():
                 })
 
             cur.execute("""
-                SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time
+                SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active,
+                       EXTRACT(EPOCH FROM traversal_time)::float8 AS traversal_time
                 FROM arcs
                 WHERE initial_node IN (SELECT node_id FROM nodes WHERE  %s = ANY(floor_level))
                 AND final_node IN (SELECT node_id FROM nodes WHERE  %s = ANY(floor_level))
@@ -164,7 +165,7 @@ def preload_graphs():
                     "x2": x2,
                     "y2": y2,
                     "active": active,
-                    "traversal_time": float(traversal_time)
+                    "traversal_time": traversal_time if traversal_time is not None else 1.0
                 })
 
             graph_manager.load_graph(floor, nodes, arcs)
@@ -242,12 +243,13 @@ def get_graph(floor: int):
         nodes = [{"id": r[0], "x": r[1], "y": r[2], "node_type": r[3], "current_occupancy": r[4], "capacity": r[5], "safe": bool(r[6])} for r in cur.fetchall()]
 
         cur.execute("""
-            SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active, traversal_time
+            SELECT arc_id, initial_node, final_node, x1, y1, x2, y2, active,
+                   EXTRACT(EPOCH FROM traversal_time)::float8 AS traversal_time
             FROM arcs
             WHERE initial_node IN (SELECT node_id FROM nodes WHERE  %s = ANY(floor_level))
             AND final_node IN (SELECT node_id FROM nodes WHERE  %s = ANY(floor_level))
         """, (floor, floor))
-        arcs = [{"arc_id": r[0], "initial_node": r[1], "final_node": r[2], "x1": r[3], "y1": r[4], "x2": r[5], "y2": r[6], "active": r[7], "traversal_time": float(r[8])} for r in cur.fetchall()]
+        arcs = [{"arc_id": r[0], "initial_node": r[1], "final_node": r[2], "x1": r[3], "y1": r[4], "x2": r[5], "y2": r[6], "active": r[7], "traversal_time": r[8] if r[8] is not None else 1.0} for r in cur.fetchall()]
           
         with graph_manager.lock:
             if floor not in graph_manager.graphs:
@@ -296,6 +298,8 @@ def disable_edge(data: dict = Body(...)):
         updated = cur.fetchone()
         if not updated:
             raise HTTPException(status_code=404, detail="Arc not found")
+        # MapManager ripara solo i percorsi che passavano da questo arco (consegnato al commit)
+        cur.execute("SELECT pg_notify('arc_disabled', %s)", (str(updated[0]),))
         conn.commit()
     finally:
         cur.close()
@@ -1,8 +1,31 @@
 import psycopg2
 import time
+from psycopg2.extras import execute_values
 from PositionManager.db.db_connection import create_connection
+from PositionManager.db.evacuation_paths import EvacuationPathCache
+from PositionManager.db.history_writer import HistoryWriter
+from PositionManager.db.node_safety import NodeSafetySnapshot
 from PositionManager.utils.logger import logger
 
+# Single statements shared by the one-row and the bulk (execute_values) variants:
+# the VALUES placeholder is filled with one row or with a whole batch.
+UPSERT_CURRENT_POSITION_SQL = """
+    INSERT INTO current_position (user_id, x, y, z, node_id, danger)
+    VALUES %s
+    ON CONFLICT (user_id) DO UPDATE
+    SET x = EXCLUDED.x, y = EXCLUDED.y, z = EXCLUDED.z,
+        node_id = EXCLUDED.node_id, danger = EXCLUDED.danger;
+"""
+
+# Relies on the unique index on (user_id, node_id) created in MapViewer/db/db_setup.py
+INSERT_HISTORICAL_POSITION_SQL = """
+    INSERT INTO user_historical_position (user_id, x, y, z, node_id, danger)
+    VALUES %s
+    ON CONFLICT (user_id, node_id) DO NOTHING;
+"""
+
+POSITION_ROW_TEMPLATE = "(%s::integer, %s::integer, %s::integer, %s::integer, %s::integer, %s::boolean)"
+
 class DBManager:
     """
     A class responsible for managing interactions with the PostgreSQL database.
@@ -19,15 +42,21 @@ class DBManager:
         Initializes the DBManager instance by establishing a connection to the database.
         """
         self.conn = create_connection()
-        self.node_safe_cache = {}
-        self.cache_ttl = 5
+        # nodes.safe in memory, updated via LISTEN/NOTIFY (see NodeSafetySnapshot)
+        self.node_safety = NodeSafetySnapshot()
+        self.node_safety.start()
+        # user_historical_position is written in background batches (see HistoryWriter)
+        self.history = HistoryWriter()
+        # nodes.evacuation_path per node, invalidated via LISTEN/NOTIFY and paths_ready
+        self.evacuation_paths = EvacuationPathCache()
+        self.evacuation_paths.start()
 
     def upsert_current_position(self, user_id, x, y, z, node_id, danger):
         """
         Inserts or updates a user's position in the `current_position` table.
 
-        If the user already exists in the `current_position` table, their position is updated.
-        Otherwise, a new record is inserted.
+        A single `INSERT ... ON CONFLICT (user_id) DO UPDATE` statement: the row is
+        created the first time the user is seen and overwritten afterwards.
 
         Args:
             user_id (int): The user's unique identifier.
@@ -39,34 +68,20 @@ class DBManager:
         """
         try:
             with self.conn.cursor() as cursor:
-                # Check if the user already exists in the current_position table
-                cursor.execute("""
-                    SELECT 1 FROM current_position WHERE user_id = %s;
-                """, (user_id,))
-                result = cursor.fetchone()
-
-                if result:  # If the user exists, update their position
-                    cursor.execute("""
-                        UPDATE current_position
-                        SET x = %s, y = %s, z = %s, node_id = %s, danger = %s
-                        WHERE user_id = %s;
-                    """, (x, y, z, node_id, danger, user_id))
-                else:  # If the user doesn't exist, insert a new record
-                    cursor.execute("""
-                        INSERT INTO current_position (user_id, x, y, z, node_id, danger)
-                        VALUES (%s, %s, %s, %s, %s, %s);
-                    """, (user_id, x, y, z, node_id, danger))
-
-                self.conn.commit()
+                cursor.execute(UPSERT_CURRENT_POSITION_SQL % "(%s, %s, %s, %s, %s, %s)",
+                               (user_id, x, y, z, node_id, danger))
+            self.conn.commit()
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Failed to upsert current_position: {e}")
 
     def insert_historical_position(self, user_id, x, y, z, node_id, danger):
         """
         Inserts a user's position into the `user_historical_position` table.
 
-        This method only inserts a new record if the combination of `user_id` and `node_id` does not already exist
-        in the `user_historical_position` table.
+        Only the first position of a user at a node is kept: the insert is a single
+        `ON CONFLICT (user_id, node_id) DO NOTHING` statement backed by a unique index,
+        so concurrent writers cannot create duplicates.
 
         Args:
             user_id (int): The user's unique identifier.
@@ -78,24 +93,114 @@ class DBManager:
         """
         try:
             with self.conn.cursor() as cursor:
-                # Check if a record with the same user_id and node_id already exists in the historical table
-                cursor.execute("""
-                    SELECT 1 FROM user_historical_position WHERE user_id = %s AND node_id = %s;
-                """, (user_id, node_id))
-                result = cursor.fetchone()
-
-                if result:  # If the record exists, do nothing
-                    logger.info(f"User {user_id} at node {node_id} already exists in the historical table.")
-                else:  # If the record doesn't exist, insert it
-                    cursor.execute("""
-                        INSERT INTO user_historical_position (user_id, x, y, z, node_id, danger)
-                        VALUES (%s, %s, %s, %s, %s, %s);
-                    """, (user_id, x, y, z, node_id, danger))
-                    self.conn.commit()
-                    logger.info(f"Inserted historical position for user {user_id} at node {node_id}.")
+                cursor.execute(INSERT_HISTORICAL_POSITION_SQL % "(%s, %s, %s, %s, %s, %s)",
+                               (user_id, x, y, z, node_id, danger))
+                inserted = cursor.rowcount
+            self.conn.commit()
+            if inserted:
+                logger.debug(f"Inserted historical position for user {user_id} at node {node_id}.")
+            else:
+                logger.debug(f"User {user_id} at node {node_id} already exists in the historical table.")
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Failed to insert into user_historical_position: {e}")
 
+    @staticmethod
+    def _position_rows(positions):
+        """
+        Splits positions (in arrival order) into the rows to upsert and the rows to keep in history:
+        the last position of each user wins for `current_position`, the first (user_id, node_id)
+        occurrence wins for the history.
+        """
+        current = {}
+        history = {}
+        for p in positions:
+            row = (p["user_id"], p["x"], p["y"], p["z"], p["node_id"], p["danger"])
+            current[p["user_id"]] = row
+            history.setdefault((p["user_id"], p["node_id"]), row)
+        return list(current.values()), list(history.values())
+
+    def _bulk(self, cursor, sql, rows):
+        execute_values(cursor, sql, rows, template=POSITION_ROW_TEMPLATE, page_size=max(1, len(rows)))
+        return cursor.rowcount
+
+    def upsert_current_positions(self, positions):
+        """
+        Bulk variant of `upsert_current_position`: one multi-row upsert, one commit.
+
+        Args:
+            positions (list): Dicts with user_id, x, y, z, node_id and danger, in arrival order.
+
+        Returns:
+            int: Number of users upserted (0 on failure).
+        """
+        current, _ = self._position_rows(positions)
+        if not current:
+            return 0
+        try:
+            with self.conn.cursor() as cursor:
+                self._bulk(cursor, UPSERT_CURRENT_POSITION_SQL, current)
+            self.conn.commit()
+            return len(current)
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to bulk upsert current_position: {e}")
+            return 0
+
+    def insert_historical_positions(self, positions):
+        """
+        Bulk variant of `insert_historical_position`: one multi-row insert, one commit.
+
+        Args:
+            positions (list): Dicts with user_id, x, y, z, node_id and danger, in arrival order.
+
+        Returns:
+            int: Number of historical rows actually inserted.
+        """
+        _, history = self._position_rows(positions)
+        if not history:
+            return 0
+        try:
+            with self.conn.cursor() as cursor:
+                inserted = self._bulk(cursor, INSERT_HISTORICAL_POSITION_SQL, history)
+            self.conn.commit()
+            return inserted
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to bulk insert into user_historical_position: {e}")
+            return 0
+
+    def apply_positions_batch(self, positions):
+        """
+        Applies a batch of positions: one multi-row upsert into `current_position` in a single
+        transaction. Once it is committed, the historical rows (same rules as
+        `insert_historical_positions`) are handed to the background `HistoryWriter`, so history
+        durability is not on the latency path of danger detection.
+
+        Args:
+            positions (list): Dicts with user_id, x, y, z, node_id and danger, in arrival order.
+
+        Returns:
+            bool: True if the batch was committed, False if it was rolled back.
+        """
+        current, history = self._position_rows(positions)
+        if not current:
+            return True
+        try:
+            with self.conn.cursor() as cursor:
+                self._bulk(cursor, UPSERT_CURRENT_POSITION_SQL, current)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to apply positions batch: {e}")
+            return False
+        queued = self.history.submit(history)
+        logger.info(
+            f"Applied batch of {len(positions)} positions: "
+            f"{len(current)} users upserted, {queued} historical rows queued."
+        )
+        return True
+
     def get_dangerous_node_aggregates(self):
         """
         Retrieves an aggregated list of dangerous nodes, where the danger status of users is TRUE.
@@ -208,12 +313,13 @@ class DBManager:
             return False  # Assume not safe if query fails
 
     def is_node_safe(self, node_id):
-        import time
-        now = time.time()
-        if node_id in self.node_safe_cache:
-            safe, ts = self.node_safe_cache[node_id]
-            if now - ts < self.cache_ttl:
-                return safe  # ritorna valore dalla cache
+        """
+        Returns the node's `safe` flag from the in-memory snapshot; the database is queried
+        only while the snapshot is not in sync (startup or listener reconnection).
+        """
+        safe = self.node_safety.get(node_id)
+        if safe is not None:
+            return safe
 
         try:
             with self.conn.cursor() as cursor:
@@ -223,9 +329,7 @@ class DBManager:
                     WHERE node_id = %s;
                 """, (node_id,))
                 result = cursor.fetchone()
-                safe = bool(result[0]) if result else False
-                self.node_safe_cache[node_id] = (safe, now)  # aggiorna cache
-                return safe
+                return bool(result[0]) if result else False
         except Exception as e:
             logger.error(f"Failed to retrieve safe flag for node {node_id}: {e}")
             return False
@@ -264,29 +368,83 @@ class DBManager:
 
 
 
-    def get_aggregated_evacuation_data(self):
+    @staticmethod
+    def split_users(user_ids, splits):
+        """
+        Distributes the users of a node over the path splits computed by MapManager
+        (capacity routing), proportionally to the planned user counts.
+
+        The counts were computed on an earlier snapshot, so they are rescaled to the
+        current users with the largest-remainder method; user ids are sorted so the
+        same user keeps the same path across dispatches.
+
+        Args:
+            user_ids (list): Users currently in danger at the node.
+            splits (list): [{"evacuation_path": [...], "users": n}, ...]
+
+        Returns:
+            list: (user_ids, evacuation_path) pairs, one per non-empty split.
+        """
+        users = sorted(user_ids)
+        weights = [max(0, int(s.get("users") or 0)) for s in splits]
+        if not any(weights):
+            weights = [1] * len(splits)
+        total = sum(weights)
+
+        quotas = [len(users) * w / total for w in weights]
+        counts = [int(q) for q in quotas]
+        by_remainder = sorted(range(len(splits)), key=lambda i: quotas[i] - counts[i], reverse=True)
+        for i in by_remainder[:len(users) - sum(counts)]:
+            counts[i] += 1
+
+        out, start = [], 0
+        for split, count in zip(splits, counts):
+            if count:
+                out.append((users[start:start + count], split.get("evacuation_path") or []))
+            start += count
+        return out
+
+    def get_aggregated_evacuation_data(self, membership=None):
         """
         Ritorna una lista di dict con node_id, user_ids e evacuation_path.
+        Se MapManager ha ripartito gli utenti di un nodo su più percorsi
+        (evacuation_path_splits) il nodo compare una volta per percorso.
+
+        Args:
+            membership (dict, optional): node_id -> user_ids in pericolo (PositionTracker).
+                Se presente i percorsi arrivano dalla cache per nodo (una sola query per i
+                nodi mancanti); altrimenti join di current_position con nodes.
         """
         try:
-            with self.conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT cp.node_id, array_agg(cp.user_id), n.evacuation_path
-                    FROM current_position cp
-                    JOIN nodes n ON cp.node_id = n.node_id
-                    WHERE cp.danger = TRUE
-                    GROUP BY cp.node_id, n.evacuation_path;
-                """)
-                results = cursor.fetchall()
-                # Trasformo in lista di dict per garantire formato coerente
-                return [
-                    {
-                        "node_id": node_id,
-                        "user_ids": user_ids,
-                        "evacuation_path": evacuation_path if isinstance(evacuation_path, list) else [evacuation_path]
-                    }
-                    for node_id, user_ids, evacuation_path in results
+            if membership is not None:
+                paths = self.evacuation_paths.get_many(list(membership), self.conn)
+                results = [
+                    (node_id, user_ids, *paths[node_id])
+                    for node_id, user_ids in membership.items() if node_id in paths
                 ]
+            else:
+                with self.conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT cp.node_id, array_agg(cp.user_id), n.evacuation_path, n.evacuation_path_splits
+                        FROM current_position cp
+                        JOIN nodes n ON cp.node_id = n.node_id
+                        WHERE cp.danger = TRUE
+                        GROUP BY cp.node_id, n.evacuation_path, n.evacuation_path_splits;
+                    """)
+                    results = cursor.fetchall()
+            # Trasformo in lista di dict per garantire formato coerente
+            data = []
+            for node_id, user_ids, evacuation_path, splits in results:
+                if splits:
+                    for split_users, split_path in self.split_users(user_ids, splits):
+                        data.append({"node_id": node_id, "user_ids": split_users, "evacuation_path": split_path})
+                    continue
+                data.append({
+                    "node_id": node_id,
+                    "user_ids": user_ids,
+                    "evacuation_path": evacuation_path if isinstance(evacuation_path, list) else [evacuation_path]
+                })
+            return data
         except Exception as e:
             logger.error(f"Failed to get aggregated evacuation data: {e}")
             return []
@@ -295,6 +453,7 @@ class DBManager:
 
     def close(self):
         """
-        Closes the connection to the PostgreSQL database.
+        Flushes the pending historical rows and closes the connection to the PostgreSQL database.
         """
+        self.history.close()
         self.conn.close()
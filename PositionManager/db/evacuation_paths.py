@@ -0,0 +1,170 @@
+import os
+import select
+import threading
+import time
+
+import psycopg2.extensions
+
+from PositionManager.db.db_connection import create_connection
+from PositionManager.utils.logger import logger
+
+EVACUATION_PATH_CHANNEL = "evacuation_path_changed"
+
+
+class EvacuationPathCache:
+    """
+    Per-node cache of `nodes.evacuation_path` / `nodes.evacuation_path_splits`.
+
+    Entries are loaded on demand, all missing nodes with a single query, and dropped when
+    the trigger `trg_nodes_evacuation_path_notify` (MapViewer/db/db_setup.py) notifies a change
+    on `evacuation_path_changed`. When MapManager sends `paths_ready` the ack may arrive before
+    the listener has read the notifications: `sync()` makes the listener run a round trip on its
+    connection, which delivers every notification committed before it, and apply them. Only the
+    nodes whose paths changed are dropped, the rest of the cache stays warm.
+
+    Nodes are cached only while the listener is connected: otherwise a missed notification
+    could leave a stale path in the cache.
+    """
+
+    def __init__(self, poll_timeout=5.0, reconnect_delay=3.0):
+        self._lock = threading.Lock()
+        self._paths = {}            # node_id -> (evacuation_path, evacuation_path_splits)
+        self._generation = 0        # bumped by every invalidation
+        self.listening = False
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._thread = None
+        # sync(): the caller wakes the listener through a pipe and waits for its round trip
+        self._wake_r, self._wake_w = os.pipe()
+        self._sync_cond = threading.Condition()
+        self._sync_requested = 0
+        self._sync_done = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="EvacuationPathListener", daemon=True)
+            self._thread.start()
+
+    def invalidate(self, node_ids=None):
+        """
+        Drops the given nodes, or the whole cache if node_ids is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if node_ids is None:
+                self._paths = {}
+            else:
+                for node_id in node_ids:
+                    self._paths.pop(node_id, None)
+
+    def sync(self, timeout=2.0):
+        """
+        Waits until the listener has applied every notification committed before this call.
+
+        Returns:
+            bool: False if the listener is not connected or did not answer within timeout
+            (the caller should then fall back to `invalidate()`).
+        """
+        if not self.listening:
+            return False
+        with self._sync_cond:
+            self._sync_requested += 1
+            target = self._sync_requested
+        os.write(self._wake_w, b"s")
+        with self._sync_cond:
+            return self._sync_cond.wait_for(lambda: self._sync_done >= target, timeout)
+
+    def _apply_notifications(self, conn):
+        changed = []
+        while conn.notifies:
+            try:
+                changed.append(int(conn.notifies.pop(0).payload))
+            except ValueError as e:
+                logger.error(f"Invalid '{EVACUATION_PATH_CHANNEL}' payload: {e}")
+        if changed:
+            self.invalidate(changed)
+            logger.debug(f"Evacuation paths invalidated for nodes {changed}")
+
+    def _barrier(self, conn):
+        """Round trip on the listening connection, then acknowledges the pending sync() calls."""
+        os.read(self._wake_r, 4096)
+        with self._sync_cond:
+            target = self._sync_requested
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        conn.poll()
+        self._apply_notifications(conn)
+        with self._sync_cond:
+            self._sync_done = max(self._sync_done, target)
+            self._sync_cond.notify_all()
+
+    def get_many(self, node_ids, conn):
+        """
+        Args:
+            node_ids (iterable): Nodes whose evacuation path is needed.
+            conn (psycopg2.connection): Connection used to load the nodes not in the cache.
+
+        Returns:
+            dict: node_id -> (evacuation_path, evacuation_path_splits) for the nodes that exist.
+        """
+        with self._lock:
+            found = {n: self._paths[n] for n in node_ids if n in self._paths}
+            generation = self._generation
+        missing = [n for n in node_ids if n not in found]
+        if not missing:
+            return found
+
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT node_id, evacuation_path, evacuation_path_splits
+                FROM nodes
+                WHERE node_id = ANY(%s);
+            """, (missing,))
+            loaded = {node_id: (path, splits) for node_id, path, splits in cursor.fetchall()}
+
+        with self._lock:
+            # if something was invalidated meanwhile, the rows just read may already be stale
+            if self.listening and generation == self._generation:
+                self._paths.update(loaded)
+        found.update(loaded)
+        return found
+
+    def _connect(self):
+        conn = create_connection()
+        if conn is None:
+            raise ConnectionError("database unavailable")
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVACUATION_PATH_CHANNEL};")
+        # changes made while disconnected were not notified
+        self.invalidate()
+        with self._lock:
+            self.listening = True
+        logger.info(f"Evacuation path cache listening on '{EVACUATION_PATH_CHANNEL}'.")
+        return conn
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                while True:
+                    readable, _, _ = select.select([conn, self._wake_r], [], [], self.poll_timeout)
+                    if self._wake_r in readable:
+                        self._barrier(conn)
+                    elif readable:
+                        conn.poll()
+                        self._apply_notifications(conn)
+            except Exception as e:
+                logger.error(f"Evacuation path listener error: {e}")
+            finally:
+                with self._lock:
+                    self.listening = False
+                    self._generation += 1
+                    self._paths = {}
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(self.reconnect_delay)
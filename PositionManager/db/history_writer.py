@@ -0,0 +1,225 @@
+import atexit
+import io
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from PositionManager.db.db_connection import create_connection
+from PositionManager.utils.logger import logger
+
+HISTORY_COLUMNS = "user_id, x, y, z, node_id, danger, event_time"
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS history_staging (
+        user_id INTEGER, x INTEGER, y INTEGER, z INTEGER,
+        node_id INTEGER, danger BOOLEAN, event_time TIMESTAMP
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# Relies on the unique index on (user_id, node_id) created in MapViewer/db/db_setup.py
+MERGE_STAGING_SQL = f"""
+    INSERT INTO user_historical_position ({HISTORY_COLUMNS})
+    SELECT {HISTORY_COLUMNS} FROM history_staging
+    ON CONFLICT (user_id, node_id) DO NOTHING;
+"""
+
+_STOP = object()
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value)
+
+
+class HistoryWriter:
+    """
+    Background writer for `user_historical_position`.
+
+    Rows are put on a bounded queue and written by a dedicated thread, on its own connection,
+    in batches: `COPY FROM STDIN` into a temporary staging table, then a single
+    `INSERT ... ON CONFLICT (user_id, node_id) DO NOTHING` into the history table. The event
+    time is taken when the row is submitted, so it does not depend on when the batch is written.
+
+    When the queue is full, `submit` waits up to `enqueue_timeout` seconds and then drops the
+    row (counted in `metrics()["dropped"]`): history never blocks danger detection for long.
+    A batch whose write fails is kept and retried on a fresh connection with exponential backoff
+    (each failed attempt is counted in `metrics()["failed_batches"]`), so a database outage
+    delays history instead of losing it; meanwhile new rows wait in the bounded queue.
+    Pending rows are flushed by `close()`, which is also registered with `atexit`.
+
+    Environment:
+        HISTORY_QUEUE_SIZE (int): Maximum number of queued rows (default 20000).
+        HISTORY_BATCH_SIZE (int): Maximum rows per COPY (default 2000).
+        HISTORY_FLUSH_MS (int): Maximum time a row waits before its batch is written (default 500).
+        HISTORY_ENQUEUE_TIMEOUT_MS (int): Maximum wait on a full queue before dropping (default 1000).
+        HISTORY_RETRY_MAX_MS (int): Maximum backoff between retries of a failed batch (default 30000).
+    """
+
+    def __init__(self):
+        self.batch_size = max(1, int(os.getenv("HISTORY_BATCH_SIZE", "2000")))
+        self.flush_interval = max(0, int(os.getenv("HISTORY_FLUSH_MS", "500"))) / 1000.0
+        self.enqueue_timeout = max(0, int(os.getenv("HISTORY_ENQUEUE_TIMEOUT_MS", "1000"))) / 1000.0
+        self.retry_initial = 0.5
+        self.retry_max = max(self.retry_initial, int(os.getenv("HISTORY_RETRY_MAX_MS", "30000")) / 1000.0)
+        self._queue = queue.Queue(maxsize=max(1, int(os.getenv("HISTORY_QUEUE_SIZE", "20000"))))
+        self._lock = threading.Lock()
+        self._metrics = {
+            "enqueued": 0, "written": 0, "inserted": 0, "dropped": 0,
+            "full_waits": 0, "failed_batches": 0, "last_batch_ms": 0.0,
+        }
+        self._conn = None
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="HistoryWriter", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def submit(self, rows):
+        """
+        Queues history rows for writing.
+
+        Args:
+            rows (list): Tuples (user_id, x, y, z, node_id, danger).
+
+        Returns:
+            int: Number of rows queued (the others were dropped because the queue stayed full).
+        """
+        if self._closed:
+            return 0
+        self.start()
+        event_time = datetime.now()
+        queued = 0
+        for row in rows:
+            item = (*row, event_time)
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._count("full_waits")
+                try:
+                    self._queue.put(item, timeout=self.enqueue_timeout)
+                except queue.Full:
+                    self._count("dropped")
+                    continue
+            queued += 1
+        self._count("enqueued", queued)
+        if queued < len(rows):
+            logger.warning(f"History queue full: {len(rows) - queued} historical rows dropped.")
+        return queued
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Counters (enqueued, written, inserted, dropped, full_waits, failed_batches),
+            duration of the last batch in ms and current queue depth.
+        """
+        with self._lock:
+            data = dict(self._metrics)
+        data["queue_depth"] = self._queue.qsize()
+        return data
+
+    def close(self, timeout=10.0):
+        """
+        Stops accepting rows, writes everything still queued and closes the connection.
+        Waits at most about `timeout` seconds, also when the queue is full and the database is down.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            deadline = time.monotonic() + timeout
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                logger.warning(f"History writer not drained: {self._queue.qsize()} rows still queued.")
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+        logger.info(f"History writer closed: {self.metrics()}")
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._metrics[key] += n
+
+    def _next_batch(self):
+        """Blocks for the first row, then collects up to batch_size rows within flush_interval."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows):
+        if self._conn is None or self._conn.closed:
+            self._conn = create_connection()
+            if self._conn is None:
+                raise ConnectionError("database unavailable")
+        # first (user_id, node_id) occurrence wins, as in the synchronous insert
+        unique = {}
+        for row in rows:
+            unique.setdefault((row[0], row[4]), row)
+        buf = io.StringIO()
+        for row in unique.values():
+            buf.write("\t".join(_copy_value(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.execute(CREATE_STAGING_SQL)
+                cursor.copy_expert(f"COPY history_staging ({HISTORY_COLUMNS}) FROM STDIN", buf)
+                cursor.execute(MERGE_STAGING_SQL)
+                inserted = cursor.rowcount
+            self._conn.commit()
+            return inserted
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def _reset_connection(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _write_with_retry(self, batch):
+        """Writes the batch, retrying with exponential backoff until it succeeds."""
+        delay = self.retry_initial
+        while True:
+            try:
+                return self._write(batch)
+            except Exception as e:
+                self._count("failed_batches")
+                logger.error(f"Failed to write {len(batch)} historical rows, retrying in {delay:.1f}s: {e}")
+                self._reset_connection()
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = self._next_batch()
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            if not batch:
+                continue
+            start = time.perf_counter()
+            inserted = self._write_with_retry(batch)
+            with self._lock:
+                self._metrics["written"] += len(batch)
+                self._metrics["inserted"] += inserted
+                self._metrics["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            logger.debug(f"History batch written: {len(batch)} rows, {inserted} inserted.")
+        if self._conn is not None:
+            self._conn.close()
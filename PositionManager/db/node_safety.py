@@ -0,0 +1,103 @@
+import json
+import select
+import threading
+import time
+
+import psycopg2.extensions
+
+from PositionManager.db.db_connection import create_connection
+from PositionManager.utils.logger import logger
+
+NODE_SAFE_CHANNEL = "node_safe_changed"
+
+
+class NodeSafetySnapshot:
+    """
+    In-memory snapshot of `nodes.safe`, kept fresh by Postgres LISTEN/NOTIFY.
+
+    The trigger `trg_nodes_safe_notify` (MapViewer/db/db_setup.py) emits a notification on
+    `node_safe_changed` whenever a node is inserted, deleted or its `safe` flag changes.
+    A background thread listens on a dedicated connection and applies them, so lookups
+    cost no query and reflect MapManager's `set_nodes_safe` as soon as it commits.
+
+    On every (re)connection the thread first issues LISTEN and then reloads the whole
+    snapshot, so changes missed while disconnected are never lost.
+
+    Attributes:
+        loaded (bool): True while the snapshot is in sync with the database.
+    """
+
+    def __init__(self, poll_timeout=5.0, reconnect_delay=3.0):
+        self._lock = threading.Lock()
+        self._safe = {}
+        self.loaded = False
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._thread = None
+
+    def get(self, node_id):
+        """
+        Returns:
+            bool or None: The node's safe flag (unknown nodes are not safe),
+            or None if the snapshot is not in sync and the caller must query the database.
+        """
+        with self._lock:
+            if not self.loaded:
+                return None
+            return bool(self._safe.get(node_id, False))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="NodeSafetyListener", daemon=True)
+            self._thread.start()
+
+    def _connect(self):
+        conn = create_connection()
+        if conn is None:
+            raise ConnectionError("database unavailable")
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {NODE_SAFE_CHANNEL};")
+            cursor.execute("SELECT node_id, safe FROM nodes;")
+            rows = cursor.fetchall()
+        with self._lock:
+            self._safe = {node_id: bool(safe) for node_id, safe in rows}
+            self.loaded = True
+        logger.info(f"Node safety snapshot loaded: {len(rows)} nodes, listening on '{NODE_SAFE_CHANNEL}'.")
+        return conn
+
+    def _apply(self, payload):
+        data = json.loads(payload)
+        node_id = data.get("node_id")
+        with self._lock:
+            if data.get("deleted"):
+                self._safe.pop(node_id, None)
+            else:
+                self._safe[node_id] = bool(data.get("safe"))
+        logger.debug(f"Node {node_id} safe flag updated: {data}")
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                while True:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        try:
+                            self._apply(conn.notifies.pop(0).payload)
+                        except (ValueError, AttributeError) as e:
+                            logger.error(f"Invalid '{NODE_SAFE_CHANNEL}' payload: {e}")
+            except Exception as e:
+                logger.error(f"Node safety listener error: {e}")
+            finally:
+                with self._lock:
+                    self.loaded = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(self.reconnect_delay)
@@ -0,0 +1,159 @@
+import threading
+from PositionManager.db.db_connection import create_connection
+from PositionManager.utils.logger import logger
+
+
+class PositionTracker:
+    """
+    In-memory mirror of `current_position` used for the hot checks of the consumer.
+
+    It keeps the number of tracked users, the number of users in danger and, for every
+    node, the users currently in danger there. It is updated with each committed batch of
+    positions, so the STOP condition and the "is everyone safe" check are O(1) instead of
+    full-table COUNT(*) queries. A periodic reconciliation reloads it from the database to
+    correct any drift (e.g. rows changed by another process).
+
+    Attributes:
+        loaded (bool): True once the tracker has been loaded from the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}            # user_id -> (node_id, danger)
+        self._danger_by_node = {}   # node_id -> set(user_id)
+        self._danger_count = 0
+        self._applied_seq = 0
+        # nodes whose set of endangered users changed since the last take_delta()/snapshot()
+        self._dirty = set()
+        self.loaded = False
+
+    def _set(self, user_id, node_id, danger):
+        previous = self._users.get(user_id)
+        if previous == (node_id, danger):
+            return
+        if previous is not None and previous[1]:
+            self._danger_count -= 1
+            self._dirty.add(previous[0])
+            members = self._danger_by_node.get(previous[0])
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._danger_by_node[previous[0]]
+        self._users[user_id] = (node_id, danger)
+        if danger:
+            self._danger_count += 1
+            self._dirty.add(node_id)
+            self._danger_by_node.setdefault(node_id, set()).add(user_id)
+
+    def apply(self, positions):
+        """
+        Applies positions that have just been committed to `current_position`.
+
+        Args:
+            positions (list): Dicts with user_id, node_id and danger, in arrival order.
+        """
+        with self._lock:
+            for p in positions:
+                self._set(p["user_id"], p["node_id"], bool(p["danger"]))
+            self._applied_seq += 1
+
+    def total(self):
+        with self._lock:
+            return len(self._users)
+
+    def in_danger(self):
+        with self._lock:
+            return self._danger_count
+
+    def is_everyone_safe(self):
+        with self._lock:
+            return self._danger_count == 0
+
+    def counts(self):
+        """
+        Returns:
+            tuple: (tracked users, users not in danger), read atomically.
+        """
+        with self._lock:
+            return len(self._users), len(self._users) - self._danger_count
+
+    def danger_membership(self):
+        """
+        Returns:
+            dict: node_id -> sorted list of the user_ids currently in danger at that node.
+        """
+        with self._lock:
+            return {node_id: sorted(users) for node_id, users in self._danger_by_node.items()}
+
+    def has_changes(self):
+        with self._lock:
+            return bool(self._dirty)
+
+    def take_delta(self):
+        """
+        Returns the nodes whose endangered users changed since the previous call and resets them.
+
+        Returns:
+            tuple: (dict node_id -> sorted user_ids for nodes still in danger,
+                    sorted list of node_ids that no longer have users in danger)
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            changed = {n: sorted(self._danger_by_node[n]) for n in dirty if n in self._danger_by_node}
+            cleared = sorted(n for n in dirty if n not in self._danger_by_node)
+        return changed, cleared
+
+    def snapshot(self):
+        """
+        Like danger_membership(), but also resets the pending changes (a full snapshot supersedes them).
+        """
+        with self._lock:
+            self._dirty = set()
+            return {node_id: sorted(users) for node_id, users in self._danger_by_node.items()}
+
+    def reconcile(self):
+        """
+        Reloads the tracker from `current_position` on a dedicated connection.
+
+        If a batch is applied while the snapshot is being read, the snapshot may already be
+        older than the tracker: in that case it is discarded and the next reconciliation retries.
+
+        Returns:
+            bool: True if the tracker state was replaced with the database snapshot.
+        """
+        with self._lock:
+            seq = self._applied_seq
+        conn = create_connection()
+        if conn is None:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT user_id, node_id, danger FROM current_position;")
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Failed to reconcile position tracker: {e}")
+            return False
+        finally:
+            conn.close()
+
+        with self._lock:
+            if seq != self._applied_seq:
+                logger.debug("Position tracker reconciliation skipped: batch applied meanwhile.")
+                return False
+            before = (len(self._users), self._danger_count)
+            old_membership = self._danger_by_node
+            self._users, self._danger_by_node, self._danger_count = {}, {}, 0
+            dirty, self._dirty = self._dirty, set()
+            for user_id, node_id, danger in rows:
+                self._set(user_id, node_id, bool(danger))
+            # pending changes = nodes that were pending before + nodes the snapshot corrected
+            self._dirty = dirty | {
+                n for n in set(old_membership) | set(self._danger_by_node)
+                if old_membership.get(n) != self._danger_by_node.get(n)
+            }
+            after = (len(self._users), self._danger_count)
+            was_loaded, self.loaded = self.loaded, True
+
+        if was_loaded and before != after:
+            logger.warning(f"Position tracker drift corrected: (users, in danger) {before} -> {after}")
+        return True
@@ -4,6 +4,7 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from PositionManager.rabbitmq.consumer import PositionManagerConsumer
+from PositionManager.rabbitmq.sharding import run_sharded
 import logging
 from PositionManager.utils.logger import logger
 
@@ -12,6 +13,12 @@ def main():
     logger.info("Starting PositionManager service...")
 
     try:
+        # POSITION_SHARDS > 1: router + K worker (partizionati per user_id) + coordinatore
+        shards = int(os.getenv("POSITION_SHARDS", "1"))
+        if shards > 1:
+            run_sharded(shards, config_file='PositionManager/config/config.yaml')
+            return
+
         # Avvio del consumer per consumare i messaggi dalla coda
         consumer = PositionManagerConsumer(config_file='PositionManager/config/config.yaml')
         consumer.start_consuming()  # Inizia a ricevere i messaggi dalla coda
@@ -4,9 +4,36 @@ import time
 import threading
 import os
 from PositionManager.db.db_manager import DBManager
+from PositionManager.db.position_tracker import PositionTracker
+from common.position_codec import decode_positions
+from PositionManager.rabbitmq.publisher import MessagePublisher, rabbitmq_parameters
 from PositionManager.utils.logger import logger
 
 
+def parse_positions(body, content_type, db_manager):
+    """
+    Decodifica un messaggio di position_queue (una posizione JSON o un batch, vedi position_codec)
+    e calcola il flag danger del nodo di ciascuna posizione.
+    """
+    return [parse_position(message, db_manager) for message in decode_positions(body, content_type)]
+
+
+def parse_position(message, db_manager):
+    """Calcola il flag danger di una posizione già decodificata."""
+    node_id = message.get("node_id")
+    # L'utente è in pericolo solo se il nodo non è sicuro
+    danger = not db_manager.is_node_safe(node_id)
+    return {
+        "event": message.get("event"),
+        "user_id": message.get("user_id"),
+        "x": message.get("x"),
+        "y": message.get("y"),
+        "z": message.get("z"),
+        "node_id": node_id,
+        "danger": danger,
+    }
+
+
 class PositionManagerConsumer:
     """
     Consumer di PositionManager.
@@ -23,7 +50,29 @@ class PositionManagerConsumer:
     Opzioni:
       - È possibile sovrascrivere il path del file con env var USER_SIMULATOR_CONFIG.
       - Se il file/chiave non sono leggibili, per sicurezza NON inviamo STOP.
+
+    Ingestion a micro-batch da position_queue (ack manuali + prefetch):
+      - POSITION_BATCH_SIZE: numero massimo di posizioni per batch (default 200, 1 = una alla volta)
+      - POSITION_BATCH_MAX_WAIT_MS: attesa massima prima di applicare un batch incompleto (default 50)
+      Ogni batch è applicato in un'unica transazione, poi i messaggi vengono confermati insieme.
+      Se la scrittura fallisce il consumer si ferma (pika rimette in coda i messaggi prefetchati
+      non ancora consegnati), il batch torna in coda e il consumer riparte: l'ordine resta quello
+      di position_queue. Al secondo fallimento consecutivo il batch va in position_queue.dead.
+
+    Contatori in memoria (PositionTracker) per STOP / "tutti al sicuro" / nodi in pericolo,
+    riallineati con il DB ogni POSITION_RECONCILE_SECONDS secondi (default 30).
+
+    I messaggi in uscita (map_manager_queue, alerted_users_queue) sono pubblicati da un
+    MessagePublisher con connessione e thread propri: nessun canale è condiviso tra thread.
+
+    Verso map_manager_queue vengono pubblicati solo i delta (nodi i cui utenti in pericolo sono
+    cambiati dall'ultimo invio + nodi non più in pericolo), con un numero di sequenza "seq".
+    Uno snapshot completo viene inviato al primo invio, al cambio di evento e comunque ogni
+    POSITION_SNAPSHOT_SECONDS secondi (default 60) per il riallineamento.
     """
+    # coda da cui arrivano le posizioni (ShardCoordinator la sostituisce in modalità sharded)
+    input_queue = 'position_queue'
+
     def __init__(self, config_file=None):
         self.db_manager = DBManager()
         self.dispatch_threshold = 100
@@ -36,23 +85,35 @@ class PositionManagerConsumer:
         # Cache del numero di utenti simulati (caricato da YAML)
         self._sim_users_count = None
 
+        # Micro-batch delle posizioni: (delivery_tag, redelivered, body, content_type)
+        self.batch_size = max(1, int(os.getenv("POSITION_BATCH_SIZE", "200")))
+        self.batch_max_wait = max(0, int(os.getenv("POSITION_BATCH_MAX_WAIT_MS", "50"))) / 1000.0
+        self._batch = []
+        self._batch_timer = None
+        self._failed_flushes = 0
+        self.dead_letter_queue = f"{self.input_queue}.dead"
+
+        # Stato in memoria di current_position (caricato subito dal DB)
+        self.tracker = PositionTracker()
+        self.tracker.reconcile()
+        self.reconcile_interval = float(os.getenv("POSITION_RECONCILE_SECONDS", "30"))
+        self.last_reconcile_time = time.time()
+
+        # Stato della pubblicazione a delta verso MapManager
+        self.snapshot_interval = float(os.getenv("POSITION_SNAPSHOT_SECONDS", "60"))
+        self._map_seq = 0
+        self._last_snapshot_time = 0.0
+        self._last_sent_event = None
+        self._map_lock = threading.Lock()
+
         # ---- Connessione RabbitMQ parametrizzata ----
-        creds = pika.PlainCredentials(
-            os.getenv("RABBITMQ_USER", "guest"),
-            os.getenv("RABBITMQ_PASSWORD", "guest")
-        )
-        params = pika.ConnectionParameters(
-            host=os.getenv("RABBITMQ_HOST", "localhost"),
-            port=int(os.getenv("RABBITMQ_PORT", "5672")),
-            credentials=creds,
-            heartbeat=30,
-            blocked_connection_timeout=300
-        )
+        params = rabbitmq_parameters()
 
         # Connessione principale per le code principali
         self.connection = pika.BlockingConnection(params)
         self.channel = self.connection.channel()
-        self.channel.queue_declare(queue='position_queue', durable=True)
+        self.channel.queue_declare(queue=self.input_queue, durable=True)
+        self.channel.queue_declare(queue=self.dead_letter_queue, durable=True)
         self.channel.queue_declare(queue='map_manager_queue', durable=True)
         self.channel.queue_declare(queue='alerted_users_queue', durable=True)
 
@@ -61,12 +122,13 @@ class PositionManagerConsumer:
         self.ack_channel = self.ack_connection.channel()
         self.ack_channel.queue_declare(queue='ack_evacuation_computed', durable=True)
 
-        # Consumer posizioni
-        self.channel.basic_consume(
-            queue='position_queue',
-            on_message_callback=self.process_message,
-            auto_ack=True
-        )
+        # Tutte le pubblicazioni (consumer, periodic_flush, thread degli ack) passano dal publisher dedicato
+        self.publisher = MessagePublisher(queues=('map_manager_queue', 'alerted_users_queue'), params=params)
+        self.publisher.start()
+
+        # Consumer posizioni (ack manuali: un messaggio è confermato solo dopo il commit del suo batch)
+        self.channel.basic_qos(prefetch_count=self.batch_size * 2)
+        self._consume_input()
 
         # Thread separati
         threading.Thread(target=self.periodic_flush, daemon=True).start()
@@ -77,9 +139,13 @@ class PositionManagerConsumer:
         while True:
             time.sleep(1)
             now = time.time()
+            if not self.tracker.loaded or (now - self.last_reconcile_time) >= self.reconcile_interval:
+                self.tracker.reconcile()
+                self.last_reconcile_time = now
+                logger.info(f"History writer: {self.db_manager.history.metrics()}")
             if (now - self.last_dispatch_time) >= self.dispatch_interval:
-                # Se c'è pericolo, invia aggiornamento mappa periodico
-                if not self.db_manager.is_everyone_safe():
+                # Se c'è pericolo (o nodi appena tornati sicuri), invia aggiornamento mappa periodico
+                if not self.tracker.is_everyone_safe() or self.tracker.has_changes():
                     logger.info("Periodic flush: danger detected, sending to MapManager.")
                     self.send_aggregated_data(only_to_map_manager=True)
                     self.processed_count = 0
@@ -177,101 +243,206 @@ class PositionManagerConsumer:
         STOP se e solo se:
           - current_position ha ESATTAMENTE n_users righe
           - tutte con danger = FALSE
+        (contatori in memoria del PositionTracker, nessuna query)
         """
         n = self._get_simulated_users_count()
         if not n:
             return False
+        if not self.tracker.loaded:
+            logger.warning("Position tracker not loaded yet — STOP check deferred.")
+            return False
+
+        total, safe = self.tracker.counts()
+        ok = (total == n) and (safe == n)
+        logger.debug(f"STOP check -> simulated(n_users)={n}, current_total={total}, safe={safe}, ok={ok}")
+        return ok
+
+    def process_message(self, ch, method, properties, body):
+        """
+        Callback di position_queue: accumula il messaggio nel batch corrente.
+        Il batch viene applicato quando raggiunge batch_size o dopo batch_max_wait secondi.
+        """
+        self._batch.append((method.delivery_tag, bool(method.redelivered), body, properties.content_type))
+        if len(self._batch) >= self.batch_size:
+            self.flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self.connection.call_later(self.batch_max_wait, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self.flush_batch()
+
+    def _consume_input(self):
+        self._consumer_tag = self.channel.basic_consume(
+            queue=self.input_queue,
+            on_message_callback=self.process_message,
+            auto_ack=False
+        )
+
+    def _requeue_in_order(self, last_tag):
+        """
+        Rimette in coda il batch (fino a last_tag) senza che i messaggi prefetchati dopo di lui
+        vengano elaborati prima: basic_cancel rimette in coda quelli non ancora consegnati,
+        poi il nack del batch e un nuovo consumer che riparte dalla testa della coda.
+        """
+        self.channel.basic_cancel(self._consumer_tag)
+        self.channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        self._consume_input()
 
+    def _dead_letter(self, batch):
+        """Copia i messaggi del batch in dead_letter_queue; False se la pubblicazione fallisce."""
         try:
-            with self.db_manager.conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) FROM current_position;")
-                total = cursor.fetchone()[0]
-                cursor.execute("SELECT COUNT(*) FROM current_position WHERE danger = FALSE;")
-                safe = cursor.fetchone()[0]
-            ok = (total == n) and (safe == n)
-            logger.debug(f"STOP check -> simulated(n_users)={n}, current_total={total}, safe={safe}, ok={ok}")
-            return ok
+            for _tag, _redelivered, body, content_type in batch:
+                self.channel.basic_publish(
+                    exchange='',
+                    routing_key=self.dead_letter_queue,
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2, content_type=content_type)
+                )
+            return True
         except Exception as e:
-            logger.error(f"Failed STOP condition check by simulated users: {e}")
+            logger.error(f"Failed to dead-letter batch of {len(batch)} messages: {e}")
             return False
 
-    def process_message(self, ch, method, properties, body):
-        try:
-            logger.info(f"Received raw message:\n{json.dumps(json.loads(body), indent=2)}")
-            message = json.loads(body)
-            event = message.get("event")
-            self.last_event = event
-            user_id = message.get("user_id")
-            x = message.get("x")
-            y = message.get("y")
-            z = message.get("z")
-            node_id = message.get("node_id")
-
-            # Ottieni la label safe del nodo direttamente dal db
-            node_safe = self.db_manager.is_node_safe(node_id)
-
-            # L'utente è in pericolo solo se il nodo non è sicuro
-            danger = not node_safe
-
-            # Se torna un pericolo dopo uno STOP inviato, sblocca la possibilità di rimandarlo
-            if danger and self._stop_sent:
-                logger.info("New user in danger detected — resetting STOP flag.")
-                self._stop_sent = False
-
-            # Aggiorna la posizione corrente e quella storica nel db
-            self.db_manager.upsert_current_position(user_id, x, y, z, node_id, danger)
-            self.db_manager.insert_historical_position(user_id, x, y, z, node_id, danger)
-
-            # --- NUOVA REGOLA: invio STOP solo se condizione n_users ----
-            can_stop = self._is_stop_condition_satisfied_by_sim_count()
-            logger.info(f"stop_condition_by_simulated_users = {can_stop}, _stop_sent = {self._stop_sent}")
-
-            if can_stop and not self._stop_sent:
-                self.send_stop_message()
-                logger.info("Send Stop message (current_position == n_users AND all safe).")
-                self._stop_sent = True
-            elif self._stop_sent and not can_stop:
-                # Se la condizione non è più soddisfatta (es. utenti mancanti o pericolo), resettiamo
-                logger.info("Stop condition no longer satisfied — resetting STOP flag.")
-                self._stop_sent = False
-
-            # Dispatch verso MapManager a batch
-            self.processed_count += 1
-            if self.processed_count >= self.dispatch_threshold:
-                self.send_aggregated_data(only_to_map_manager=True)
-                self.processed_count = 0
+    def _parse_positions(self, body, content_type):
+        return parse_positions(body, content_type, self.db_manager)
 
+    def _store_positions(self, positions):
+        """Scrive il batch su DB; False se la scrittura non è riuscita."""
+        return self.db_manager.apply_positions_batch(positions)
+
+    def flush_batch(self):
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        last_tag = batch[-1][0]
+        positions = []
+        for _tag, _redelivered, body, content_type in batch:
+            try:
+                logger.debug(f"Received raw message ({content_type}): {body!r}")
+                positions.extend(self._parse_positions(body, content_type))
+            except Exception as e:
+                # messaggio malformato: confermato insieme agli altri e scartato
+                logger.error(f"Failed to process message: {e}")
+
+        if positions and not self._store_positions(positions):
+            self._failed_flushes += 1
+            # riconsegna una sola volta: al secondo fallimento consecutivo il batch va in dead-letter
+            if self._failed_flushes > 1 and self._dead_letter(batch):
+                logger.error(f"Positions batch of {len(batch)} messages not applied, moved to {self.dead_letter_queue}.")
+                self._failed_flushes = 0
+                self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+            else:
+                logger.error(f"Positions batch of {len(batch)} messages not applied, requeued.")
+                self._requeue_in_order(last_tag)
+            return
+        self._failed_flushes = 0
+        self.tracker.apply(positions)
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+        try:
+            self._after_batch(positions)
         except Exception as e:
             logger.error(f"Failed to process message: {e}")
 
-    def send_aggregated_data(self, only_to_map_manager=False):
-        aggregated_data = self.aggregate_current_positions()
-        aggregated_data["event"] = self.last_event
-
-        logger.info(f"Aggregated data being sent to map_manager_queue:\n{json.dumps(aggregated_data, indent=2)}")
-        self.channel.basic_publish(
-            exchange='',
-            routing_key='map_manager_queue',
-            body=json.dumps(aggregated_data),
-            properties=pika.BasicProperties(delivery_mode=2)
+    def _after_batch(self, positions):
+        if not positions:
+            return
+        self.last_event = positions[-1]["event"]
+
+        # Se torna un pericolo dopo uno STOP inviato, sblocca la possibilità di rimandarlo
+        if self._stop_sent and any(p["danger"] for p in positions):
+            logger.info("New user in danger detected — resetting STOP flag.")
+            self._stop_sent = False
+
+        # --- NUOVA REGOLA: invio STOP solo se condizione n_users (una volta per batch) ----
+        can_stop = self._is_stop_condition_satisfied_by_sim_count()
+        logger.info(
+            f"Batch of {len(positions)} positions applied: "
+            f"stop_condition_by_simulated_users = {can_stop}, _stop_sent = {self._stop_sent}"
+        )
+
+        if can_stop and not self._stop_sent:
+            self.send_stop_message()
+            logger.info("Send Stop message (current_position == n_users AND all safe).")
+            self._stop_sent = True
+        elif self._stop_sent and not can_stop:
+            # Se la condizione non è più soddisfatta (es. utenti mancanti o pericolo), resettiamo
+            logger.info("Stop condition no longer satisfied — resetting STOP flag.")
+            self._stop_sent = False
+
+        # Dispatch verso MapManager a batch
+        self.processed_count += len(positions)
+        if self.processed_count >= self.dispatch_threshold:
+            self.send_aggregated_data(only_to_map_manager=True)
+            self.processed_count = 0
+
+    def _map_manager_payload(self):
+        """
+        Costruisce il prossimo messaggio per map_manager_queue:
+          - {"msg_type": "snapshot", "dangerous_nodes": [...]} : stato completo dei nodi in pericolo
+          - {"msg_type": "delta", "dangerous_nodes": [...], "cleared_nodes": [...]} : solo i nodi cambiati
+        Ritorna None se non c'è nessun cambiamento da inviare.
+        """
+        now = time.time()
+        snapshot_due = (
+            self._map_seq == 0
+            or self.last_event != self._last_sent_event
+            or (now - self._last_snapshot_time) >= self.snapshot_interval
         )
-        logger.info("Sent aggregated data to map_manager_queue.")
+        if not self.tracker.loaded:
+            payload = self.aggregate_current_positions()
+            payload["msg_type"] = "snapshot"
+        elif snapshot_due:
+            payload = {"msg_type": "snapshot", "dangerous_nodes": [
+                {"node_id": node_id, "user_ids": user_ids}
+                for node_id, user_ids in self.tracker.snapshot().items()
+            ]}
+        else:
+            changed, cleared = self.tracker.take_delta()
+            if not changed and not cleared:
+                return None
+            payload = {
+                "msg_type": "delta",
+                "dangerous_nodes": [{"node_id": node_id, "user_ids": user_ids} for node_id, user_ids in changed.items()],
+                "cleared_nodes": cleared,
+            }
+
+        if payload["msg_type"] == "snapshot":
+            self._last_snapshot_time = now
+        self._map_seq += 1
+        payload["seq"] = self._map_seq
+        payload["event"] = self.last_event
+        self._last_sent_event = self.last_event
+        return payload
+
+    def send_aggregated_data(self, only_to_map_manager=False):
+        with self._map_lock:
+            aggregated_data = self._map_manager_payload()
+            if aggregated_data is None:
+                logger.debug("No dangerous node changed since last dispatch — nothing sent to map_manager_queue.")
+            else:
+                logger.info(f"Aggregated data being sent to map_manager_queue:\n{json.dumps(aggregated_data, indent=2)}")
+                self.publisher.publish('map_manager_queue', json.dumps(aggregated_data))
+                logger.info(
+                    f"Sent aggregated data to map_manager_queue "
+                    f"({aggregated_data['msg_type']} seq={aggregated_data['seq']})."
+                )
 
         if only_to_map_manager:
             return
 
-        evacuation_data = self.db_manager.get_aggregated_evacuation_data()
+        evacuation_data = self._evacuation_data()
 
         logger.info(
             f"Evacuation data being sent:\n{json.dumps(evacuation_data, indent=2) if evacuation_data else 'STOP check'}"
         )
         if evacuation_data:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key='alerted_users_queue',
-                body=json.dumps(evacuation_data),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
+            self.publisher.publish('alerted_users_queue', json.dumps(evacuation_data))
             logger.info("Sent evacuation data to alerted_users_queue.")
         else:
             # --- STOP solo se condizione con n_users è soddisfatta ---
@@ -281,6 +452,13 @@ class PositionManagerConsumer:
                 logger.info("Evacuation data empty, but stop condition NOT satisfied — not sending STOP.")
 
     def aggregate_current_positions(self):
+        # nodi in pericolo dal PositionTracker; query su current_position solo se non ancora caricato
+        if self.tracker.loaded:
+            return {"dangerous_nodes": [
+                {"node_id": node_id, "user_ids": user_ids}
+                for node_id, user_ids in self.tracker.danger_membership().items()
+            ]}
+
         aggregated_data = {}
         try:
             with self.db_manager.conn.cursor() as cursor:
@@ -298,42 +476,25 @@ class PositionManagerConsumer:
             logger.error(f"Failed to aggregate current positions: {e}")
         return {"dangerous_nodes": list(aggregated_data.values())}
 
-    def get_evacuation_data(self):
-        evacuation_data = []
-        try:
-            with self.db_manager.conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT node_id, array_agg(user_id)
-                    FROM current_position
-                    WHERE danger = TRUE
-                    GROUP BY node_id;
-                """)
-                rows = cursor.fetchall()
-                for node_id, user_ids in rows:
-                    cursor.execute("""
-                        SELECT evacuation_path
-                        FROM nodes
-                        WHERE node_id = %s;
-                    """, (node_id,))
-                    evacuation_path = cursor.fetchone()
-                    if evacuation_path:
-                        path = evacuation_path[0]
-                        for user_id in user_ids:
-                            evacuation_data.append({
-                                "user_id": user_id,
-                                "evacuation_path": path
-                            })
-        except Exception as e:
-            logger.error(f"Failed to get evacuation data: {e}")
-        return evacuation_data if evacuation_data else None
+    def _evacuation_data(self):
+        """
+        Payload per alerted_users_queue: utenti in pericolo dal PositionTracker e percorsi dalla
+        cache per nodo di DBManager (join su current_position solo se il tracker non è caricato).
+        """
+        membership = self.tracker.danger_membership() if self.tracker.loaded else None
+        return self.db_manager.get_aggregated_evacuation_data(membership)
 
     def process_ack_message(self, ch, method, properties, body):
         try:
             msg = json.loads(body)
             if msg.get("msg_type") == "paths_ready":
                 logger.info("Received 'paths_ready' message.")
-                if not self.db_manager.is_everyone_safe():
-                    evacuation_data = self.db_manager.get_aggregated_evacuation_data()
+                # MapManager ha appena scritto nuovi percorsi: si applicano le NOTIFY dei nodi cambiati
+                # (solo se il listener non risponde la cache viene svuotata tutta)
+                if not self.db_manager.evacuation_paths.sync():
+                    self.db_manager.evacuation_paths.invalidate()
+                if not self.tracker.is_everyone_safe():
+                    evacuation_data = self._evacuation_data()
                     self.send_evacuation_data(evacuation_data)
                 elif self._is_stop_condition_satisfied_by_sim_count():
                     self.send_stop_message()
@@ -363,7 +524,7 @@ class PositionManagerConsumer:
     def send_evacuation_data(self, evacuation_data=None):
         try:
             if evacuation_data is None:
-                evacuation_data = self.db_manager.get_aggregated_evacuation_data()
+                evacuation_data = self._evacuation_data()
 
             if not evacuation_data:
                 # --- STOP solo se condizione con n_users è soddisfatta ---
@@ -376,12 +537,7 @@ class PositionManagerConsumer:
 
             logger.info(f"Evacuation data being sent:\n{json.dumps(evacuation_data, indent=2)}")
 
-            self.channel.basic_publish(
-                exchange='',
-                routing_key='alerted_users_queue',
-                body=json.dumps(evacuation_data),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
+            self.publisher.publish('alerted_users_queue', json.dumps(evacuation_data))
             logger.info("Sent aggregated evacuation data to alerted_users_queue.")
 
         except Exception as e:
@@ -389,12 +545,7 @@ class PositionManagerConsumer:
 
     def send_stop_message(self):
         try:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key='alerted_users_queue',
-                body=json.dumps({"msgType": "Stop"}),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
+            self.publisher.publish('alerted_users_queue', json.dumps({"msgType": "Stop"}))
             logger.info("Sent stop message to alerted_users_queue.")
         except Exception as e:
             logger.error(f"Failed to send stop message: {e}")
@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+import time
+
+import pika
+
+from PositionManager.utils.logger import logger
+
+_STOP = object()
+
+
+def rabbitmq_parameters():
+    """Parametri di connessione RabbitMQ (RABBITMQ_HOST/PORT/USER/PASSWORD)."""
+    creds = pika.PlainCredentials(
+        os.getenv("RABBITMQ_USER", "guest"),
+        os.getenv("RABBITMQ_PASSWORD", "guest")
+    )
+    return pika.ConnectionParameters(
+        host=os.getenv("RABBITMQ_HOST", "localhost"),
+        port=int(os.getenv("RABBITMQ_PORT", "5672")),
+        credentials=creds,
+        heartbeat=30,
+        blocked_connection_timeout=300
+    )
+
+
+class MessagePublisher:
+    """
+    Publisher dedicato: un thread con la propria BlockingConnection e una coda interna.
+
+    pika BlockingConnection non è thread-safe: consumer, periodic_flush e thread degli ack
+    non pubblicano più sui propri canali ma chiamano publish(), che accoda e ritorna subito.
+    Il thread pubblica i messaggi in ordine, a gruppi (al massimo PUBLISH_BATCH_SIZE, default 100),
+    in una transazione AMQP (tx_select / tx_commit): al commit il broker ha accettato (e, per
+    messaggi persistenti su code durable, salvato) l'intero gruppo. Se il commit fallisce il
+    thread si riconnette e ripubblica il gruppo (at-least-once).
+    publish() non blocca il chiamante (anche il thread del consumer) oltre PUBLISH_ENQUEUE_TIMEOUT_MS
+    (default 1000): se la coda interna resta piena, ad esempio con il broker irraggiungibile, il
+    messaggio viene scartato e contato in `dropped`. Un delta perso verso map_manager_queue crea un
+    buco nella sequenza, che MapManager recupera ricalcolando tutti i nodi noti.
+    """
+
+    def __init__(self, queues=(), params=None):
+        self.params = params or rabbitmq_parameters()
+        self.queues = tuple(queues)
+        self.batch_size = max(1, int(os.getenv("PUBLISH_BATCH_SIZE", "100")))
+        self.reconnect_delay = 3.0
+        self._queue = queue.Queue(maxsize=max(1, int(os.getenv("PUBLISH_QUEUE_SIZE", "10000"))))
+        self.enqueue_timeout = max(0, int(os.getenv("PUBLISH_ENQUEUE_TIMEOUT_MS", "1000"))) / 1000.0
+        self._connection = None
+        self._channel = None
+        self._thread = None
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="MessagePublisher", daemon=True)
+            self._thread.start()
+
+    def publish(self, routing_key, body):
+        """
+        Accoda un messaggio persistente (delivery_mode=2) per routing_key sull'exchange di default.
+
+        Returns:
+            bool: False se il messaggio è stato scartato (publisher chiuso o coda piena oltre enqueue_timeout).
+        """
+        if self._closed:
+            logger.error(f"Publisher closed: message for '{routing_key}' discarded.")
+            return False
+        try:
+            self._queue.put((routing_key, body), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Publish queue full for {self.enqueue_timeout}s: message for '{routing_key}' dropped.")
+            return False
+
+    def close(self, timeout=10.0):
+        """
+        Pubblica i messaggi ancora in coda e chiude la connessione.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            deadline = time.monotonic() + timeout
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                # thread fermo (broker irraggiungibile): i messaggi in coda vanno persi
+                logger.warning(f"Publish queue still full on close, dropping {self._queue.qsize()} pending messages.")
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _connect(self):
+        self._connection = pika.BlockingConnection(self.params)
+        self._channel = self._connection.channel()
+        for name in self.queues:
+            self._channel.queue_declare(queue=name, durable=True)
+        self._channel.tx_select()
+        logger.info("MessagePublisher connected.")
+
+    def _disconnect(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = self._channel = None
+
+    def _next_batch(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=1.0)]
+                break
+            except queue.Empty:
+                # nessun messaggio: gestisce heartbeat ed eventi della connessione
+                if self._connection is not None:
+                    self._connection.process_data_events(time_limit=0)
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        properties = pika.BasicProperties(delivery_mode=2)
+        for routing_key, body in batch:
+            self._channel.basic_publish(exchange='', routing_key=routing_key, body=body, properties=properties)
+        self._channel.tx_commit()
+
+    def _run(self):
+        stopping = False
+        batch = []
+        while not (stopping and not batch):
+            try:
+                if self._connection is None or not self._connection.is_open:
+                    self._connect()
+                if not batch:
+                    batch = self._next_batch()
+                    if batch[-1] is _STOP:
+                        batch.pop()
+                        stopping = True
+                    if not batch:
+                        continue
+                self._send(batch)
+                self.published += len(batch)
+                logger.debug(f"Published {len(batch)} messages in one transaction.")
+                batch = []
+            except Exception as e:
+                logger.error(f"MessagePublisher error ({len(batch)} messages pending, will retry): {e}")
+                self._disconnect()
+                time.sleep(self.reconnect_delay)
+        self._disconnect()
@@ -0,0 +1,317 @@
+import json
+import multiprocessing
+import os
+import zlib
+
+import pika
+
+from PositionManager.db.db_manager import DBManager
+from PositionManager.rabbitmq.consumer import PositionManagerConsumer, parse_positions
+from common.position_codec import (
+    decode_positions, encode_positions, join_records, split_records, BINARY_CONTENT_TYPE
+)
+from PositionManager.rabbitmq.publisher import rabbitmq_parameters
+from PositionManager.utils.logger import logger
+
+APPLIED_QUEUE = 'position_applied_queue'
+APPLIED_PUBLISH_ATTEMPTS = 3
+
+
+def shard_queue(shard):
+    return f'position_queue.shard.{shard}'
+
+
+def shard_for(user_id, shards):
+    """
+    Shard di un utente: user_id % shards (crc32 per id non interi).
+    Tutte le posizioni di un utente finiscono sempre nella stessa coda, quindi restano in ordine.
+    """
+    if user_id is None:
+        return 0
+    try:
+        return int(user_id) % shards
+    except (TypeError, ValueError):
+        return zlib.crc32(str(user_id).encode()) % shards
+
+
+class PositionRouter:
+    """
+    Legge position_queue e inoltra le posizioni a position_queue.shard.{user_id % K}.
+
+    I messaggi in ingresso sono raccolti in micro-batch (POSITION_ROUTER_BATCH_SIZE messaggi o
+    POSITION_BATCH_MAX_WAIT_MS) e instradati sullo user_id senza decodificare le posizioni:
+    i record degli envelope binari consecutivi vengono copiati così come sono in pochi messaggi per
+    shard (al massimo POSITION_ROUTER_CHUNK record ciascuno), i messaggi JSON con un solo shard
+    sono inoltrati invariati.
+    Il canale usa publisher confirms: un messaggio in ingresso viene confermato solo dopo che il
+    broker ha accettato tutto ciò che ne è stato inoltrato. Se una conferma fallisce si conferma il
+    prefisso del batch già inoltrato e si rimette in coda, in ordine, solo il resto (at-least-once:
+    la parte già inoltrata di un messaggio rimesso in coda viene reinoltrata, nello stesso ordine).
+    È l'unico consumer di position_queue: l'ordine delle posizioni di uno stesso utente è preservato.
+    """
+    input_queue = 'position_queue'
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.batch_size = max(1, int(os.getenv("POSITION_ROUTER_BATCH_SIZE", "200")))
+        self.batch_max_wait = max(0, int(os.getenv("POSITION_BATCH_MAX_WAIT_MS", "50"))) / 1000.0
+        self.chunk = max(1, int(os.getenv("POSITION_ROUTER_CHUNK", "1000")))
+        self._batch = []
+        self._batch_timer = None
+
+        self.connection = pika.BlockingConnection(rabbitmq_parameters())
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue='position_queue', durable=True)
+        for shard in range(shards):
+            self.channel.queue_declare(queue=shard_queue(shard), durable=True)
+        self.channel.confirm_delivery()
+        self.channel.basic_qos(prefetch_count=int(os.getenv("POSITION_ROUTER_PREFETCH", "500")))
+        self._consume_input()
+
+    _consume_input = PositionManagerConsumer._consume_input
+    _requeue_in_order = PositionManagerConsumer._requeue_in_order
+
+    def process_message(self, ch, method, properties, body):
+        self._batch.append((method.delivery_tag, body, properties.content_type))
+        if len(self._batch) >= self.batch_size:
+            self.flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self.connection.call_later(self.batch_max_wait, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self.flush_batch()
+
+    def _route(self, batch):
+        """
+        Messaggi da inoltrare: lista di (shard, body, content_type, indici nel batch dei messaggi
+        in ingresso che contiene), nell'ordine di arrivo per shard.
+        """
+        routed = []
+        open_groups = {}  # shard -> (prefix, record, indici): envelope binari consecutivi dello shard
+
+        def close(shard):
+            prefix, records, indexes = open_groups.pop(shard)
+            for start in range(0, len(records), self.chunk):
+                end = start + self.chunk
+                routed.append((shard, join_records(prefix, records[start:end]), BINARY_CONTENT_TYPE,
+                               set(indexes[start:end])))
+
+        for index, (_tag, body, content_type) in enumerate(batch):
+            try:
+                if content_type == BINARY_CONTENT_TYPE:
+                    prefix, records = split_records(body)
+                    for user_id, record in records:
+                        shard = shard_for(user_id, self.shards)
+                        if shard in open_groups and open_groups[shard][0] != prefix:
+                            close(shard)
+                        group = open_groups.setdefault(shard, (prefix, [], []))
+                        group[1].append(record)
+                        group[2].append(index)
+                    continue
+                by_shard = {}
+                for p in decode_positions(body, content_type):
+                    by_shard.setdefault(shard_for(p.get("user_id"), self.shards), []).append(p)
+            except Exception:
+                # malformato: inoltrato così com'è, lo scarterà il worker dello shard 0
+                by_shard = {0: None}
+            for shard, positions in by_shard.items():
+                if shard in open_groups:
+                    close(shard)
+                if len(by_shard) == 1:
+                    routed.append((shard, body, content_type, {index}))
+                else:
+                    routed.append((shard, *encode_positions(positions, "json"), {index}))
+
+        for shard in list(open_groups):
+            close(shard)
+        return routed
+
+    def flush_batch(self):
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        last_tag = batch[-1][0]
+        routed = self._route(batch)
+        confirmed = 0
+        try:
+            for shard, body, content_type, _indexes in routed:
+                # con confirm_delivery basic_publish ritorna dopo l'ack del broker (NackError altrimenti)
+                self.channel.basic_publish(
+                    exchange='',
+                    routing_key=shard_queue(shard),
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2, content_type=content_type)
+                )
+                confirmed += 1
+        except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+            # confermati solo i messaggi in ingresso prima del primo non inoltrato del tutto
+            first_pending = min(set().union(*(indexes for *_msg, indexes in routed[confirmed:])))
+            logger.error(
+                f"PositionRouter: {len(batch) - first_pending} of {len(batch)} messages not confirmed, requeued: {e}"
+            )
+            if first_pending > 0:
+                self.channel.basic_ack(delivery_tag=batch[first_pending - 1][0], multiple=True)
+            self._requeue_in_order(last_tag)
+            return
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+    def start_consuming(self):
+        logger.info(f"PositionRouter started ({self.shards} shards).")
+        self.channel.start_consuming()
+
+
+class PositionShardWorker:
+    """
+    Worker di uno shard: applica in micro-batch le posizioni della propria coda con la propria
+    connessione al DB (stessa logica di PositionManagerConsumer.flush_batch, compresi requeue in
+    ordine e dead-letter) e pubblica le posizioni applicate su position_applied_queue per lo
+    ShardCoordinator. Un batch già scritto su DB non viene mai riapplicato: se la pubblicazione su
+    position_applied_queue non viene confermata dopo APPLIED_PUBLISH_ATTEMPTS tentativi il batch
+    viene comunque confermato e il tracker del coordinatore si riallinea alla riconciliazione.
+    """
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.queue = self.input_queue = shard_queue(shard)
+        self.dead_letter_queue = f"{self.queue}.dead"
+        self.db_manager = DBManager()
+        self.batch_size = max(1, int(os.getenv("POSITION_BATCH_SIZE", "200")))
+        self.batch_max_wait = max(0, int(os.getenv("POSITION_BATCH_MAX_WAIT_MS", "50"))) / 1000.0
+        self._batch = []
+        self._batch_timer = None
+        self._failed_flushes = 0
+
+        self.connection = pika.BlockingConnection(rabbitmq_parameters())
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.queue, durable=True)
+        self.channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        self.channel.queue_declare(queue=APPLIED_QUEUE, durable=True)
+        self.channel.confirm_delivery()
+        self.channel.basic_qos(prefetch_count=self.batch_size * 2)
+        self._consume_input()
+
+    _consume_input = PositionManagerConsumer._consume_input
+    _requeue_in_order = PositionManagerConsumer._requeue_in_order
+    _dead_letter = PositionManagerConsumer._dead_letter
+
+    def process_message(self, ch, method, properties, body):
+        self._batch.append((method.delivery_tag, bool(method.redelivered), body, properties.content_type))
+        if len(self._batch) >= self.batch_size:
+            self.flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self.connection.call_later(self.batch_max_wait, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self.flush_batch()
+
+    def flush_batch(self):
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        last_tag = batch[-1][0]
+        positions = []
+        for _tag, _redelivered, body, content_type in batch:
+            try:
+                positions.extend(parse_positions(body, content_type, self.db_manager))
+            except Exception as e:
+                logger.error(f"[shard {self.shard}] Failed to process message: {e}")
+
+        if positions and not self.db_manager.apply_positions_batch(positions):
+            self._failed_flushes += 1
+            # riconsegna una sola volta: al secondo fallimento consecutivo il batch va in dead-letter
+            if self._failed_flushes > 1 and self._dead_letter(batch):
+                logger.error(f"[shard {self.shard}] Positions batch of {len(batch)} messages not applied, moved to {self.dead_letter_queue}.")
+                self._failed_flushes = 0
+                self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+            else:
+                logger.error(f"[shard {self.shard}] Positions batch of {len(batch)} messages not applied, requeued.")
+                self._requeue_in_order(last_tag)
+            return
+        self._failed_flushes = 0
+
+        if positions:
+            self._publish_applied(positions)
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+    def _publish_applied(self, positions):
+        """
+        Pubblica le posizioni applicate per il coordinatore; False se il broker non le conferma.
+        Il batch è già su DB: non viene rimesso in coda, al più il coordinatore le recupera alla
+        prossima riconciliazione del tracker.
+        """
+        applied = [
+            {"event": p["event"], "user_id": p["user_id"], "node_id": p["node_id"], "danger": p["danger"]}
+            for p in positions
+        ]
+        body = json.dumps({"shard": self.shard, "positions": applied})
+        for attempt in range(1, APPLIED_PUBLISH_ATTEMPTS + 1):
+            try:
+                self.channel.basic_publish(
+                    exchange='',
+                    routing_key=APPLIED_QUEUE,
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2)
+                )
+                return True
+            except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+                logger.error(
+                    f"[shard {self.shard}] Applied positions not confirmed "
+                    f"(attempt {attempt}/{APPLIED_PUBLISH_ATTEMPTS}): {e}"
+                )
+        logger.error(f"[shard {self.shard}] {len(applied)} applied positions not forwarded, left to reconciliation.")
+        return False
+
+    def start_consuming(self):
+        logger.info(f"PositionShardWorker {self.shard} started on '{self.queue}'.")
+        self.channel.start_consuming()
+
+
+class ShardCoordinator(PositionManagerConsumer):
+    """
+    PositionManagerConsumer che riceve le posizioni già applicate dai worker (position_applied_queue)
+    invece di quelle grezze: aggiorna solo il PositionTracker e mantiene la logica globale
+    (STOP, delta verso MapManager, paths_ready / alerted_users_queue) in un unico processo.
+    Il micro-batching è quello del consumer; cambiano solo parsing e scrittura (già fatta dai worker).
+    """
+    input_queue = APPLIED_QUEUE
+
+    def _parse_positions(self, body, content_type):
+        return json.loads(body)["positions"]
+
+    def _store_positions(self, positions):
+        return True
+
+
+def _run_router(shards):
+    PositionRouter(shards).start_consuming()
+
+
+def _run_worker(shard):
+    PositionShardWorker(shard).start_consuming()
+
+
+def run_sharded(shards, config_file=None):
+    """
+    Avvia il router e i K worker in processi separati, poi il coordinatore nel processo corrente.
+    """
+    processes = [multiprocessing.Process(target=_run_router, args=(shards,), name="PositionRouter", daemon=True)]
+    processes += [
+        multiprocessing.Process(target=_run_worker, args=(shard,), name=f"PositionShard-{shard}", daemon=True)
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"PositionManager sharded mode: router + {shards} workers started.")
+
+    coordinator = ShardCoordinator(config_file=config_file)
+    coordinator.start_consuming()
@@ -0,0 +1,133 @@
+class FakeChannel:
+    """Canale pika finto: registra le chiamate in ordine."""
+
+    def __init__(self, fail_publish_to=(), publish_error=RuntimeError):
+        self.calls = []
+        self.published = []
+        self.fail_publish_to = set(fail_publish_to)
+        self.publish_error = publish_error
+        self._consumers = 0
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self._consumers += 1
+        tag = f"ctag-{self._consumers}"
+        self.calls.append(("consume", queue, tag))
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        self.calls.append(("cancel", consumer_tag))
+        return []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.calls.append(("nack", delivery_tag, multiple, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if routing_key in self.fail_publish_to:
+            raise self.publish_error(f"publish to {routing_key} failed")
+        self.published.append((routing_key, body, properties))
+        self.calls.append(("publish", routing_key))
+
+
+class FakeTracker:
+    def __init__(self):
+        self.applied = []
+
+    def apply(self, positions):
+        self.applied.append(list(positions))
+
+
+class FakeDB:
+    """DBManager finto: tutti i nodi sicuri tranne quelli in 'dangerous'."""
+
+    def __init__(self, dangerous=()):
+        self.dangerous = set(dangerous)
+
+    def is_node_safe(self, node_id):
+        return node_id not in self.dangerous
+
+
+class Method:
+    def __init__(self, delivery_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+
+class Properties:
+    def __init__(self, content_type=None):
+        self.content_type = content_type
+
+
+class FakeConnection:
+    """Solo i timer di BlockingConnection: il batch viene chiuso a mano con flush_batch()."""
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback):
+        self.timers.append(callback)
+        return callback
+
+    def remove_timeout(self, timer):
+        if timer in self.timers:
+            self.timers.remove(timer)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((" ".join(sql.split()), params))
+        if self.conn.on_execute is not None:
+            self.conn.on_execute(sql, params)
+        if self.conn.fail:
+            raise RuntimeError("query failed")
+
+    def copy_expert(self, sql, file):
+        self.execute(sql)
+        self.conn.copied.append(file.read())
+
+    def fetchall(self):
+        return list(self.conn.rows)
+
+    def fetchone(self):
+        return self.conn.rows[0] if self.conn.rows else None
+
+
+class FakeDBConnection:
+    """Connessione psycopg2 finta: ogni SELECT ritorna 'rows'; on_execute simula attività concorrente."""
+
+    def __init__(self, rows=(), fail=False, on_execute=None):
+        self.rows = list(rows)
+        self.fail = fail
+        self.on_execute = on_execute
+        self.executed = []
+        self.copied = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+    def set_isolation_level(self, level):
+        self.isolation_level = level
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from PositionManager.rabbitmq.consumer import PositionManagerConsumer
+from PositionManager.test.fakes import FakeChannel, FakeConnection, FakeDB, FakeTracker, Method, Properties
+
+
+@pytest.fixture
+def consumer():
+    c = PositionManagerConsumer.__new__(PositionManagerConsumer)
+    c.db_manager = FakeDB()
+    c.tracker = FakeTracker()
+    c.channel = FakeChannel()
+    c.connection = FakeConnection()
+    c.batch_size = 10
+    c.batch_max_wait = 0.05
+    c._batch = []
+    c._batch_timer = None
+    c._failed_flushes = 0
+    c.dead_letter_queue = "position_queue.dead"
+    c._consume_input()
+    c.channel.calls.clear()
+    c.after_batches = []
+    c._after_batch = c.after_batches.append
+    c.store_results = []
+    c._store_positions = lambda positions: c.store_results.pop(0)
+    return c
+
+
+def _deliver(consumer, tags):
+    for tag in tags:
+        body = json.dumps({"user_id": tag, "node_id": 1, "x": 0, "y": 0, "z": 0, "event": "Fire"})
+        consumer.process_message(consumer.channel, Method(tag), Properties("application/json"), body)
+
+
+def test_applied_batch_is_acked_once(consumer):
+    consumer.store_results = [True]
+    _deliver(consumer, [1, 2, 3])
+    consumer.flush_batch()
+    assert consumer.channel.calls == [("ack", 3, True)]
+    assert [p["user_id"] for p in consumer.tracker.applied[0]] == [1, 2, 3]
+
+
+def test_failed_batch_is_requeued_before_any_prefetched_message(consumer):
+    consumer.store_results = [False]
+    _deliver(consumer, [1, 2, 3])
+    consumer.flush_batch()
+    # consumer fermato (pika rimette in coda i prefetchati), batch in coda, consumer di nuovo attivo
+    assert consumer.channel.calls == [
+        ("cancel", "ctag-1"), ("nack", 3, True, True), ("consume", "position_queue", "ctag-2")
+    ]
+    assert consumer._consumer_tag == "ctag-2"
+    assert consumer.tracker.applied == [] and consumer.after_batches == []
+
+
+def test_second_consecutive_failure_goes_to_dead_letter(consumer):
+    consumer.store_results = [False, False]
+    _deliver(consumer, [1, 2])
+    consumer.flush_batch()
+    consumer.channel.calls.clear()
+
+    _deliver(consumer, [3, 4])
+    consumer.flush_batch()
+    assert consumer.channel.calls == [
+        ("publish", "position_queue.dead"), ("publish", "position_queue.dead"), ("ack", 4, True)
+    ]
+    assert [json.loads(body)["user_id"] for _q, body, _p in consumer.channel.published] == [3, 4]
+    assert consumer.channel.published[0][2].content_type == "application/json"
+    assert consumer._failed_flushes == 0
+
+
+def test_success_resets_the_failure_count(consumer):
+    consumer.store_results = [False, True, False]
+    for tags in ([1], [2], [3]):
+        _deliver(consumer, tags)
+        consumer.flush_batch()
+    assert ("nack", 3, True, True) in consumer.channel.calls
+    assert consumer.channel.published == []
+
+
+def test_dead_letter_publish_failure_requeues_instead_of_dropping(consumer):
+    consumer.channel.fail_publish_to = {"position_queue.dead"}
+    consumer.store_results = [False, False]
+    _deliver(consumer, [1])
+    consumer.flush_batch()
+    _deliver(consumer, [2])
+    consumer.flush_batch()
+    assert consumer.channel.calls[-3:] == [
+        ("cancel", "ctag-2"), ("nack", 2, True, True), ("consume", "position_queue", "ctag-3")
+    ]
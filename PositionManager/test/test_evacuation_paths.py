@@ -0,0 +1,64 @@
+import os
+import time
+
+from PositionManager.db import evacuation_paths
+from PositionManager.db.evacuation_paths import EvacuationPathCache
+from PositionManager.test.fakes import FakeDBConnection
+
+
+class Notify:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class FakeListenConnection(FakeDBConnection):
+    """
+    Connessione in LISTEN: le notifiche in 'committed' arrivano solo con poll(), come in psycopg2.
+    Il descrittore non diventa mai leggibile: le notifiche si leggono solo con il round trip di sync().
+    """
+
+    def __init__(self, rows=()):
+        super().__init__(rows)
+        self.notifies = []
+        self.committed = []
+        self._fd, self._unused_w = os.pipe()
+
+    def fileno(self):
+        return self._fd
+
+    def poll(self):
+        self.notifies.extend(Notify(str(node_id)) for node_id in self.committed)
+        self.committed = []
+
+
+def _wait_listening(cache):
+    deadline = time.monotonic() + 2.0
+    while not cache.listening and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cache.listening
+
+
+def test_sync_without_listener_asks_for_full_invalidation():
+    cache = EvacuationPathCache()
+    assert cache.sync(timeout=0.1) is False
+
+
+def test_sync_applies_committed_notifications_and_keeps_the_rest(monkeypatch):
+    listener = FakeListenConnection()
+    monkeypatch.setattr(evacuation_paths, "create_connection", lambda: listener)
+    cache = EvacuationPathCache(poll_timeout=0.05)
+    cache.start()
+    assert _wait_listening(cache)
+
+    reader = FakeDBConnection([(1, [1, 9], None), (2, [2, 9], None)])
+    assert cache.get_many([1, 2], reader) == {1: ([1, 9], None), 2: ([2, 9], None)}
+
+    # MapManager ha cambiato il percorso del nodo 1, la notifica non è ancora stata letta
+    listener.committed.append(1)
+    assert cache.sync(timeout=2.0) is True
+    assert ("SELECT 1;", None) in listener.executed
+
+    reader.rows = [(1, [1, 8], None)]
+    assert cache.get_many([1, 2], reader) == {1: ([1, 8], None), 2: ([2, 9], None)}
+    # solo il nodo 1 è stato riletto dal DB
+    assert reader.executed[-1][1] == ([1],)
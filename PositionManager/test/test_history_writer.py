@@ -0,0 +1,50 @@
+from PositionManager.db import history_writer as history_writer_module
+from PositionManager.db.history_writer import HistoryWriter
+from PositionManager.test.fakes import FakeDBConnection
+
+
+def _connections(monkeypatch, *connections):
+    pending = list(connections)
+    monkeypatch.setattr(history_writer_module, "create_connection", lambda: pending.pop(0))
+    return connections
+
+
+def test_close_writes_pending_rows_with_one_copy(monkeypatch):
+    (conn,) = _connections(monkeypatch, FakeDBConnection())
+    writer = HistoryWriter()
+    assert writer.submit([(1, 10, 20, 0, 5, True), (1, 11, 21, 0, 5, False), (2, 0, 0, 0, None, False)]) == 3
+    writer.close()
+
+    assert conn.commits == 1 and conn.closed
+    assert [sql for sql, _params in conn.executed][1].startswith("COPY history_staging")
+    # la prima occorrenza di (user_id, node_id) vince; None diventa \N
+    lines = [line.split("\t")[:6] for line in conn.copied[0].splitlines()]
+    assert lines == [["1", "10", "20", "0", "5", "t"], ["2", "0", "0", "0", "\\N", "f"]]
+    metrics = writer.metrics()
+    assert (metrics["enqueued"], metrics["written"], metrics["queue_depth"]) == (3, 3, 0)
+    # chiuso: le righe successive sono ignorate
+    assert writer.submit([(3, 0, 0, 0, 1, False)]) == 0
+
+
+def test_full_queue_drops_rows_after_the_timeout(monkeypatch):
+    monkeypatch.setenv("HISTORY_QUEUE_SIZE", "1")
+    monkeypatch.setenv("HISTORY_ENQUEUE_TIMEOUT_MS", "0")
+    writer = HistoryWriter()
+    monkeypatch.setattr(writer, "start", lambda: None)
+
+    assert writer.submit([(1, 0, 0, 0, 1, False), (2, 0, 0, 0, 1, False), (3, 0, 0, 0, 1, False)]) == 1
+    metrics = writer.metrics()
+    assert (metrics["enqueued"], metrics["dropped"], metrics["full_waits"]) == (1, 2, 2)
+
+
+def test_failed_batch_is_retried_on_a_fresh_connection(monkeypatch):
+    broken, healthy = _connections(monkeypatch, FakeDBConnection(fail=True), FakeDBConnection())
+    sleeps = []
+    monkeypatch.setattr(history_writer_module.time, "sleep", sleeps.append)
+    writer = HistoryWriter()
+
+    writer._write_with_retry([(1, 0, 0, 0, 1, False, None)])
+    assert broken.rollbacks == 1 and broken.closed
+    assert healthy.commits == 1
+    assert sleeps == [writer.retry_initial]
+    assert writer.metrics()["failed_batches"] == 1
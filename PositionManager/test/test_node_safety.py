@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from PositionManager.db import node_safety
+from PositionManager.db.node_safety import NODE_SAFE_CHANNEL, NodeSafetySnapshot
+from PositionManager.test.fakes import FakeDBConnection
+
+
+def test_not_loaded_means_ask_the_database():
+    snapshot = NodeSafetySnapshot()
+    assert snapshot.get(1) is None
+
+
+def test_connect_listens_before_loading(monkeypatch):
+    conn = FakeDBConnection([(1, True), (2, False)])
+    monkeypatch.setattr(node_safety, "create_connection", lambda: conn)
+    snapshot = NodeSafetySnapshot()
+
+    assert snapshot._connect() is conn
+    # LISTEN prima della SELECT: nessuna modifica persa tra caricamento e notifiche
+    assert [sql for sql, _params in conn.executed] == [f"LISTEN {NODE_SAFE_CHANNEL};", "SELECT node_id, safe FROM nodes;"]
+    assert snapshot.loaded
+    assert snapshot.get(1) is True and snapshot.get(2) is False
+    # nodo sconosciuto: non sicuro
+    assert snapshot.get(3) is False
+
+
+def test_notifications_update_the_snapshot(monkeypatch):
+    monkeypatch.setattr(node_safety, "create_connection", lambda: FakeDBConnection([(1, False)]))
+    snapshot = NodeSafetySnapshot()
+    snapshot._connect()
+
+    snapshot._apply(json.dumps({"node_id": 1, "safe": True}))
+    snapshot._apply(json.dumps({"node_id": 5, "safe": True}))
+    assert snapshot.get(1) is True and snapshot.get(5) is True
+    snapshot._apply(json.dumps({"node_id": 5, "deleted": True}))
+    assert snapshot.get(5) is False
+
+
+def test_connect_fails_without_database(monkeypatch):
+    monkeypatch.setattr(node_safety, "create_connection", lambda: None)
+    snapshot = NodeSafetySnapshot()
+    with pytest.raises(ConnectionError):
+        snapshot._connect()
+    assert snapshot.get(1) is None
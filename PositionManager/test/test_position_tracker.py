@@ -0,0 +1,76 @@
+from PositionManager.db import position_tracker
+from PositionManager.db.position_tracker import PositionTracker
+from PositionManager.test.fakes import FakeDBConnection
+
+
+def _p(user_id, node_id, danger):
+    return {"user_id": user_id, "node_id": node_id, "danger": danger}
+
+
+def test_apply_tracks_counts_and_membership():
+    tracker = PositionTracker()
+    tracker.apply([_p(1, 10, True), _p(2, 10, True), _p(3, 20, False)])
+    assert tracker.counts() == (3, 1)
+    assert tracker.danger_membership() == {10: [1, 2]}
+    assert not tracker.is_everyone_safe()
+
+    # l'utente 1 si sposta in un nodo sicuro, il 2 in un altro nodo in pericolo
+    tracker.apply([_p(1, 20, False), _p(2, 30, True)])
+    assert tracker.counts() == (3, 2)
+    assert tracker.danger_membership() == {30: [2]}
+
+    tracker.apply([_p(2, 20, False)])
+    assert tracker.is_everyone_safe() and tracker.in_danger() == 0
+
+
+def test_take_delta_reports_changed_and_cleared_nodes():
+    tracker = PositionTracker()
+    tracker.apply([_p(1, 10, True), _p(2, 20, True)])
+    assert tracker.take_delta() == ({10: [1], 20: [2]}, [])
+    assert tracker.take_delta() == ({}, [])
+
+    tracker.apply([_p(1, 20, True)])
+    assert tracker.take_delta() == ({20: [1, 2]}, [10])
+    # una posizione invariata non sporca nulla
+    tracker.apply([_p(1, 20, True)])
+    assert not tracker.has_changes()
+
+    tracker.apply([_p(3, 40, True)])
+    assert tracker.snapshot() == {20: [1, 2], 40: [3]}
+    assert tracker.take_delta() == ({}, [])
+
+
+def test_reconcile_replaces_state_and_marks_corrected_nodes(monkeypatch):
+    tracker = PositionTracker()
+    tracker.apply([_p(1, 10, True), _p(2, 10, True)])
+    tracker.take_delta()
+
+    # su DB l'utente 2 è al sicuro e c'è un utente 3 in pericolo nel nodo 30
+    rows = [(1, 10, True), (2, 20, False), (3, 30, True)]
+    monkeypatch.setattr(position_tracker, "create_connection", lambda: FakeDBConnection(rows))
+    assert tracker.reconcile()
+    assert tracker.loaded
+    assert tracker.counts() == (3, 1)
+    assert tracker.danger_membership() == {10: [1], 30: [3]}
+    assert tracker.take_delta() == ({10: [1], 30: [3]}, [])
+
+
+def test_reconcile_is_skipped_if_a_batch_is_applied_meanwhile(monkeypatch):
+    tracker = PositionTracker()
+    conn = FakeDBConnection([(1, 10, True)], on_execute=lambda sql, params: tracker.apply([_p(1, 20, False)]))
+    monkeypatch.setattr(position_tracker, "create_connection", lambda: conn)
+
+    assert not tracker.reconcile()
+    assert not tracker.loaded
+    assert tracker.danger_membership() == {}
+    assert conn.closed
+
+
+def test_reconcile_without_database_keeps_state(monkeypatch):
+    tracker = PositionTracker()
+    tracker.apply([_p(1, 10, True)])
+    monkeypatch.setattr(position_tracker, "create_connection", lambda: None)
+    assert not tracker.reconcile()
+    monkeypatch.setattr(position_tracker, "create_connection", lambda: FakeDBConnection(fail=True))
+    assert not tracker.reconcile()
+    assert tracker.danger_membership() == {10: [1]}
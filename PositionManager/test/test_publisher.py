@@ -0,0 +1,32 @@
+import threading
+import time
+
+from PositionManager.rabbitmq.publisher import MessagePublisher
+
+
+def _publisher(monkeypatch, timeout_ms="0"):
+    monkeypatch.setenv("PUBLISH_QUEUE_SIZE", "1")
+    monkeypatch.setenv("PUBLISH_ENQUEUE_TIMEOUT_MS", timeout_ms)
+    return MessagePublisher()
+
+
+def test_full_queue_drops_instead_of_blocking(monkeypatch):
+    publisher = _publisher(monkeypatch)
+    assert publisher.publish("map_manager_queue", "{}") is True
+    assert publisher.publish("map_manager_queue", "{}") is False
+    assert publisher.dropped == 1
+
+
+def test_close_returns_when_the_publisher_thread_is_stuck(monkeypatch):
+    publisher = _publisher(monkeypatch)
+    publisher.publish("alerted_users_queue", "{}")
+    # thread che non svuota la coda (broker irraggiungibile)
+    release = threading.Event()
+    publisher._thread = threading.Thread(target=release.wait, daemon=True)
+    publisher._thread.start()
+
+    start = time.monotonic()
+    publisher.close(timeout=0.2)
+    assert time.monotonic() - start < 1.0
+    assert publisher.publish("alerted_users_queue", "{}") is False
+    release.set()
@@ -0,0 +1,178 @@
+import json
+
+import pika
+
+from common.position_codec import BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, decode_positions, encode_positions
+from PositionManager.rabbitmq.sharding import (
+    APPLIED_QUEUE, PositionRouter, PositionShardWorker, ShardCoordinator,
+    shard_for, shard_queue
+)
+from PositionManager.test.fakes import FakeChannel, FakeConnection, FakeDB, FakeTracker, Method, Properties
+
+
+def _position(user_id, node_id=1, event="Fire"):
+    return {"user_id": user_id, "x": user_id, "y": 0, "z": 0, "node_id": node_id, "event": event}
+
+
+def _setup_batching(obj, channel):
+    obj.channel = channel
+    obj.connection = FakeConnection()
+    obj.batch_size = 100
+    obj.batch_max_wait = 0.05
+    obj._batch = []
+    obj._batch_timer = None
+    obj._consume_input()
+    channel.calls.clear()
+
+
+def _router(shards=2, chunk=1000, channel=None):
+    router = PositionRouter.__new__(PositionRouter)
+    router.shards = shards
+    router.chunk = chunk
+    _setup_batching(router, channel or FakeChannel())
+    return router
+
+
+def _worker(shard=0, channel=None):
+    worker = PositionShardWorker.__new__(PositionShardWorker)
+    worker.shard = shard
+    worker.queue = worker.input_queue = shard_queue(shard)
+    worker.dead_letter_queue = f"{worker.queue}.dead"
+    worker.db_manager = FakeDB()
+    worker._failed_flushes = 0
+    _setup_batching(worker, channel or FakeChannel())
+    return worker
+
+
+def _deliver(consumer, bodies):
+    for tag, (body, content_type) in enumerate(bodies, start=1):
+        consumer.process_message(consumer.channel, Method(tag), Properties(content_type), body)
+
+
+def test_shard_for_is_stable_per_user():
+    assert [shard_for(user_id, 4) for user_id in (0, 1, 5, "6")] == [0, 1, 1, 2]
+    assert shard_for(None, 4) == 0
+    # id non interi: crc32, sempre lo stesso shard
+    assert shard_for("alice", 4) == shard_for("alice", 4)
+    assert 0 <= shard_for("alice", 4) < 4
+
+
+def test_router_partitions_binary_records_without_reencoding():
+    router = _router(shards=2)
+    first = encode_positions([_position(1), _position(2), _position(3)], "binary")
+    second = encode_positions([_position(4), _position(5)], "binary")
+    routed = router._route([(1, *first), (2, *second)])
+
+    # envelope consecutivi con la stessa tabella eventi: un solo messaggio per shard
+    assert [(shard, content_type, indexes) for shard, _b, content_type, indexes in routed] == [
+        (1, BINARY_CONTENT_TYPE, {0, 1}), (0, BINARY_CONTENT_TYPE, {0, 1})
+    ]
+    bodies = {shard: decode_positions(body, BINARY_CONTENT_TYPE) for shard, body, _c, _i in routed}
+    assert bodies == {1: [_position(1), _position(3), _position(5)], 0: [_position(2), _position(4)]}
+
+
+def test_router_chunks_and_keeps_per_shard_order_across_formats():
+    router = _router(shards=1, chunk=2)
+    binary = encode_positions([_position(1), _position(2), _position(3)], "binary")
+    single = (json.dumps(_position(4)), JSON_CONTENT_TYPE)
+    other_events = encode_positions([_position(5, event="Flood")], "binary")
+    routed = router._route([(1, *binary), (2, *single), (3, *other_events)])
+
+    users = [[p["user_id"] for p in decode_positions(body, content_type)] for _s, body, content_type, _i in routed]
+    assert users == [[1, 2], [3], [4], [5]]
+    # il messaggio JSON con un solo shard è inoltrato invariato
+    assert routed[2][1] is single[0]
+
+
+def test_router_splits_json_lists_and_forwards_malformed_to_shard_zero():
+    router = _router(shards=2)
+    mixed = json.dumps([_position(1), _position(2), _position(3)])
+    routed = router._route([(1, mixed, None), (2, b"\x07garbage", BINARY_CONTENT_TYPE)])
+
+    assert [(shard, body) for shard, body, _c, _i in routed[2:]] == [(0, b"\x07garbage")]
+    assert [(shard, json.loads(body)) for shard, body, _c, _i in routed[:2]] == [
+        (1, [_position(1), _position(3)]), (0, _position(2))
+    ]
+
+
+def test_router_acks_the_forwarded_prefix_and_requeues_the_rest_in_order():
+    channel = FakeChannel(fail_publish_to={shard_queue(1)}, publish_error=pika.exceptions.NackError)
+    router = _router(shards=2, channel=channel)
+    # utente 2 -> shard 0, utente 1 -> shard 1
+    _deliver(router, [(json.dumps(_position(u)), JSON_CONTENT_TYPE) for u in (2, 1, 2)])
+    router.flush_batch()
+
+    assert channel.calls == [
+        ("publish", shard_queue(0)),
+        ("ack", 1, True),
+        ("cancel", "ctag-1"), ("nack", 3, True, True), ("consume", "position_queue", "ctag-2"),
+    ]
+
+
+def test_router_acks_the_whole_batch_when_everything_is_confirmed():
+    router = _router(shards=2)
+    _deliver(router, [(json.dumps(_position(u)), JSON_CONTENT_TYPE) for u in (1, 2)])
+    router.flush_batch()
+    assert router.channel.calls == [("publish", shard_queue(1)), ("publish", shard_queue(0)), ("ack", 2, True)]
+
+
+def test_worker_does_not_reapply_when_applied_publish_fails():
+    channel = FakeChannel(fail_publish_to={APPLIED_QUEUE}, publish_error=pika.exceptions.NackError)
+    worker = _worker(channel=channel)
+    applied = []
+    worker.db_manager.apply_positions_batch = lambda positions: applied.append(positions) or True
+    _deliver(worker, [encode_positions([_position(2), _position(4)], "binary")])
+    worker.flush_batch()
+
+    assert len(applied) == 1
+    # pubblicazione ritentata, poi batch confermato: già su DB, lo recupera la riconciliazione
+    assert channel.calls == [("ack", 1, True)]
+    assert not channel.published
+
+
+def test_worker_publishes_applied_positions_then_acks():
+    worker = _worker(shard=1)
+    worker.db_manager = FakeDB(dangerous={1})
+    worker.db_manager.apply_positions_batch = lambda positions: True
+    _deliver(worker, [encode_positions([_position(1), _position(3, node_id=2)], "binary")])
+    worker.flush_batch()
+
+    assert worker.channel.calls == [("publish", APPLIED_QUEUE), ("ack", 1, True)]
+    payload = json.loads(worker.channel.published[0][1])
+    assert payload == {"shard": 1, "positions": [
+        {"event": "Fire", "user_id": 1, "node_id": 1, "danger": True},
+        {"event": "Fire", "user_id": 3, "node_id": 2, "danger": False},
+    ]}
+
+
+def test_worker_requeues_in_order_then_dead_letters_a_failing_batch():
+    worker = _worker()
+    worker.db_manager.apply_positions_batch = lambda positions: False
+    body = encode_positions([_position(2)], "binary")
+    _deliver(worker, [body])
+    worker.flush_batch()
+    assert worker.channel.calls == [
+        ("cancel", "ctag-1"), ("nack", 1, True, True), ("consume", shard_queue(0), "ctag-2")
+    ]
+
+    worker.channel.calls.clear()
+    _deliver(worker, [body])
+    worker.flush_batch()
+    assert worker.channel.calls == [("publish", f"{shard_queue(0)}.dead"), ("ack", 1, True)]
+    assert worker._failed_flushes == 0
+
+
+def test_coordinator_updates_the_tracker_without_writing():
+    coordinator = ShardCoordinator.__new__(ShardCoordinator)
+    coordinator.tracker = FakeTracker()
+    coordinator._failed_flushes = 0
+    coordinator.dead_letter_queue = f"{APPLIED_QUEUE}.dead"
+    coordinator._after_batch = lambda positions: None
+    _setup_batching(coordinator, FakeChannel())
+    positions = [{"event": "Fire", "user_id": 1, "node_id": 1, "danger": True}]
+    _deliver(coordinator, [(json.dumps({"shard": 1, "positions": positions}), None)])
+    coordinator.flush_batch()
+
+    assert coordinator.channel.calls == [("ack", 1, True)]
+    assert coordinator.tracker.applied == [positions]
+
@@ -12,6 +12,13 @@ class Config:
         self.simulation_tick: float = 1.0
         self.timeout_after_stop: int = 60
         self.time_slots: List[Dict] = []
+        self.wire_format: str = "json"
+        self.engine: str = "objects"
+        self.publish_batch_size: int = 500
+        self.seed = None                     # None = casuale; intero = run ripetibile
+        self.virtual_time: bool = False      # tick senza sleep su un orologio simulato
+        self.virtual_start: str = "09:00"    # ora simulata di partenza (HH:MM) in virtual_time
+        self.max_simulated_seconds: float = 0  # 0 = nessun limite
         
         
         # Valori di default per RabbitMQ
@@ -42,6 +49,13 @@ class Config:
             self.simulation_mode = cfg.get("simulation_mode", "from_scratch")
             self.user_file = cfg.get("user_file", None)
             self.alert_event_type = cfg.get("alert_event_type", None)
+            self.wire_format = cfg.get("wire_format", self.wire_format)
+            self.engine = cfg.get("engine", self.engine)
+            self.publish_batch_size = cfg.get("publish_batch_size", self.publish_batch_size)
+            self.seed = cfg.get("seed", self.seed)
+            self.virtual_time = cfg.get("virtual_time", self.virtual_time)
+            self.virtual_start = cfg.get("virtual_start", self.virtual_start)
+            self.max_simulated_seconds = cfg.get("max_simulated_seconds", self.max_simulated_seconds)
 
             
             self._validate_config()
@@ -55,6 +69,18 @@ class Config:
         """Validate configuration values"""
         if self.n_users <= 0:
             raise ValueError("n_users must be positive")
+        if self.wire_format not in ("json", "binary"):
+            raise ValueError("wire_format must be 'json' or 'binary'")
+        if self.publish_batch_size <= 0:
+            raise ValueError("publish_batch_size must be positive")
+        if self.engine not in ("objects", "vectorized"):
+            raise ValueError("engine must be 'objects' or 'vectorized'")
+        if self.seed is not None and (not isinstance(self.seed, int) or self.seed < 0):
+            raise ValueError("seed must be a non-negative integer")
+        if self.max_simulated_seconds < 0:
+            raise ValueError("max_simulated_seconds must not be negative")
+        if self.virtual_time:
+            self._parse_time(self.virtual_start)
         if not self.time_slots:
             logger.warning("No time slots defined in configuration")
 
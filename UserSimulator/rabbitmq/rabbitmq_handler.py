@@ -7,29 +7,52 @@ import queue
 import threading
 import traceback
 from UserSimulator.utils.logger import logger
+from common.position_codec import encode_positions
+
+_STOP = object()
+
 
 class RabbitMQHandler:
+    """
+    Connessione di consumo (alert / evacuation path) usata solo dal thread di start(), e
+    connessione di pubblicazione separata, usata solo da un thread dedicato: pika
+    BlockingConnection non è thread-safe. publish_position / publish_positions accodano
+    il messaggio e ritornano subito; il thread lo pubblica con publisher confirms
+    (confirm_delivery) e si riconnette da solo, ripubblicando il messaggio non confermato.
+    """
+
     def __init__(self, config, simulator):
         self.config = config
         self.simulator = simulator
         self.connection = None
         self.channel = None
 
+        # coda limitata: se il broker rallenta, il simulatore attende su put() al massimo
+        # publish_timeout secondi, poi scarta il messaggio invece di accumulare o bloccarsi
+        self._publish_queue = queue.Queue(maxsize=int(self.config.rabbitmq.get("publish_queue_size", 1000)))
+        self.publish_timeout = float(self.config.rabbitmq.get("publish_timeout", 2.0))
+        self.close_timeout = float(self.config.rabbitmq.get("close_timeout", 10.0))
+        self._publisher_thread = None
+        self._publish_connection = None
+        self._publish_channel = None
+        self.reconnect_delay = 5
+
+    def _connection_parameters(self):
+        credentials = pika.PlainCredentials(
+            self.config.rabbitmq.get("username", "guest"),
+            self.config.rabbitmq.get("password", "guest")
+        )
+        return pika.ConnectionParameters(
+            host=self.config.rabbitmq.get("host", "localhost"),
+            port=self.config.rabbitmq.get("port", 5672),
+            credentials=credentials,
+            heartbeat=600,  # Aggiungi heartbeat
+            blocked_connection_timeout=300  # Timeout per connessioni bloccate
+        )
 
     def connect(self):
         try:
-            credentials = pika.PlainCredentials(
-                self.config.rabbitmq.get("username", "guest"),
-                self.config.rabbitmq.get("password", "guest")
-            )
-            parameters = pika.ConnectionParameters(
-                host=self.config.rabbitmq.get("host", "localhost"),
-                port=self.config.rabbitmq.get("port", 5672),
-                credentials=credentials,
-                heartbeat=600,  # Aggiungi heartbeat
-                blocked_connection_timeout=300  # Timeout per connessioni bloccate
-            )
-            self.connection = pika.BlockingConnection(parameters)
+            self.connection = pika.BlockingConnection(self._connection_parameters())
             self.channel = self.connection.channel()
 
             # Aumenta il prefetch count
@@ -82,6 +105,64 @@ class RabbitMQHandler:
             logger.error(f"Failed to connect RabbitMQ: {e}")
             raise
 
+        self._start_publisher()
+
+    def _start_publisher(self):
+        if self._publisher_thread is None:
+            self._publisher_thread = threading.Thread(target=self._publisher_loop, name="PositionPublisher", daemon=True)
+            self._publisher_thread.start()
+            logger.info("RabbitMQ publisher thread started.")
+
+    def _connect_publisher(self):
+        self._publish_connection = pika.BlockingConnection(self._connection_parameters())
+        self._publish_channel = self._publish_connection.channel()
+        self._publish_channel.queue_declare(
+            queue=self.config.rabbitmq.get("position_queue", "position_queue"),
+            durable=True,
+            arguments={'x-queue-type': 'classic'}
+        )
+        self._publish_channel.confirm_delivery()  # basic_publish ritorna solo dopo l'ack del broker
+        logger.info("RabbitMQ publisher connected (publisher confirms enabled).")
+
+    def _disconnect_publisher(self):
+        try:
+            if self._publish_connection and self._publish_connection.is_open:
+                self._publish_connection.close()
+        except Exception:
+            pass
+        self._publish_connection = self._publish_channel = None
+
+    def _publisher_loop(self):
+        pending = None
+        while True:
+            try:
+                if not self._publish_connection or self._publish_connection.is_closed:
+                    self._connect_publisher()
+                if pending is None:
+                    try:
+                        pending = self._publish_queue.get(timeout=1.0)
+                    except queue.Empty:
+                        # nessun messaggio: gestisce heartbeat ed eventi della connessione
+                        self._publish_connection.process_data_events(time_limit=0)
+                        continue
+                if pending is _STOP:
+                    break
+
+                body, content_type = pending
+                self._publish_channel.basic_publish(
+                    exchange='',
+                    routing_key=self.config.rabbitmq.get("position_queue", "position_queue"),
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2, content_type=content_type)  # rende il messaggio persistente
+                )
+                pending = None
+            except Exception as e:
+                # messaggio non confermato (nack, connessione persa...): riconnessione e nuovo invio
+                logger.error(f"Publisher error, reconnecting and retrying: {e}")
+                self._disconnect_publisher()
+                time.sleep(self.reconnect_delay)
+        self._disconnect_publisher()
+
     def on_alert(self, ch, method, properties, body):
         try:
             message = json.loads(body)
@@ -162,21 +243,49 @@ class RabbitMQHandler:
             return False
 
 
+    def _enqueue(self, message):
+        """
+        Accoda un messaggio per il thread di pubblicazione. Chiamato anche dal thread di consumo
+        (handle_alert): non si blocca oltre publish_timeout, a coda piena il messaggio è scartato.
+        """
+        try:
+            self._publish_queue.put(message, timeout=self.publish_timeout)
+            return True
+        except queue.Full:
+            logger.error(f"Publish queue full for {self.publish_timeout}s, position message dropped")
+            return False
+
     def publish_position(self, position_data):
         try:
-            msg = json.dumps(position_data)
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=self.config.rabbitmq.get("position_queue", "position_queue"),  # usa config
-                body=msg,
-                properties=pika.BasicProperties(delivery_mode=2)  # rende il messaggio persistente
-            )
-            logger.debug(f"Published position for user {position_data.get('user_id', 'unknown')}")
+            # formato scelto da config.wire_format, dichiarato nel content_type
+            if self._enqueue(encode_positions([position_data], self.config.wire_format)):
+                logger.debug(f"Published position for user {position_data.get('user_id', 'unknown')}")
         except Exception as e:
             logger.error(f"Failed to publish position message: {e}")
 
+    def publish_positions(self, positions):
+        """
+        Pubblica molte posizioni in messaggi batch (al massimo config.publish_batch_size
+        posizioni per messaggio), nel formato config.wire_format.
+        """
+        size = max(1, int(self.config.publish_batch_size))
+        queued = 0
+        for start in range(0, len(positions), size):
+            queued += self._enqueue(encode_positions(positions[start:start + size], self.config.wire_format))
+        logger.debug(f"Queued {len(positions)} positions in {queued}/{-(-len(positions) // size)} messages")
+
 
     def close(self):
+        # prima svuota la coda di pubblicazione, poi chiude le connessioni
+        if self._publisher_thread is not None:
+            deadline = time.monotonic() + self.close_timeout
+            try:
+                self._publish_queue.put(_STOP, timeout=self.close_timeout)
+            except queue.Full:
+                # publisher fermo (broker irraggiungibile): i messaggi in coda vanno persi
+                logger.warning(f"Publish queue still full on close, dropping {self._publish_queue.qsize()} pending messages")
+            self._publisher_thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            self._publisher_thread = None
         if self.channel:
             self.channel.close()
         if self.connection:
@@ -0,0 +1,143 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+
+class MapIndex:
+    """
+    Indici della mappa costruiti una volta al caricamento e condivisi da tutti gli utenti
+    (oggetti User e VectorEngine):
+      - node_id -> nodo, arc_id -> arco
+      - adiacenza (non orientata) node_id -> nodi collegati da un arco
+      - forma ad array per il motore vettoriale: box dei nodi (lo/hi), estremi e lunghezze
+        degli archi, adiacenza padded (adj[v, :adj_deg[v]]), indici riga node_index / arc_index
+      - griglia uniforme sul piano x/y dei box dei nodi (x1..x2, y1..y2) per trovare
+        il nodo che contiene un punto senza scandire tutta la lista
+
+    containing_node (un punto) e locate (array di punti) usano la stessa griglia e
+    restituiscono gli stessi risultati della scansione lineare di User (primo nodo della lista).
+    """
+
+    def __init__(self, nodes, arcs, cell_size=None):
+        self.nodes = nodes
+        self.arcs = arcs
+        self.node_by_id = {n['node_id']: n for n in nodes}
+        self.arc_by_id = {a['arc_id']: a for a in arcs}
+
+        self.adjacency = defaultdict(set)
+        for arc in arcs:
+            a, b = int(arc['initial_node']), int(arc['final_node'])
+            self.adjacency[a].add(b)
+            self.adjacency[b].add(a)
+
+        self._build_nodes(nodes)
+        self._build_arcs(arcs)
+        self._build_grid(cell_size)
+
+    # ---------- forma ad array ----------
+    def _build_nodes(self, nodes):
+        self.node_ids = np.array([n['node_id'] for n in nodes], dtype=np.int64)
+        self.node_index = {int(n): i for i, n in enumerate(self.node_ids)}
+        self.lo = np.array([[n['x1'], n['y1'], n['z1']] for n in nodes], dtype=np.float64).reshape(-1, 3)
+        self.hi = np.array([[n['x2'], n['y2'], n['z2']] for n in nodes], dtype=np.float64).reshape(-1, 3)
+
+    def _build_arcs(self, arcs):
+        # solo archi tra nodi noti (gli altri non sono percorribili dal motore vettoriale)
+        arcs = [a for a in arcs if a['initial_node'] in self.node_index and a['final_node'] in self.node_index]
+        self.arc_index = {int(a['arc_id']): i for i, a in enumerate(arcs)}
+        self.arc_ini = np.array([self.node_index[a['initial_node']] for a in arcs], dtype=np.int64)
+        self.arc_fin = np.array([self.node_index[a['final_node']] for a in arcs], dtype=np.int64)
+        self.p1 = np.array([[a['x1'], a['y1'], a['z1']] for a in arcs], dtype=np.float64).reshape(-1, 3)
+        self.p2 = np.array([[a['x2'], a['y2'], a['z2']] for a in arcs], dtype=np.float64).reshape(-1, 3)
+        self.arc_len = np.linalg.norm(self.p2 - self.p1, axis=1)
+
+        neighbours = [set() for _ in range(len(self.node_ids))]
+        for u, v in zip(self.arc_ini.tolist(), self.arc_fin.tolist()):
+            neighbours[u].add(v)
+            neighbours[v].add(u)
+        width = max((len(s) for s in neighbours), default=0) or 1
+        self.adj = np.full((len(neighbours), width), -1, dtype=np.int64)
+        self.adj_deg = np.zeros(len(neighbours), dtype=np.int64)
+        for v, s in enumerate(neighbours):
+            self.adj[v, :len(s)] = sorted(s)
+            self.adj_deg[v] = len(s)
+
+    def _build_grid(self, cell_size):
+        """
+        Griglia uniforme x/y: cells[c] = righe dei nodi (in ordine crescente) il cui box tocca
+        la cella c; cell_nodes è la stessa tabella padded con -1 per le ricerche vettoriali.
+        Lato della cella: mediana delle dimensioni dei box, pochi nodi per cella e poche celle per nodo.
+        """
+        n = len(self.node_ids)
+        if n == 0:
+            self.origin, self.cell, self.shape = np.zeros(2), 1.0, (1, 1)
+            self.cells = [[]]
+            self.cell_nodes = np.full((1, 1), -1, dtype=np.int64)
+            return
+        size = self.hi[:, :2] - self.lo[:, :2]
+        self.cell = float(cell_size or max(np.median(size), 1.0))
+        self.origin = self.lo[:, :2].min(axis=0)
+        cmin = np.floor((self.lo[:, :2] - self.origin) / self.cell).astype(np.int64)
+        cmax = np.floor((self.hi[:, :2] - self.origin) / self.cell).astype(np.int64)
+        self.shape = tuple(int(v) + 1 for v in cmax.max(axis=0))
+
+        self.cells = [[] for _ in range(self.shape[0] * self.shape[1])]
+        for i in range(n):
+            for cx in range(cmin[i, 0], cmax[i, 0] + 1):
+                for cy in range(cmin[i, 1], cmax[i, 1] + 1):
+                    self.cells[cx * self.shape[1] + cy].append(i)
+        width = max(len(c) for c in self.cells) or 1
+        self.cell_nodes = np.full((len(self.cells), width), -1, dtype=np.int64)
+        for c, members in enumerate(self.cells):
+            self.cell_nodes[c, :len(members)] = members
+
+    # ---------- lookup ----------
+    def node(self, node_id):
+        return self.node_by_id.get(node_id)
+
+    def arc(self, arc_id):
+        return self.arc_by_id.get(arc_id)
+
+    def adjacent(self, node_id):
+        return list(self.adjacency.get(int(node_id), ()))
+
+    def connected(self, node_a, node_b):
+        return int(node_b) in self.adjacency.get(int(node_a), ())
+
+    def containing_node(self, x, y, z):
+        """node_id del primo nodo (nell'ordine della lista) che contiene il punto, None se nessuno."""
+        cx = math.floor((x - self.origin[0]) / self.cell)
+        cy = math.floor((y - self.origin[1]) / self.cell)
+        if not (0 <= cx < self.shape[0] and 0 <= cy < self.shape[1]):
+            return None
+        for i in self.cells[cx * self.shape[1] + cy]:
+            node = self.nodes[i]
+            if node['x1'] <= x <= node['x2'] and \
+            node['y1'] <= y <= node['y2'] and \
+            node['z1'] <= z <= node['z2']:
+                return node['node_id']
+        return None
+
+    def locate(self, points):
+        """
+        Come containing_node per un array di punti (n, 3): riga del primo nodo che contiene
+        ciascun punto, -1 se nessuno.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        out = np.full(len(points), -1, dtype=np.int64)
+        if not len(points):
+            return out
+        c = np.floor((points[:, :2] - self.origin) / self.cell).astype(np.int64)
+        inside = (c[:, 0] >= 0) & (c[:, 1] >= 0) & (c[:, 0] < self.shape[0]) & (c[:, 1] < self.shape[1])
+        if not inside.any():
+            return out
+        rows = np.flatnonzero(inside)
+        cand = self.cell_nodes[c[rows, 0] * self.shape[1] + c[rows, 1]]          # (m, K)
+        valid = cand >= 0
+        safe = np.where(valid, cand, 0)
+        p = points[rows][:, None, :]
+        hit = valid & np.all((self.lo[safe] <= p) & (p <= self.hi[safe]), axis=2)
+        found = hit.any(axis=1)
+        out[rows[found]] = cand[found, hit[found].argmax(axis=1)]
+        return out
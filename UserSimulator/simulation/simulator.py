@@ -1,9 +1,11 @@
-from datetime import datetime, time as dtime
+from datetime import datetime, time as dtime, timedelta
 import time
 from typing import Dict, List
 import random
 from collections import defaultdict
+from UserSimulator.simulation.map_index import MapIndex
 from UserSimulator.simulation.user import User
+from UserSimulator.simulation.vector_engine import ALLERTA, SALVO, PositionsView, UserView, VectorEngine
 import numpy as np
 from UserSimulator.utils.logger import logger
 import csv
@@ -14,6 +16,7 @@ class Simulator:
         self.config = config
         self.nodes = nodes
         self.arcs = arcs
+        self.map_index = MapIndex(nodes, arcs)  # lookup per id, adiacenza e griglia spaziale condivisi
         self.users = {}
         self.users_lock = threading.RLock()
         self.initialization_complete = False
@@ -24,6 +27,18 @@ class Simulator:
         self.running = False
         self.publisher = publisher
         self._already_published_salvo = set()
+        self.engine = None  # VectorEngine se config.engine == "vectorized"
+
+        # Casualità: con config.seed la run è ripetibile (stream per utente derivati dal seed)
+        self.seed = config.seed
+        self._random = random.Random(self.seed)
+
+        # Orologio: reale, oppure simulato (virtual_time) che avanza di simulation_tick a ogni tick
+        self.sim_start = None
+        self.sim_time = None
+        if config.virtual_time:
+            start = config._parse_time(config.virtual_start)
+            self.sim_start = self.sim_time = datetime.combine(datetime.now().date(), start)
 
     def _users_values_snapshot(self):
         """Copia immutabile degli utenti per iterazioni sicure."""
@@ -40,8 +55,29 @@ class Simulator:
         with self.users_lock:
             return self.users.get(user_id)
 
+    def now(self):
+        """Ora della simulazione: simulata in virtual_time, altrimenti quella reale."""
+        return self.sim_time if self.sim_time is not None else datetime.now()
+
+    def _user_rng(self, user_id):
+        """Stream casuale dell'utente: np.random.default_rng([seed, user_id]) se c'è un seed."""
+        if self.seed is None:
+            return None
+        return np.random.default_rng([self.seed, int(user_id)])
+
+
+    def _publish_positions(self, messages):
+        """Pubblica le posizioni raccolte (tick, alert, caricamento CSV) in messaggi batch."""
+        if not self.publisher or not messages:
+            return
+        try:
+            self.publisher.publish_positions(messages)
+            logger.debug(f"Published {len(messages)} positions")
+        except Exception as e:
+            logger.error(f"Failed to publish {len(messages)} positions: {e}")
 
     def _load_users_from_csv(self):
+        initial_positions = []
         try:
             with open(self.config.user_file, newline="") as csvfile:
                 reader = csv.DictReader(csvfile)
@@ -49,7 +85,7 @@ class Simulator:
                     try:
                         user_id = int(row["user_id"])
                         node_id = int(row["node_id"])
-                        node = next((n for n in self.nodes if n["node_id"] == node_id), None)
+                        node = self.map_index.node(node_id)
                         if not node:
                             logger.warning(f"Node {node_id} not found for user {user_id}, skipping.")
                             continue
@@ -59,7 +95,8 @@ class Simulator:
                             user_id=user_id,
                             node=node,
                             speed_normal=self.config.speed_normal,
-                            speed_alert=self.config.speed_alert
+                            speed_alert=self.config.speed_alert,
+                            rng=self._user_rng(user_id)
                         )
 
                         # Posizione dal CSV
@@ -81,17 +118,16 @@ class Simulator:
                             self.users[user_id] = user
                         logger.info(f"User {user_id} loaded from CSV at node {node_id}, state={user.state}")
 
-                        if self.publisher:
-                            position_msg = user.get_position_message()
-                            self.publisher.publish_position(position_msg)
-                            logger.debug(f"Published initial position for user {user_id} from CSV")
-                            time.sleep(0.05)  # throttling per evitare chiusura canale RabbitMQ
+                        initial_positions.append(user.get_position_message())
 
                     except Exception as e:
                         logger.error(f"Failed to load user from row {row}: {e}")
         except Exception as e:
             logger.critical(f"Failed to load users from CSV: {e}", exc_info=True)
             raise
+
+        # Posizioni iniziali pubblicate tutte insieme, a batch
+        self._publish_positions(initial_positions)
     
     @staticmethod
     def _parse_danger_value(value: str) -> bool:
@@ -125,7 +161,7 @@ class Simulator:
     def _initialize_users_from_scratch(self):
         """Original random user initialization based on distribution."""
         try:
-            current_time = datetime.now().time()
+            current_time = self.now().time()
             distribution = self.config.get_distribution_for_current_time(current_time)
 
             if not distribution:
@@ -138,20 +174,21 @@ class Simulator:
 
             for user_id in range(self.config.n_users):
                 try:
-                    selected_type = random.choices(
+                    selected_type = self._random.choices(
                         list(distribution.keys()),
                         weights=list(distribution.values()),
                         k=1
                     )[0]
 
                     possible_nodes = node_types.get(selected_type, self.nodes)
-                    node = random.choice(possible_nodes)
+                    node = self._random.choice(possible_nodes)
 
                     user = User(
                         user_id=user_id,
                         node=node,
                         speed_normal=self.config.speed_normal,
-                        speed_alert=self.config.speed_alert
+                        speed_alert=self.config.speed_alert,
+                        rng=self._user_rng(user_id)
                     )
                     user.state = "normale"
                     with self.users_lock:
@@ -169,18 +206,53 @@ class Simulator:
             raise
 
 
+    def _enable_vector_engine(self):
+        """
+        Sposta gli utenti inizializzati nel VectorEngine: self.users contiene da qui in poi
+        UserView (stessa interfaccia di User) e users_positions è calcolato alla lettura.
+        """
+        with self.users_lock:
+            users = list(self.users.values())
+            # un solo stream per tutti gli array, derivato dal seed (ripetibile a parità di utenti)
+            rng = np.random.default_rng(self.seed) if self.seed is not None else None
+            self.engine = VectorEngine(self.map_index, users, rng=rng)
+            self.users = {u.user_id: UserView(self.engine, i) for i, u in enumerate(users)}
+            self.users_positions = PositionsView(self.engine)
+        logger.info(f"Vectorized engine enabled for {len(users)} users")
+
+    def _tick_vectorized(self, dt):
+        moved, blocked = self.engine.step(dt)
+        if not self.publisher:
+            return
+        state = self.engine.state
+
+        # In fase di allerta, pubblico solo se posizione cambiata o bloccato
+        alert = np.flatnonzero((state == ALLERTA) & (moved | blocked))
+        self.engine.event[alert] = self.alert_event
+        # Pubblico utenti in stato salvo
+        salvo = np.flatnonzero(state == SALVO)
+        self._already_published_salvo.update(self.engine.user_ids[salvo].tolist())
+
+        self._publish_positions([self.engine.position_message(i) for i in np.concatenate((alert, salvo)).tolist()])
+
     def tick(self):
         dt = self.config.simulation_tick
         logger.debug(f"Tick started (dt={dt}s)")
 
+        if self.engine is not None:
+            self._tick_vectorized(dt)
+            logger.debug("Tick completed")
+            return
+
+        changed_positions = []
         for user_id, user in self._users_items_snapshot():
             prev_pos = (user.x, user.y, user.z)
 
             if user.state == "normale":
-                user._move_free(self.arcs, self.nodes, dt)
+                user._move_free(self.arcs, self.nodes, dt, self.map_index)
                 moved = True
             else:
-                moved =user.update_position(self.arcs, self.nodes, dt)
+                moved =user.update_position(self.arcs, self.nodes, dt, self.map_index)
 
             new_pos = (user.x, user.y, user.z)
 
@@ -192,23 +264,15 @@ class Simulator:
             # In fase di allerta, pubblico solo se posizione cambiata o bloccato
             if user.state == "allerta" and (prev_pos != new_pos or user.blocked) and self.publisher:
                 user.event = self.alert_event
-                try:
-                    position_msg = user.get_position_message()
-                    self.publisher.publish_position(position_msg)
-                    logger.debug(f"Published updated position for user {user_id} during alert")
-                except Exception as e:
-                    logger.error(f"Failed to publish position for user {user_id}: {e}")
+                changed_positions.append(user.get_position_message())
 
             # Pubblico utente appena passato a salvo (salvo = stato "salvo")
             if user.state == "salvo":
-                try:
-                    position_msg = user.get_position_message()
-                    self.publisher.publish_position(position_msg)
-                    logger.debug(f"Published position for user {user_id} in stato salvo")
-                    self._already_published_salvo.add(user_id)
-                except Exception as e:
-                    logger.error(f"Failed to publish position for user {user_id}: {e}")
+                changed_positions.append(user.get_position_message())
+                self._already_published_salvo.add(user_id)
 
+        # Tutte le posizioni del tick in uno o pochi messaggi batch
+        self._publish_positions(changed_positions)
         logger.debug("Tick completed")
 
 
@@ -225,6 +289,7 @@ class Simulator:
         evacuation_paths = alert_msg.get('evacuation_paths', {})  # es: {user_id: [arc_ids]}
 
         affected = 0
+        alert_positions = []
         for user in self._users_values_snapshot():
             if user.state != "in_attesa_percorso":
                 affected += 1
@@ -241,25 +306,15 @@ class Simulator:
             elif path == [] and evacuation_paths:  
                 # Se c'è una mappa ma percorso vuoto, significa utente salvo
                 user.mark_as_salvo()
-                self.users_positions[user.user_id] = user.get_position_message()
+                if self.engine is None:  # col motore vettoriale users_positions è calcolato alla lettura
+                    self.users_positions[user.user_id] = user.get_position_message()
                 logger.info(f"After mark_as_salvo, user {user.user_id} state: {user.state}")
             
-            if self.publisher:
-                try:
-                    position_msg = {
-                        "user_id": user.user_id,
-                        "x": user.x,
-                        "y": user.y,
-                        "z": user.z,
-                        "node_id": getattr(user, 'current_node', None),  
-                        "event": self.alert_event
-                    }
-                    self.publisher.publish_position(position_msg)
-
-                    logger.debug(f"Published position for user {user.user_id} due to alert")
-                except Exception as e:
-                    logger.error(f"Failed to publish position for user {user.user_id}: {e}")
+            message = user.get_position_message()  # coordinate già convertite in int
+            message["event"] = self.alert_event
+            alert_positions.append(message)
 
+        self._publish_positions(alert_positions)
         logger.info(f"Alert applied to {affected} users")
 
 
@@ -276,11 +331,11 @@ class Simulator:
             user.state = "salvo"
             user.speed = user.speed_normal
             
-        self.stop_timer = datetime.now()
+        self.stop_timer = self.now()
         logger.info(f"Stop timer started at {self.stop_timer}")
 
     def _check_stop_resume(self):
-        elapsed = (datetime.now() - self.stop_timer).total_seconds()
+        elapsed = (self.now() - self.stop_timer).total_seconds()
         logger.debug(f"Checking stop resume: elapsed={elapsed}s, timeout={self.config.timeout_after_stop}s")
         if elapsed > self.config.timeout_after_stop:
             logger.info("Resuming normal operations")
@@ -297,10 +352,28 @@ class Simulator:
         self.running = True
 
         self.initialize_users()
-        logger.info("Simulator run() started.")
+        if self.config.engine == "vectorized" and self.engine is None:
+            self._enable_vector_engine()
+        logger.info(f"Simulator run() started (virtual_time={self.config.virtual_time}, seed={self.seed}).")
+        if self.sim_time is not None and not self.config.max_simulated_seconds:
+            logger.warning("virtual_time without max_simulated_seconds: ticks run back to back until the process is stopped.")
 
         while True:
             if self.state == "salvo" and self.stop_timer:
                 self._check_stop_resume()
             self.tick()
-            time.sleep(self.config.simulation_tick)
+
+            if self.sim_time is None:
+                time.sleep(self.config.simulation_tick)
+                continue
+
+            # Orologio simulato: nessuna attesa, il tempo avanza di un tick
+            self.sim_time += timedelta(seconds=self.config.simulation_tick)
+            elapsed = (self.sim_time - self.sim_start).total_seconds()
+            if self.config.max_simulated_seconds and elapsed >= self.config.max_simulated_seconds:
+                logger.info(f"Simulated time limit reached ({elapsed:.0f}s), simulator stopped.")
+                self.running = False
+                return
+            # senza sleep il loop non rilascerebbe mai il GIL: cede il turno al thread di consumo
+            # (alert, STOP) a ogni tick
+            time.sleep(0)
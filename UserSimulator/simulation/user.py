@@ -1,14 +1,15 @@
-import random
 import numpy as np
 from UserSimulator.utils.logger import logger
 
 class User:
-    def __init__(self, user_id, node, speed_normal, speed_alert):
+    def __init__(self, user_id, node, speed_normal, speed_alert, rng=None):
         self.user_id = user_id
+        # stream casuale dell'utente (np.random.Generator): con un seed la simulazione è ripetibile
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.current_node = node['node_id']
-        self.x = int(round(np.random.uniform(node['x1'], node['x2'])))
-        self.y = int(round(np.random.uniform(node['y1'], node['y2'])))
-        self.z = int(round(np.random.uniform(node['z1'], node['z2'])))
+        self.x = int(round(self.rng.uniform(node['x1'], node['x2'])))
+        self.y = int(round(self.rng.uniform(node['y1'], node['y2'])))
+        self.z = int(round(self.rng.uniform(node['z1'], node['z2'])))
 
         self.state = "normale"  # "normale", "allerta", "salvo"
         self.speed_normal = speed_normal
@@ -39,7 +40,7 @@ class User:
             "event": self.event
         }
 
-    def update_position(self, arcs, nodes, dt):
+    def update_position(self, arcs, nodes, dt, index=None):
         try:
             if self.state == "in_attesa_percorso":
                 # Utente fermo, non si muove finché non riceve percorso
@@ -48,7 +49,7 @@ class User:
 
             elif self.state == "allerta":
                 if self.evacuation_path:
-                    completed = self._move_along_path(arcs, nodes, dt)
+                    completed = self._move_along_path(arcs, nodes, dt, index)
                     return completed
                 else:
                     # In allerta ma senza percorso, utente fermo (o si può modificare se vuoi)
@@ -56,7 +57,7 @@ class User:
                     return False
             
             elif self.state == "normale":
-                self._move_free(arcs, nodes, dt)
+                self._move_free(arcs, nodes, dt, index)
                 return False
             
             else:
@@ -68,8 +69,10 @@ class User:
             logger.error(f"User {self.user_id} update_position error: {e}", exc_info=True)
             return False
 
-    def _get_adjacent_nodes(self, node_id, arcs):
+    def _get_adjacent_nodes(self, node_id, arcs, index=None):
         """Restituisce lista di nodi direttamente connessi a node_id"""
+        if index is not None:
+            return index.adjacent(node_id)
         node_id = int(node_id)
         adjacent = set()
         for arc in arcs:
@@ -79,32 +82,34 @@ class User:
                 adjacent.add(arc['initial_node'])
         return list(adjacent)
 
-    def _get_node_by_id(self, node_id, nodes):
+    def _get_node_by_id(self, node_id, nodes, index=None):
         """Restituisce il dizionario del nodo dato l'ID"""
+        if index is not None:
+            return index.node(node_id)
         for node in nodes:
             if node['node_id'] == node_id:
                 return node
         return None
 
 
-    def _move_free(self, arcs, nodes, dt):
+    def _move_free(self, arcs, nodes, dt, index=None):
         max_attempts = 10
         moved = False
 
         # Controlla se l'utente è bloccato da troppi tick
         if self.stuck_ticks >= 5:
             logger.debug(f"[FALLBACK_TRIGGER] User {self.user_id} stuck in node {self.current_node} for {self.stuck_ticks} ticks")
-            adjacent_nodes = self._get_adjacent_nodes(self.current_node, arcs)
-            random.shuffle(adjacent_nodes)
+            adjacent_nodes = self._get_adjacent_nodes(self.current_node, arcs, index)
+            self.rng.shuffle(adjacent_nodes)
 
             for adj_node in adjacent_nodes:
                 if (self.current_node, adj_node) in self.failed_directions:
                     continue
-                node_data = self._get_node_by_id(adj_node, nodes)
+                node_data = self._get_node_by_id(adj_node, nodes, index)
                 if node_data:
-                    self.x = int(round(np.random.uniform(node_data['x1'], node_data['x2'])))
-                    self.y = int(round(np.random.uniform(node_data['y1'], node_data['y2'])))
-                    self.z = int(round(np.random.uniform(node_data['z1'], node_data['z2'])))
+                    self.x = int(round(self.rng.uniform(node_data['x1'], node_data['x2'])))
+                    self.y = int(round(self.rng.uniform(node_data['y1'], node_data['y2'])))
+                    self.z = int(round(self.rng.uniform(node_data['z1'], node_data['z2'])))
                     self.current_node = adj_node
                     self.stuck_ticks = 0
                     self.prev_node_id = adj_node
@@ -114,15 +119,16 @@ class User:
             return
 
         for attempt in range(max_attempts):
-            dx = np.random.randint(-15, 16)
-            dy = np.random.randint(-15, 16)
-            dz = np.random.randint(-2, 3)
+            # int(): le estrazioni di Generator.integers sono numpy.int64, non serializzabili in JSON
+            dx = int(self.rng.integers(-15, 16))
+            dy = int(self.rng.integers(-15, 16))
+            dz = int(self.rng.integers(-2, 3))
 
             new_x = self.x + dx
             new_y = self.y + dy
             new_z = self.z + dz
 
-            target_node = self._find_containing_node(new_x, new_y, new_z, nodes)
+            target_node = self._find_containing_node(new_x, new_y, new_z, nodes, index)
 
             if target_node is not None:
                 self.x = new_x
@@ -135,11 +141,11 @@ class User:
 
             # A metà dei tentativi, prova a fare jitter nel nodo corrente
             if attempt == max_attempts // 2:
-                node_data = self._get_node_by_id(self.current_node, nodes)
+                node_data = self._get_node_by_id(self.current_node, nodes, index)
                 if node_data:
-                    self.x = int(round(np.random.uniform(node_data['x1'], node_data['x2'])))
-                    self.y = int(round(np.random.uniform(node_data['y1'], node_data['y2'])))
-                    self.z = int(round(np.random.uniform(node_data['z1'], node_data['z2'])))
+                    self.x = int(round(self.rng.uniform(node_data['x1'], node_data['x2'])))
+                    self.y = int(round(self.rng.uniform(node_data['y1'], node_data['y2'])))
+                    self.z = int(round(self.rng.uniform(node_data['z1'], node_data['z2'])))
                     self.current_node = self.current_node  # invariato
                     moved = True
                     logger.debug(f"User {self.user_id} jittered inside node {self.current_node}")
@@ -153,7 +159,9 @@ class User:
             self.prev_node_id = self.current_node
 
 
-    def _find_containing_node(self, x, y, z, nodes):
+    def _find_containing_node(self, x, y, z, nodes, index=None):
+        if index is not None:
+            return index.containing_node(x, y, z)
         for node in nodes:
             if node['x1'] <= x <= node['x2'] and \
             node['y1'] <= y <= node['y2'] and \
@@ -162,7 +170,9 @@ class User:
         return None
 
 
-    def _is_connected(self, node_a, node_b, arcs):
+    def _is_connected(self, node_a, node_b, arcs, index=None):
+        if index is not None:
+            return index.connected(node_a, node_b)
         node_a = int(node_a)
         node_b = int(node_b)
         for arc in arcs:
@@ -175,7 +185,9 @@ class User:
         logger.debug(f"[NO ARC] No connection between {node_a} and {node_b}")
         return False
 
-    def find_arc_by_id(self, arcs, arc_id):
+    def find_arc_by_id(self, arcs, arc_id, index=None):
+        if index is not None:
+            return index.arc(arc_id)
         for arc in arcs:
             if arc['arc_id'] == arc_id:
                 return arc
@@ -199,14 +211,14 @@ class User:
                 node['y1'] <= y <= node['y2'] and
                 node['z1'] <= z <= node['z2'])
 
-    def _move_along_path(self, arcs, nodes, dt):
+    def _move_along_path(self, arcs, nodes, dt, index=None):
         if not self.evacuation_path:
             logger.debug(f"User {self.user_id} evacuation_path vuota, utente già salvo o non in movimento")
             self.moving_along_arc = False
             return False
         
         current_arc_id = self.evacuation_path[0]
-        arc = self.find_arc_by_id(arcs, current_arc_id)
+        arc = self.find_arc_by_id(arcs, current_arc_id, index)
         
         if not self.moving_along_arc:
             self.moving_along_arc = True
@@ -266,7 +278,7 @@ class User:
         self.arc_progress = max(0.0, min(1.0, self.arc_progress))
 
         pos = self.position_along_arc(arc, self.arc_progress, reverse)
-        node = next(n for n in nodes if n['node_id'] == self.current_node)
+        node = self._get_node_by_id(self.current_node, nodes, index)
         if not self.is_position_inside_node(pos, node):
             # Correggo posizione fuori nodo
             pos = np.array([
@@ -294,7 +306,7 @@ class User:
             if self.evacuation_path:
                 # Posiziono utente sul nodo iniziale del prossimo arco
                 next_arc_id = self.evacuation_path[0]
-                next_arc = self.find_arc_by_id(arcs, next_arc_id)
+                next_arc = self.find_arc_by_id(arcs, next_arc_id, index)
                 if next_arc is None:
                     logger.warning(f"User {self.user_id} next arc {next_arc_id} not found")
                     return False
@@ -307,7 +319,7 @@ class User:
                     logger.warning(f"User {self.user_id} node {self.current_node} does not match next arc {next_arc_id}")
                     return False
 
-                node = next(n for n in nodes if n['node_id'] == self.current_node)
+                node = self._get_node_by_id(self.current_node, nodes, index)
                 if not self.is_position_inside_node(new_pos, node):
                     new_pos = np.array([
                         np.clip(new_pos[0], node['x1'], node['x2']),
@@ -319,7 +331,7 @@ class User:
             else:
                 # Percorso completato: posizione finale su nodo di arrivo (final_node)
                 final_node_id = self.current_node
-                final_node = next((n for n in nodes if n['node_id'] == final_node_id), None)
+                final_node = self._get_node_by_id(final_node_id, nodes, index)
                 if final_node:
                     # Posiziono esattamente al centro del nodo finale
                     self.x = (final_node['x1'] + final_node['x2']) / 2
@@ -0,0 +1,381 @@
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+from UserSimulator.utils.logger import logger
+
+# Codici di stato (stessi nomi degli stati di User)
+STATES = ("normale", "allerta", "in_attesa_percorso", "salvo")
+NORMALE, ALLERTA, IN_ATTESA, SALVO = range(len(STATES))
+STATE_CODES = {name: code for code, name in enumerate(STATES)}
+
+MAX_FREE_ATTEMPTS = 6     # come User._move_free: jitter nel nodo dopo il 6° tentativo fallito
+STUCK_TICKS = 5
+SNAP_THRESHOLD = 40.0
+
+
+class VectorEngine:
+    """
+    Motore di simulazione vettoriale: tutti gli utenti in forma structure-of-arrays
+    (x, y, z, nodo, stato, arco corrente, progresso, velocità, ...) e un tick che avanza
+    movimento libero e percorsi di evacuazione di tutti gli utenti con operazioni NumPy.
+
+    Stessa logica di User._move_free / User._move_along_path. Nodi, archi, adiacenza e griglia
+    uniforme x/y vengono dal MapIndex del Simulator, lo stesso usato dagli oggetti User: la
+    ricerca del nodo che contiene un punto costa O(K) (K = nodi per cella).
+
+    Gli indici interni (nodi, archi, utenti) sono posizioni negli array; verso l'esterno si
+    usano sempre node_id / arc_id / user_id tramite UserView.
+    """
+
+    def __init__(self, map_index, users, rng=None):
+        self.lock = threading.RLock()
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._use_map(map_index)
+        self._build_users(users)
+
+    # ---------- mappa ----------
+    def _use_map(self, map_index):
+        """Array di nodi, archi, adiacenza e griglia presi dal MapIndex condiviso (nessuna copia)."""
+        self.map = map_index
+        self.node_ids, self.node_index = map_index.node_ids, map_index.node_index
+        self.lo, self.hi = map_index.lo, map_index.hi
+        self.arc_index = map_index.arc_index
+        self.arc_ini, self.arc_fin = map_index.arc_ini, map_index.arc_fin
+        self.p1, self.p2, self.arc_len = map_index.p1, map_index.p2, map_index.arc_len
+        self.adj, self.adj_deg = map_index.adj, map_index.adj_deg
+
+    def locate(self, points):
+        """Indice del primo nodo che contiene ciascun punto, -1 se nessuno (vedi MapIndex.locate)."""
+        return self.map.locate(points)
+
+    def _uniform_in(self, node_idx):
+        """Punto casuale (arrotondato) nel box di ciascun nodo, come np.random.uniform su x/y/z."""
+        lo, hi = self.lo[node_idx], self.hi[node_idx]
+        return np.round(lo + self.rng.random(lo.shape) * (hi - lo))
+
+    # ---------- utenti ----------
+    def _build_users(self, users):
+        users = list(users)
+        n = len(users)
+        self.user_ids = np.array([u.user_id for u in users], dtype=np.int64)
+        self.user_index = {int(uid): i for i, uid in enumerate(self.user_ids)}
+        self.pos = np.array([[u.x, u.y, u.z] for u in users], dtype=np.float64).reshape(-1, 3)
+        self.node = np.array([self.node_index[u.current_node] for u in users], dtype=np.int64)
+        self.prev_node = np.array([self.node_index.get(u.prev_node_id, -1) for u in users], dtype=np.int64)
+        self.state = np.array([STATE_CODES.get(u.state, SALVO) for u in users], dtype=np.int8)
+        self.speed = np.array([u.speed for u in users], dtype=np.float64)
+        self.speed_normal = np.array([u.speed_normal for u in users], dtype=np.float64)
+        self.speed_alert = np.array([u.speed_alert for u in users], dtype=np.float64)
+        self.stuck = np.array([u.stuck_ticks for u in users], dtype=np.int64)
+        self.blocked = np.array([u.blocked for u in users], dtype=bool)
+        self.moving = np.zeros(n, dtype=bool)
+        self.progress = np.zeros(n, dtype=np.float64)
+        self.direction = np.ones(n, dtype=np.int8)
+        self.arc = np.full(n, -1, dtype=np.int64)          # arco corrente del percorso (-1 = nessuno)
+        self.paths = [[] for _ in range(n)]                # arc_id del percorso residuo
+        self.event = np.array([u.event for u in users], dtype=object)
+        for i, u in enumerate(users):
+            if u.evacuation_path:
+                self.set_path(i, u.evacuation_path)
+
+    def set_path(self, i, arc_ids):
+        with self.lock:
+            self.paths[i] = list(arc_ids)
+            self._refresh_arc(i)
+            self.moving[i] = False
+            self.blocked[i] = False
+
+    def _refresh_arc(self, i):
+        path = self.paths[i]
+        self.arc[i] = self.arc_index.get(int(path[0]), -1) if path else -1
+
+    def position_message(self, i):
+        x, y, z = self.pos[i]
+        return {
+            "user_id": int(self.user_ids[i]),
+            "x": int(round(x)),
+            "y": int(round(y)),
+            "z": int(round(z)),
+            "node_id": int(self.node_ids[self.node[i]]),
+            "event": self.event[i],
+        }
+
+    # ---------- tick ----------
+    def step(self, dt):
+        """
+        Avanza tutti gli utenti di dt secondi.
+
+        Returns:
+            tuple: (moved, blocked) maschere bool per utente, da usare per decidere cosa pubblicare.
+        """
+        with self.lock:
+            before = self.pos.copy()
+            self._move_free(np.flatnonzero(self.state == NORMALE))
+            self._move_along_paths(np.flatnonzero((self.state == ALLERTA) & (self.arc >= 0)), dt)
+            moved = np.any(self.pos != before, axis=1)
+            return moved, self.blocked.copy()
+
+    def _move_free(self, idx):
+        if not len(idx):
+            return
+        stuck = self.stuck[idx] >= STUCK_TICKS
+
+        # utenti bloccati da troppi tick: salto in un nodo adiacente a caso
+        fb = idx[stuck]
+        if len(fb):
+            deg = self.adj_deg[self.node[fb]]
+            fb = fb[deg > 0]
+            deg = deg[deg > 0]
+            if len(fb):
+                pick = (self.rng.random(len(fb)) * deg).astype(np.int64)
+                target = self.adj[self.node[fb], pick]
+                self.pos[fb] = self._uniform_in(target)
+                self.node[fb] = target
+                self.prev_node[fb] = target
+                self.stuck[fb] = 0
+
+        walkers = idx[~stuck]
+        pending = walkers
+        for _ in range(MAX_FREE_ATTEMPTS):
+            if not len(pending):
+                break
+            delta = np.column_stack((
+                self.rng.integers(-15, 16, size=len(pending)),
+                self.rng.integers(-15, 16, size=len(pending)),
+                self.rng.integers(-2, 3, size=len(pending)),
+            ))
+            candidate = self.pos[pending] + delta
+            found = self.locate(candidate)
+            ok = found >= 0
+            self.pos[pending[ok]] = candidate[ok]
+            self.node[pending[ok]] = found[ok]
+            pending = pending[~ok]
+        if len(pending):
+            # nessun punto valido: jitter dentro il nodo corrente
+            self.pos[pending] = self._uniform_in(self.node[pending])
+
+        same = self.node[walkers] == self.prev_node[walkers]
+        self.stuck[walkers[same]] += 1
+        changed = walkers[~same]
+        self.stuck[changed] = 0
+        self.prev_node[changed] = self.node[changed]
+
+    def _move_along_paths(self, idx, dt):
+        if not len(idx):
+            return
+        a = self.arc[idx]
+        ini, fin = self.arc_ini[a], self.arc_fin[a]
+        node = self.node[idx]
+
+        # partenza su un nuovo arco: direzione e progresso dal nodo corrente
+        start = ~self.moving[idx]
+        backward = start & (node == fin) & (node != ini)
+        self.direction[idx[start]] = 1
+        self.progress[idx[start]] = 0.0
+        self.direction[idx[backward]] = -1
+        self.progress[idx[backward]] = 1.0
+        self.moving[idx] = True
+
+        # nodo corrente non estremo dell'arco: aggancio all'estremo più vicino o utente bloccato
+        off = (node != ini) & (node != fin)
+        if off.any():
+            d1 = np.linalg.norm(self.pos[idx] - self.p1[a], axis=1)
+            d2 = np.linalg.norm(self.pos[idx] - self.p2[a], axis=1)
+            snap = off & (np.minimum(d1, d2) < SNAP_THRESHOLD)
+            node = np.where(snap, np.where(d1 < d2, ini, fin), node)
+            self.node[idx] = node
+            stuck = off & ~snap
+            self.blocked[idx[stuck]] = True
+            keep = ~stuck & (self.arc_len[a] > 0)
+        else:
+            keep = self.arc_len[a] > 0
+        self.moving[idx[~keep]] = False
+        idx, a, ini, fin, node = idx[keep], a[keep], ini[keep], fin[keep], node[keep]
+        if not len(idx):
+            return
+
+        reverse = node == fin
+        direction = np.where(reverse, -1, 1)
+        self.direction[idx] = direction
+        progress = np.clip(self.progress[idx] + self.speed[idx] * dt / self.arc_len[a] * direction, 0.0, 1.0)
+        self.progress[idx] = progress
+
+        p_start = np.where(reverse[:, None], self.p2[a], self.p1[a])
+        p_end = np.where(reverse[:, None], self.p1[a], self.p2[a])
+        pos = p_start + progress[:, None] * (p_end - p_start)
+        pos = np.clip(pos, self.lo[node], self.hi[node])
+        self.pos[idx] = np.round(pos)
+        self.blocked[idx] = False
+
+        done = ((direction == 1) & (progress >= 1.0)) | ((direction == -1) & (progress <= 0.0))
+        for i, arrived in zip(idx[done].tolist(), np.where(direction[done] == 1, fin[done], ini[done]).tolist()):
+            self._complete_arc(i, arrived)
+
+    def _complete_arc(self, i, arrived):
+        """Fine arco: passa al successivo (posizione sull'estremo) o segna l'utente come salvo."""
+        self.node[i] = arrived
+        self.paths[i].pop(0)
+        self.moving[i] = False
+        self.progress[i] = 0.0
+        self._refresh_arc(i)
+        if self.paths[i]:
+            nxt = self.arc[i]
+            if nxt < 0:
+                logger.warning(f"User {self.user_ids[i]} next arc {self.paths[i][0]} not found")
+                return
+            if arrived == self.arc_ini[nxt]:
+                point = self.p1[nxt]
+            elif arrived == self.arc_fin[nxt]:
+                point = self.p2[nxt]
+            else:
+                logger.warning(f"User {self.user_ids[i]} node {self.node_ids[arrived]} does not match next arc {self.paths[i][0]}")
+                return
+            self.pos[i] = np.clip(point, self.lo[arrived], self.hi[arrived])
+            return
+        self.pos[i] = (self.lo[arrived] + self.hi[arrived]) / 2
+        logger.info(f"User {self.user_ids[i]} reached end of evacuation path at node {self.node_ids[arrived]}")
+        self.mark_as_salvo(i)
+
+    def mark_as_salvo(self, i):
+        with self.lock:
+            if self.state[i] == SALVO:
+                return
+            self.paths[i] = []
+            self.arc[i] = -1
+            self.moving[i] = False
+            self.progress[i] = 0.0
+            self.state[i] = SALVO
+            self.speed[i] = 0
+
+
+class UserView:
+    """
+    Vista di un utente del VectorEngine con la stessa interfaccia di User usata da Simulator,
+    RabbitMQHandler e API (stato, posizione, percorso, get_position_message, ...).
+    """
+
+    def __init__(self, engine, index):
+        self._engine = engine
+        self._i = index
+
+    @property
+    def user_id(self):
+        return int(self._engine.user_ids[self._i])
+
+    @property
+    def x(self):
+        return float(self._engine.pos[self._i, 0])
+
+    @x.setter
+    def x(self, value):
+        self._engine.pos[self._i, 0] = value
+
+    @property
+    def y(self):
+        return float(self._engine.pos[self._i, 1])
+
+    @y.setter
+    def y(self, value):
+        self._engine.pos[self._i, 1] = value
+
+    @property
+    def z(self):
+        return float(self._engine.pos[self._i, 2])
+
+    @z.setter
+    def z(self, value):
+        self._engine.pos[self._i, 2] = value
+
+    @property
+    def current_node(self):
+        return int(self._engine.node_ids[self._engine.node[self._i]])
+
+    @property
+    def state(self):
+        return STATES[self._engine.state[self._i]]
+
+    @state.setter
+    def state(self, value):
+        self._engine.state[self._i] = STATE_CODES[value]
+
+    @property
+    def speed(self):
+        return float(self._engine.speed[self._i])
+
+    @speed.setter
+    def speed(self, value):
+        self._engine.speed[self._i] = value
+
+    @property
+    def speed_normal(self):
+        return float(self._engine.speed_normal[self._i])
+
+    @property
+    def speed_alert(self):
+        return float(self._engine.speed_alert[self._i])
+
+    @property
+    def event(self):
+        return self._engine.event[self._i]
+
+    @event.setter
+    def event(self, value):
+        self._engine.event[self._i] = value
+
+    @property
+    def blocked(self):
+        return bool(self._engine.blocked[self._i])
+
+    @property
+    def evacuation_path(self):
+        return self._engine.paths[self._i]
+
+    def get_position_message(self):
+        return self._engine.position_message(self._i)
+
+    def mark_as_salvo(self):
+        if self.state != "salvo":
+            self._engine.mark_as_salvo(self._i)
+            logger.info(f"User {self.user_id} evacuation completed, state set to SALVO")
+
+    def set_evacuation_path(self, new_path):
+        with self._engine.lock:
+            if new_path != self.evacuation_path:
+                logger.info(f"User {self.user_id} received new evacuation path: {new_path}")
+                self._engine.set_path(self._i, new_path)
+                if self.state != "allerta":
+                    self.state = "allerta"
+                    self.speed = self.speed_alert
+                    logger.info(f"User {self.user_id} state changed to ALLERTA")
+
+    def set_state(self, new_state):
+        with self._engine.lock:
+            if new_state != self.state:
+                self.state = new_state
+                self.speed = self.speed_alert if new_state == "allerta" else self.speed_normal
+                logger.info(f"User {self.user_id} state changed to {new_state.upper()}")
+                if new_state == "salvo":
+                    self._engine.paths[self._i] = []
+                    self._engine.arc[self._i] = -1
+                    self._engine.moving[self._i] = False
+                    self._engine.progress[self._i] = 0.0
+
+
+class PositionsView(Mapping):
+    """
+    Sostituto di Simulator.users_positions per il motore vettoriale: i messaggi di posizione
+    vengono costruiti solo quando letti (API /positions) invece che per ogni utente a ogni tick.
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def __getitem__(self, user_id):
+        return self._engine.position_message(self._engine.user_index[user_id])
+
+    def __iter__(self):
+        return iter(self._engine.user_ids.tolist())
+
+    def __len__(self):
+        return len(self._engine.user_ids)
@@ -0,0 +1,26 @@
+def build_grid_map(rows=6, cols=6, size=100, floors=1):
+    """
+    Mappa sintetica: stanze quadrate affiancate (i bordi coincidono, come nodi adiacenti reali)
+    e un arco tra i centri di ogni coppia di stanze vicine.
+    """
+    nodes, arcs = [], []
+    for f in range(floors):
+        for r in range(rows):
+            for c in range(cols):
+                nodes.append({
+                    "node_id": 1000 * f + r * cols + c, "node_type": "classroom",
+                    "x1": c * size, "x2": (c + 1) * size, "y1": r * size, "y2": (r + 1) * size,
+                    "z1": f * 10, "z2": f * 10 + 5,
+                })
+    centers = {n["node_id"]: ((n["x1"] + n["x2"]) // 2, (n["y1"] + n["y2"]) // 2, n["z1"]) for n in nodes}
+    for f in range(floors):
+        for r in range(rows):
+            for c in range(cols):
+                a = 1000 * f + r * cols + c
+                for b in ([a + 1] if c + 1 < cols else []) + ([a + cols] if r + 1 < rows else []):
+                    (x1, y1, z1), (x2, y2, z2) = centers[a], centers[b]
+                    arcs.append({
+                        "arc_id": len(arcs) + 1, "initial_node": a, "final_node": b,
+                        "x1": x1, "y1": y1, "z1": z1, "x2": x2, "y2": y2, "z2": z2,
+                    })
+    return nodes, arcs
@@ -0,0 +1,43 @@
+import numpy as np
+
+from UserSimulator.simulation.map_index import MapIndex
+from UserSimulator.test.grid_map import build_grid_map
+
+
+def _linear_scan(nodes, x, y, z):
+    """Stessa scansione di User._find_containing_node senza indice."""
+    for node in nodes:
+        if node['x1'] <= x <= node['x2'] and node['y1'] <= y <= node['y2'] and node['z1'] <= z <= node['z2']:
+            return node['node_id']
+    return None
+
+
+def test_containing_node_matches_linear_scan():
+    nodes, arcs = build_grid_map(rows=5, cols=7, floors=2)
+    # un nodo che si sovrappone ad altri: vince sempre il primo della lista
+    nodes.append({"node_id": 9999, "node_type": "corridor", "x1": 150, "x2": 420, "y1": 40, "y2": 260, "z1": 0, "z2": 5})
+    index = MapIndex(nodes, arcs)
+
+    rng = np.random.default_rng(0)
+    points = np.column_stack((
+        rng.integers(-60, 760, 3000), rng.integers(-60, 560, 3000), rng.integers(-3, 18, 3000)
+    ))
+    # anche i bordi condivisi tra stanze
+    points = np.vstack((points, [[100, 100, 0], [0, 0, 0], [700, 500, 15], [200, 250, 5]]))
+
+    expected = [_linear_scan(nodes, *p) for p in points.tolist()]
+    assert [index.containing_node(*p) for p in points.tolist()] == expected
+
+    rows = index.locate(points)
+    assert [None if r < 0 else int(index.node_ids[r]) for r in rows] == expected
+
+
+def test_adjacency_and_lookups():
+    nodes, arcs = build_grid_map()
+    index = MapIndex(nodes, arcs)
+    assert sorted(index.adjacent(7)) == [1, 6, 8, 13]
+    assert index.connected(7, 8) and index.connected(8, 7) and not index.connected(7, 14)
+    assert index.node(7) is nodes[7]
+    assert index.arc(arcs[3]["arc_id"]) is arcs[3]
+    row = index.node_index[7]
+    assert sorted(index.node_ids[index.adj[row, :index.adj_deg[row]]].tolist()) == [1, 6, 8, 13]
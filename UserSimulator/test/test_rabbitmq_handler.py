@@ -0,0 +1,43 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from UserSimulator.rabbitmq.rabbitmq_handler import RabbitMQHandler
+
+
+def _handler(monkeypatch, queue_size=1, timeout=0.05, close_timeout=1.0):
+    """Handler con un publisher fermo (broker irraggiungibile): la coda non viene mai svuotata."""
+    monkeypatch.setattr(RabbitMQHandler, "_start_publisher", lambda self: None)
+    config = SimpleNamespace(
+        rabbitmq={"publish_queue_size": queue_size, "publish_timeout": timeout, "close_timeout": close_timeout},
+        wire_format="json", publish_batch_size=2,
+    )
+    handler = RabbitMQHandler(config, simulator=None)
+    stalled = threading.Event()
+    handler._publisher_thread = threading.Thread(target=stalled.wait, daemon=True)
+    handler._publisher_thread.start()
+    return handler, stalled
+
+
+def test_publish_drops_instead_of_blocking_on_full_queue(monkeypatch):
+    handler, stalled = _handler(monkeypatch)
+    position = {"user_id": 1, "x": 1, "y": 2, "z": 3, "node_id": 4, "event": None}
+
+    start = time.monotonic()
+    handler.publish_position(position)
+    handler.publish_position(position)                       # coda piena: scartato
+    handler.publish_positions([position] * 6)                # 3 messaggi, tutti scartati
+    assert time.monotonic() - start < 1.0
+    assert handler._publish_queue.qsize() == 1
+    stalled.set()
+
+
+def test_close_does_not_block_on_full_queue(monkeypatch):
+    handler, stalled = _handler(monkeypatch, timeout=0.05, close_timeout=0.2)
+    handler.publish_position({"user_id": 1, "x": 1, "y": 2, "z": 3, "node_id": 4, "event": None})
+
+    start = time.monotonic()
+    handler.close()
+    assert time.monotonic() - start < 1.0
+    assert handler._publisher_thread is None
+    stalled.set()
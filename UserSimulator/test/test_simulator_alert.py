@@ -0,0 +1,58 @@
+import json
+from datetime import time
+from types import SimpleNamespace
+
+from common.position_codec import encode_positions
+from UserSimulator.simulation import simulator as simulator_module
+from UserSimulator.simulation.simulator import Simulator
+from UserSimulator.simulation.user import User
+from UserSimulator.test.grid_map import build_grid_map
+
+
+class _Publisher:
+    """Codifica i messaggi come RabbitMQHandler.publish_positions (wire format json)."""
+
+    def __init__(self):
+        self.bodies = []
+
+    def publish_positions(self, positions):
+        body, _ = encode_positions(positions, "json")
+        self.bodies.append(body)
+
+
+def test_alert_after_free_move_is_json_encodable():
+    nodes, arcs = build_grid_map(rows=3, cols=3)
+    publisher = _Publisher()
+    config = SimpleNamespace(seed=11, virtual_time=False)
+    sim = Simulator(config, nodes, arcs, publisher=publisher)
+    for uid in range(20):
+        sim.users[uid] = User(uid, nodes[uid % len(nodes)], 10, 20, rng=sim._user_rng(uid))
+
+    for user in sim.users.values():
+        user.update_position(arcs, nodes, 1.0, sim.map_index)   # movimento libero
+        assert all(type(v) is int for v in (user.x, user.y, user.z))
+
+    sim.handle_alert({"info": [{"event": "fire"}]})
+    assert publisher.bodies
+    sent = [p for body in publisher.bodies for p in json.loads(body)]
+    assert {p["user_id"] for p in sent} == set(sim.users)
+    assert all(p["event"] == "fire" for p in sent)
+
+
+def test_virtual_time_run_yields_every_tick_and_stops_at_the_limit(monkeypatch):
+    nodes, arcs = build_grid_map(rows=2, cols=2)
+    config = SimpleNamespace(
+        seed=1, virtual_time=True, virtual_start="09:00", _parse_time=lambda _s: time(9, 0),
+        simulation_tick=1.0, max_simulated_seconds=3, engine="classic",
+    )
+    sim = Simulator(config, nodes, arcs)
+    ticks = []
+    monkeypatch.setattr(sim, "initialize_users", lambda: None)
+    monkeypatch.setattr(sim, "tick", lambda: ticks.append(sim.now()))
+    sleeps = []
+    monkeypatch.setattr(simulator_module.time, "sleep", sleeps.append)
+
+    sim.run()
+    assert len(ticks) == 3 and not sim.running
+    # nessuna attesa reale, ma il GIL viene ceduto a ogni tick non finale
+    assert sleeps == [0, 0]
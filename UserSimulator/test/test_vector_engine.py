@@ -0,0 +1,71 @@
+import copy
+
+import numpy as np
+
+from UserSimulator.simulation.map_index import MapIndex
+from UserSimulator.simulation.user import User
+from UserSimulator.simulation.vector_engine import STATES, UserView, VectorEngine
+from UserSimulator.test.grid_map import build_grid_map
+
+
+def _random_path(index, arc_between, start, length, rng):
+    """Percorso (lista di arc_id) lungo un cammino casuale senza ripetere nodi, archi percorsi in entrambi i versi."""
+    path, node, seen = [], start, {start}
+    for _ in range(length):
+        options = sorted(n for n in index.adjacent(node) if n not in seen)
+        if not options:
+            break
+        nxt = options[rng.integers(len(options))]
+        path.append(arc_between[frozenset((node, nxt))])
+        seen.add(nxt)
+        node = nxt
+    return path
+
+
+def test_step_matches_user_along_paths():
+    nodes, arcs = build_grid_map(rows=6, cols=6)
+    index = MapIndex(nodes, arcs)
+    arc_between = {frozenset((a['initial_node'], a['final_node'])): a['arc_id'] for a in arcs}
+    rng = np.random.default_rng(7)
+
+    users = []
+    for uid in range(60):
+        node = nodes[rng.integers(len(nodes))]
+        user = User(uid, node, speed_normal=8, speed_alert=float(rng.integers(15, 70)), rng=np.random.default_rng(uid))
+        users.append(user)
+    engine = VectorEngine(index, [copy.deepcopy(u) for u in users], rng=np.random.default_rng(0))
+
+    for i, user in enumerate(users):
+        path = _random_path(index, arc_between, user.current_node, int(rng.integers(1, 8)), rng)
+        user.set_evacuation_path(path)
+        UserView(engine, i).set_evacuation_path(path)
+
+    for _ in range(120):
+        for user in users:
+            user.update_position(arcs, nodes, 1.0, index)
+        engine.step(1.0)
+        for i, user in enumerate(users):
+            assert engine.position_message(i) == user.get_position_message()
+            assert engine.paths[i] == user.evacuation_path
+            assert STATES[engine.state[i]] == user.state
+    assert all(user.state == "salvo" for user in users)
+
+
+def test_free_movement_stays_inside_the_map():
+    nodes, arcs = build_grid_map(rows=4, cols=5)
+    index = MapIndex(nodes, arcs)
+    users = [User(uid, nodes[uid % len(nodes)], 10, 20, rng=np.random.default_rng(uid)) for uid in range(80)]
+    engine = VectorEngine(index, users, rng=np.random.default_rng(3))
+
+    for _ in range(50):
+        before_pos, before_node = engine.pos.copy(), engine.node.copy()
+        engine.step(1.0)
+        node = engine.node
+        # ogni utente è dentro il box del nodo che il motore gli attribuisce
+        assert np.all((index.lo[node] <= engine.pos) & (engine.pos <= index.hi[node]))
+        # passo libero (come User._move_free): spostamento di al più (15, 15, 2) nel primo nodo
+        # che contiene il punto, oppure jitter / salto nel nodo corrente o in uno adiacente
+        step = np.all(np.abs(engine.pos - before_pos) <= [15, 15, 2], axis=1) & (index.locate(engine.pos) == node)
+        for i in np.flatnonzero(~step).tolist():
+            a, b = int(index.node_ids[before_node[i]]), int(index.node_ids[node[i]])
+            assert a == b or index.connected(a, b)
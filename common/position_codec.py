@@ -0,0 +1,144 @@
+"""
+Codifica dei messaggi di posizione su position_queue (UserSimulator -> PositionManager),
+condivisa dai due servizi.
+
+Il formato è indicato dal `content_type` AMQP del messaggio:
+  - application/json (o assente): un oggetto JSON con una posizione, oppure una lista di posizioni
+  - application/x-position-batch: envelope binario con molte posizioni
+
+Envelope binario (little-endian):
+    header   : version (B), numero di eventi (B)
+    eventi   : per ciascuno lunghezza (B) + nome UTF-8; il codice evento è l'indice in questa tabella
+    count    : numero di posizioni (I)
+    record   : user_id, x, y, z, node_id (5 x int32) + codice evento (B), 21 byte per posizione
+node_id = -1 e codice evento 255 rappresentano None.
+"""
+import json
+import struct
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-position-batch"
+
+WIRE_FORMATS = {"json": JSON_CONTENT_TYPE, "binary": BINARY_CONTENT_TYPE}
+
+_VERSION = 1
+_HEADER = struct.Struct("<BB")
+_COUNT = struct.Struct("<I")
+_RECORD = struct.Struct("<iiiiiB")
+_USER_ID = struct.Struct("<i")  # primo campo di ogni record
+_NO_NODE = -1
+_NO_EVENT = 255
+
+
+def content_type_for(wire_format):
+    try:
+        return WIRE_FORMATS[(wire_format or "json").lower()]
+    except KeyError:
+        raise ValueError(f"Unknown wire format '{wire_format}' (expected one of {sorted(WIRE_FORMATS)})")
+
+
+def encode_positions(positions, wire_format="json"):
+    """
+    Codifica una o più posizioni (dict con user_id, x, y, z, node_id, event).
+
+    Returns:
+        tuple: (body, content_type) da usare in basic_publish.
+    """
+    content_type = content_type_for(wire_format)
+    if content_type == JSON_CONTENT_TYPE:
+        payload = positions[0] if len(positions) == 1 else list(positions)
+        return json.dumps(payload), content_type
+
+    events = []
+    codes = {}
+    for p in positions:
+        event = p.get("event")
+        if event is not None and event not in codes:
+            codes[event] = len(events)
+            events.append(event)
+    if len(events) >= _NO_EVENT:
+        raise ValueError(f"Too many distinct events in one batch: {len(events)}")
+
+    parts = [_HEADER.pack(_VERSION, len(events))]
+    for event in events:
+        name = str(event).encode("utf-8")[:255]
+        parts.append(bytes((len(name),)) + name)
+    parts.append(_COUNT.pack(len(positions)))
+    for p in positions:
+        node_id = p.get("node_id")
+        event = p.get("event")
+        parts.append(_RECORD.pack(
+            int(p["user_id"]),
+            int(round(p["x"])), int(round(p["y"])), int(round(p["z"])),
+            _NO_NODE if node_id is None else int(node_id),
+            _NO_EVENT if event is None else codes[event],
+        ))
+    return b"".join(parts), content_type
+
+
+def decode_positions(body, content_type=None):
+    """
+    Decodifica il body di un messaggio di position_queue.
+
+    Returns:
+        list: dict con user_id, x, y, z, node_id, event (nell'ordine in cui sono stati codificati).
+    """
+    if content_type != BINARY_CONTENT_TYPE:
+        data = json.loads(body)
+        return data if isinstance(data, list) else [data]
+
+    version, n_events = _HEADER.unpack_from(body, 0)
+    if version != _VERSION:
+        raise ValueError(f"Unsupported position batch version {version}")
+    offset = _HEADER.size
+    events = []
+    for _ in range(n_events):
+        length = body[offset]
+        events.append(bytes(body[offset + 1:offset + 1 + length]).decode("utf-8"))
+        offset += 1 + length
+    (count,) = _COUNT.unpack_from(body, offset)
+    offset += _COUNT.size
+    end = offset + count * _RECORD.size
+    if len(body) < end:
+        raise ValueError(f"Truncated position batch: {count} records announced, {len(body)} bytes")
+
+    return [
+        {
+            "user_id": user_id, "x": x, "y": y, "z": z,
+            "node_id": None if node_id == _NO_NODE else node_id,
+            "event": None if code == _NO_EVENT else events[code],
+        }
+        for user_id, x, y, z, node_id, code in _RECORD.iter_unpack(body[offset:end])
+    ]
+
+
+def split_records(body):
+    """
+    Divide un envelope binario nei record grezzi senza decodificarli.
+
+    Returns:
+        tuple: (prefix, records) con prefix = header + tabella eventi e records = lista di
+        (user_id, record di 21 byte), da ricomporre con join_records.
+    """
+    version, n_events = _HEADER.unpack_from(body, 0)
+    if version != _VERSION:
+        raise ValueError(f"Unsupported position batch version {version}")
+    offset = _HEADER.size
+    for _ in range(n_events):
+        offset += 1 + body[offset]
+    prefix = bytes(body[:offset])
+    (count,) = _COUNT.unpack_from(body, offset)
+    offset += _COUNT.size
+    end = offset + count * _RECORD.size
+    if len(body) < end:
+        raise ValueError(f"Truncated position batch: {count} records announced, {len(body)} bytes")
+
+    return prefix, [
+        (_USER_ID.unpack_from(body, start)[0], bytes(body[start:start + _RECORD.size]))
+        for start in range(offset, end, _RECORD.size)
+    ]
+
+
+def join_records(prefix, records):
+    """Ricompone un envelope binario da un prefix di split_records e dai suoi record grezzi."""
+    return b"".join((prefix, _COUNT.pack(len(records)), *records))
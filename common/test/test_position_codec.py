@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from common.position_codec import (
+    BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, content_type_for, decode_positions, encode_positions,
+    join_records, split_records
+)
+
+POSITIONS = [
+    {"user_id": 1, "x": 120, "y": -40, "z": 0, "node_id": 7, "event": "Earthquake"},
+    {"user_id": 2, "x": 0, "y": 15, "z": 3, "node_id": None, "event": None},
+    {"user_id": 3, "x": 999, "y": 1, "z": 1, "node_id": 8, "event": "Fire"},
+    {"user_id": 4, "x": 5, "y": 5, "z": 2, "node_id": 9, "event": "Earthquake"},
+]
+
+
+@pytest.mark.parametrize("wire_format", ["json", "binary"])
+def test_round_trip(wire_format):
+    body, content_type = encode_positions(POSITIONS, wire_format)
+    assert content_type == content_type_for(wire_format)
+    assert decode_positions(body, content_type) == POSITIONS
+
+
+@pytest.mark.parametrize("wire_format", ["json", "binary"])
+def test_single_position_round_trip(wire_format):
+    body, content_type = encode_positions(POSITIONS[:1], wire_format)
+    assert decode_positions(body, content_type) == POSITIONS[:1]
+
+
+def test_json_single_position_stays_a_plain_object():
+    body, content_type = encode_positions(POSITIONS[:1], "json")
+    assert content_type == JSON_CONTENT_TYPE
+    assert json.loads(body) == POSITIONS[0]
+    # i messaggi senza content_type sono JSON
+    assert decode_positions(body, None) == POSITIONS[:1]
+
+
+def test_binary_rounds_coordinates_and_is_smaller():
+    floats = [dict(p, x=p["x"] + 0.4) for p in POSITIONS]
+    body, content_type = encode_positions(floats, "binary")
+    assert content_type == BINARY_CONTENT_TYPE
+    assert decode_positions(body, content_type) == POSITIONS
+    assert len(body) < len(encode_positions(POSITIONS, "json")[0])
+
+
+def test_split_and_join_records_without_decoding():
+    body, _ = encode_positions(POSITIONS, "binary")
+    prefix, records = split_records(body)
+    assert [user_id for user_id, _raw in records] == [1, 2, 3, 4]
+    assert join_records(prefix, [raw for _uid, raw in records]) == body
+    # un sottoinsieme dei record resta un envelope valido con la stessa tabella eventi
+    odd = join_records(prefix, [raw for user_id, raw in records if user_id % 2])
+    assert decode_positions(odd, BINARY_CONTENT_TYPE) == [POSITIONS[0], POSITIONS[2]]
+
+
+def test_truncated_binary_batch_is_rejected():
+    body, content_type = encode_positions(POSITIONS, "binary")
+    with pytest.raises(ValueError):
+        decode_positions(body[:-5], content_type)
+
+
+def test_unknown_wire_format():
+    with pytest.raises(ValueError):
+        encode_positions(POSITIONS, "xml")